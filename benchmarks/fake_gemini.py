@@ -0,0 +1,81 @@
+import json
+import random
+import re
+import threading
+import time
+
+
+class FakeGeminiError(Exception):
+    def __init__(self, code, message):
+        super().__init__(f"{code} {message}")
+        self.code = code
+
+
+class FakeUsage:
+    def __init__(self, prompt_tokens, output_tokens):
+        self.prompt_token_count = prompt_tokens
+        self.candidates_token_count = output_tokens
+        self.total_token_count = prompt_tokens + output_tokens
+
+
+class FakeResponse:
+    def __init__(self, text, prompt_tokens, output_tokens):
+        self.text = text
+        self.usage_metadata = FakeUsage(prompt_tokens, output_tokens)
+
+
+class FakeModels:
+    def __init__(self, owner):
+        self.owner = owner
+
+    def generate_content(self, model, contents, config=None):
+        return self.owner.generate(model, contents)
+
+
+class FakeGenaiClient:
+    """
+    Offline stand-in for google.genai.Client: same `models.generate_content`
+    surface, configurable latency and 429 rate, deterministic HTML output
+    that contains the link requested in the prompt. Batch prompts get a JSON
+    array back (malformed with probability `malformed_rate`).
+    """
+
+    def __init__(self, latency=0.2, rate_limit_rate=0.0, words=600, seed=None, malformed_rate=0.0):
+        self.latency = latency
+        self.rate_limit_rate = rate_limit_rate
+        self.malformed_rate = malformed_rate
+        self.words = words
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.calls = 0
+        self.models = FakeModels(self)
+
+    def generate(self, model, prompt):
+        with self.lock:
+            self.calls += 1
+            roll = self.rng.random()
+        time.sleep(self.latency)
+        if roll < self.rate_limit_rate:
+            raise FakeGeminiError(429, "RESOURCE_EXHAUSTED")
+        if 'Briefs:' in prompt:
+            return self._batch(prompt, roll)
+        link = ''
+        if 'Include a natural link to "' in prompt:
+            target = prompt.split('Include a natural link to "', 1)[1].split('"', 1)[0]
+            anchor = prompt.split('with anchor text "', 1)[1].split('"', 1)[0]
+            link = f'<a href="{target}">{anchor}</a>'
+        text = self._article(link)
+        return FakeResponse(text, len(prompt) // 3, len(text) // 3)
+
+    def _article(self, link):
+        body = ' '.join(['текст'] * self.words)
+        return f"<h1>Статья</h1><p>{body}</p><p>{link}</p>"
+
+    def _batch(self, prompt, roll):
+        briefs = re.findall(r'Link: "([^"]*)"\s*Anchor text: "([^"]*)"', prompt)
+        articles = [{'id': i, 'html': self._article(f'<a href="{target}">{anchor}</a>')}
+                    for i, (target, anchor) in enumerate(briefs, 1)]
+        text = json.dumps(articles, ensure_ascii=False)
+        if roll > 1 - self.malformed_rate:
+            text = text[:len(text) // 2]
+        return FakeResponse(text, len(prompt) // 3, len(text) // 3)
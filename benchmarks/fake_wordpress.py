@@ -0,0 +1,216 @@
+import base64
+import json
+import random
+import threading
+import time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+class FakeWordPressServer(ThreadingHTTPServer):
+    """
+    Minimal local stand-in for the WordPress REST API.
+
+    Serves /wp-json/, /wp-json/wp/v2/users/me and /wp-json/wp/v2/posts
+    (list with paging and modified_after, get, create, update) with
+    configurable latency, error rate and 429 rate. Counts accepted TCP
+    connections so keep-alive reuse can be measured.
+    """
+    daemon_threads = True
+    request_queue_size = 256
+
+    def __init__(self, port=0, latency=0.05, error_rate=0.0, rate_limit_rate=0.0,
+                 seed_posts=0, login='admin', app_password='xxxx xxxx xxxx xxxx', rng_seed=None):
+        super().__init__(('127.0.0.1', port), FakeWordPressHandler)
+        self.latency = latency
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.auth = 'Basic ' + base64.b64encode(f"{login}:{app_password}".encode()).decode()
+        self.rng = random.Random(rng_seed)
+        self.lock = threading.Lock()
+        self.posts = {}
+        self.next_id = 1
+        self.connections = 0
+        self.requests = 0
+        self.status_counts = {}
+        for i in range(seed_posts):
+            self.create_post(f"Архивная статья {i}: финансы, инвестиции и бюджет",
+                             f"<p>Старый текст номер {i} про деньги и сбережения.</p>")
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def get_request(self):
+        conn = super().get_request()
+        with self.lock:
+            self.connections += 1
+        return conn
+
+    def create_post(self, title, content, status='publish'):
+        with self.lock:
+            post_id = self.next_id
+            self.next_id += 1
+            self.posts[post_id] = {
+                'id': post_id,
+                'link': f"{self.url}/?p={post_id}",
+                'status': status,
+                'modified': datetime.now().strftime('%Y-%m-%dT%H:%M:%S'),
+                'title': {'raw': title, 'rendered': title},
+                'excerpt': {'rendered': content[:200]},
+                'content': {'raw': content, 'rendered': content},
+            }
+            return self.posts[post_id]
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, name="fake-wordpress", daemon=True).start()
+        return self
+
+    def stats(self):
+        with self.lock:
+            return {'connections': self.connections, 'requests': self.requests,
+                    'posts': len(self.posts), 'status_counts': dict(self.status_counts)}
+
+
+class FakeWordPressHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, code, payload, headers=None):
+        body = json.dumps(payload, ensure_ascii=False).encode()
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json; charset=UTF-8')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+        with self.server.lock:
+            self.server.status_counts[code] = self.server.status_counts.get(code, 0) + 1
+
+    def _body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return json.loads(self.rfile.read(length) or b'{}')
+
+    def _preamble(self):
+        """
+        Applies latency and injected failures. Returns False if a response was already sent.
+        """
+        server = self.server
+        with server.lock:
+            server.requests += 1
+            roll = server.rng.random()
+        time.sleep(server.latency)
+        if roll < server.rate_limit_rate:
+            self._send(429, {'code': 'rate_limited'}, {'Retry-After': '1'})
+            return False
+        if roll < server.rate_limit_rate + server.error_rate:
+            self._send(500, {'code': 'internal_server_error'})
+            return False
+        return True
+
+    def _authorized(self):
+        if self.headers.get('Authorization') != self.server.auth:
+            self._send(401, {'code': 'rest_not_logged_in'})
+            return False
+        return True
+
+    def _post_id(self, path):
+        tail = path.rstrip('/').rsplit('/', 1)[-1]
+        return int(tail) if tail.isdigit() else None
+
+    def do_GET(self):
+        if not self._preamble():
+            return
+        url = urlparse(self.path)
+        query = {k: v[0] for k, v in parse_qs(url.query).items()}
+        if url.path.rstrip('/') == '/wp-json':
+            return self._send(200, {'name': 'Fake WordPress', 'namespaces': ['wp/v2']})
+        if url.path == '/wp-json/wp/v2/users/me':
+            if self._authorized():
+                self._send(200, {'id': 1, 'name': 'admin'})
+            return
+        post_id = self._post_id(url.path)
+        if post_id is not None:
+            post = self.server.posts.get(post_id)
+            return self._send(200, post) if post else self._send(404, {'code': 'rest_post_invalid_id'})
+        if url.path == '/wp-json/wp/v2/posts':
+            with self.server.lock:
+                posts = sorted(self.server.posts.values(), key=lambda p: p['modified'])
+            if 'modified_after' in query:
+                posts = [p for p in posts if p['modified'] > query['modified_after']]
+            if 'search' in query:
+                posts = [p for p in posts if query['search'].lower() in p['title']['raw'].lower()]
+            per_page = int(query.get('per_page', 10))
+            page = int(query.get('page', 1))
+            total_pages = max(1, -(-len(posts) // per_page))
+            chunk = posts[(page - 1) * per_page:page * per_page]
+            fields = query.get('_fields')
+            if fields:
+                keep = fields.split(',')
+                chunk = [{k: p[k] for k in keep if k in p} for p in chunk]
+            return self._send(200, chunk, {'X-WP-Total': str(len(posts)), 'X-WP-TotalPages': str(total_pages)})
+        self._send(404, {'code': 'rest_no_route'})
+
+    def do_POST(self):
+        if not self._preamble() or not self._authorized():
+            return
+        url = urlparse(self.path)
+        data = self._body()
+        post_id = self._post_id(url.path)
+        if post_id is not None:
+            return self._update(post_id, data)
+        if url.path == '/wp-json/wp/v2/posts':
+            post = self.server.create_post(data.get('title', ''), data.get('content', ''), data.get('status', 'publish'))
+            return self._send(201, post)
+        self._send(404, {'code': 'rest_no_route'})
+
+    def do_PATCH(self):
+        if not self._preamble() or not self._authorized():
+            return
+        self._update(self._post_id(urlparse(self.path).path), self._body())
+
+    def _update(self, post_id, data):
+        with self.server.lock:
+            post = self.server.posts.get(post_id)
+            if post is not None:
+                if 'content' in data:
+                    post['content'] = {'raw': data['content'], 'rendered': data['content']}
+                post['modified'] = datetime.now().strftime('%Y-%m-%dT%H:%M:%S')
+        # _send() takes server.lock itself
+        if post is None:
+            return self._send(404, {'code': 'rest_post_invalid_id'})
+        self._send(200, post)
+
+
+class FakeWordPressFarm:
+    """
+    Several fake satellites on separate ports (i.e. separate hosts as far as
+    per-host limits and connection pools are concerned).
+    """
+
+    def __init__(self, sites, **kwargs):
+        self.servers = [FakeWordPressServer(**kwargs).start() for _ in range(sites)]
+
+    @property
+    def urls(self):
+        return [server.url for server in self.servers]
+
+    def stats(self):
+        totals = {'connections': 0, 'requests': 0, 'posts': 0, 'status_counts': {}}
+        for server in self.servers:
+            s = server.stats()
+            for key in ('connections', 'requests', 'posts'):
+                totals[key] += s[key]
+            for code, count in s['status_counts'].items():
+                totals['status_counts'][code] = totals['status_counts'].get(code, 0) + count
+        return totals
+
+    def close(self):
+        for server in self.servers:
+            server.shutdown()
+            server.server_close()
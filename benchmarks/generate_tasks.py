@@ -0,0 +1,42 @@
+import argparse
+import json
+import random
+
+TOPICS = ["Личные финансы и инвестиции", "Бюджетирование", "Саморазвитие", "Кредиты и ипотека",
+          "Пассивный доход", "Криптовалюта для начинающих", "Налоги для фрилансеров", "Пенсионные накопления"]
+ANCHORS = ["лучшие финансовые советы", "как экономить деньги", "финансовая грамотность", "тут", "по этой ссылке"]
+STYLES = ["expert", "lifestyle", "neutral"]
+
+
+def generate_tasks(n, site_urls=None, login='admin', app_password='xxxx xxxx xxxx xxxx', seed=42):
+    """
+    Returns `n` tasks in the data/sites_data.json schema. With `site_urls`
+    the tasks are spread round-robin over those satellites.
+    """
+    rng = random.Random(seed)
+    tasks = []
+    for i in range(n):
+        tasks.append({
+            "site_url": site_urls[i % len(site_urls)] if site_urls else f"https://satellite{i}.example.com",
+            "login": login,
+            "app_password": app_password,
+            "target_url": f"https://main-project.com/page{i % 50}",
+            "anchor": rng.choice(ANCHORS),
+            "topic": f"{rng.choice(TOPICS)} #{i}",
+            "author_style": rng.choice(STYLES),
+        })
+    return tasks
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate synthetic PBN tasks (sites_data.json schema).")
+    parser.add_argument('count', type=int)
+    parser.add_argument('--output', default='bench_sites.json')
+    args = parser.parse_args()
+    tasks = generate_tasks(args.count)
+    with open(args.output, 'w', encoding='utf-8') as f:
+        if args.output.endswith('.jsonl'):
+            f.writelines(json.dumps(t, ensure_ascii=False) + '\n' for t in tasks)
+        else:
+            json.dump(tasks, f, indent=2, ensure_ascii=False)
+    print(f"✅ {len(tasks)} задач записано в {args.output}")
@@ -0,0 +1,197 @@
+"""
+Offline end-to-end benchmark of publish_post.run_tasks.
+
+Every scenario runs in its own subprocess (so peak RSS is per scenario)
+against local fake WordPress satellites and a fake Gemini backend, then
+the numbers are written to benchmarks/results/ as JSON for comparing
+commits:
+
+    python benchmarks/run_benchmarks.py --tasks 200 --sites 20
+    python benchmarks/run_benchmarks.py --compare results/a.json results/b.json
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+CORE_DIR = os.path.join(BENCH_DIR, '..', 'core')
+RESULTS_DIR = os.path.join(BENCH_DIR, 'results')
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, CORE_DIR)
+
+SCENARIOS = {
+    'sequential': {'workers': 1},
+    'threads-8': {'workers': 8, 'per_host': 1},
+    'pipeline': {'pipeline': {'gen_workers': 8, 'publish_workers': 8, 'log_workers': 1}},
+    'pipeline-batched': {'pipeline': {'gen_workers': 8, 'publish_workers': 8, 'log_workers': 1},
+                         'gen_batch_size': 4},
+    'pipeline-no-keepalive': {'pipeline': {'gen_workers': 8, 'publish_workers': 8, 'log_workers': 1},
+                              'keep_alive': False},
+}
+
+
+def run_scenario(name, args):
+    """
+    Runs one scenario in this process and returns its measurements.
+    """
+    import publish_post
+    from fake_gemini import FakeGenaiClient
+    from fake_wordpress import FakeWordPressFarm
+    from generate_tasks import generate_tasks
+    from gemini_client import configure_gemini_client
+    from generation_cache import configure_generation_cache
+    from internal_linking import configure_catalogue
+    from metrics import configure_metrics
+    from task_journal import configure_journal
+    from wp_publisher import configure_publisher, get_publisher
+
+    scenario = SCENARIOS[name]
+    farm = FakeWordPressFarm(args.sites, latency=args.wp_latency, error_rate=args.wp_error_rate,
+                             rate_limit_rate=args.wp_429_rate, seed_posts=args.seed_posts, rng_seed=1)
+    fake_gemini = FakeGenaiClient(latency=args.gemini_latency, rate_limit_rate=args.gemini_429_rate, seed=1,
+                                  malformed_rate=args.gemini_malformed_rate)
+    tasks = generate_tasks(args.tasks, site_urls=farm.urls)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        metrics = configure_metrics(db_path=None)
+        configure_publisher(pool_size=args.pool_size, keep_alive=scenario.get('keep_alive', True))
+        configure_generation_cache(path=os.path.join(tmp, 'cache.db'), mode='bypass')
+        configure_gemini_client(client=fake_gemini, rpm=1_000_000, tpm=10**12, base_delay=0.05, max_delay=0.5)
+        configure_journal(os.path.join(tmp, 'journal.db'), enabled=args.journal)
+        configure_catalogue(path=os.path.join(tmp, 'post_index.db'))
+        publish_post.configure_article_batching(scenario.get('gen_batch_size', 1), max_wait=0.5)
+
+        pipeline = None
+        if 'pipeline' in scenario:
+            pipeline = publish_post.build_pipeline(per_host=scenario.get('per_host', 1), **scenario['pipeline'])
+        log = io.StringIO()
+        started = time.perf_counter()
+        with contextlib.redirect_stdout(log):
+            results = publish_post.run_tasks(iter(tasks), output_file=os.path.join(tmp, 'results.json'),
+                                             workers=scenario.get('workers', 1),
+                                             per_host=scenario.get('per_host', 1), pipeline=pipeline)
+        elapsed = time.perf_counter() - started
+        client_stats = get_publisher().stats()
+        configure_journal(enabled=False)
+
+    server = farm.stats()
+    farm.close()
+    return {
+        'scenario': name,
+        'config': scenario,
+        'tasks': len(tasks),
+        'succeeded': sum(1 for r in results if r.get('status') == 'success'),
+        'seconds': round(elapsed, 3),
+        'tasks_per_sec': round(len(tasks) / elapsed, 2) if elapsed else None,
+        'stages': {stage: {k: round(v, 4) if isinstance(v, float) else v for k, v in p.items()}
+                   for stage, p in sorted(metrics.percentiles().items())},
+        'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        'http_requests': server['requests'],
+        'http_connections_opened': server['connections'],
+        'http_status_counts': server['status_counts'],
+        'client_connections_opened': client_stats['connections_opened'],
+        'gemini_calls': fake_gemini.calls,
+    }
+
+
+def _git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=BENCH_DIR,
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except Exception:
+        return 'unknown'
+
+
+def _child_argv(name, args):
+    argv = [sys.executable, os.path.abspath(__file__), '--child', name]
+    for option in ('tasks', 'sites', 'seed_posts', 'pool_size', 'wp_latency', 'wp_error_rate',
+                   'wp_429_rate', 'gemini_latency', 'gemini_429_rate', 'gemini_malformed_rate'):
+        argv += ['--' + option.replace('_', '-'), str(getattr(args, option))]
+    if args.journal:
+        argv.append('--journal')
+    return argv
+
+
+def run_all(args):
+    revision = _git_revision()
+    report = {
+        'revision': revision,
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'params': {k: v for k, v in vars(args).items() if k not in ('child', 'scenarios', 'compare', 'output')},
+        'scenarios': [],
+    }
+    for name in args.scenarios:
+        print(f"▶️ {name}...", flush=True)
+        proc = subprocess.run(_child_argv(name, args), capture_output=True, text=True)
+        if proc.returncode != 0:
+            print(f"❌ {name} failed:\n{proc.stderr[-2000:]}")
+            continue
+        result = json.loads(proc.stdout.strip().splitlines()[-1])
+        report['scenarios'].append(result)
+        stages = ', '.join(f"{s} p95={p['p95'] * 1000:.0f}ms" for s, p in result['stages'].items())
+        print(f"   {result['tasks_per_sec']} tasks/s, {result['succeeded']}/{result['tasks']} ok, "
+              f"RSS {result['peak_rss_mb']} MB, {result['http_connections_opened']} conns | {stages}")
+
+    output = args.output
+    if output is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        output = os.path.join(RESULTS_DIR, f"{datetime.now().strftime('%Y%m%d-%H%M%S')}-{revision}.json")
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print(f"💾 Результаты сохранены в {output}")
+
+
+def compare(old_path, new_path):
+    with open(old_path, encoding='utf-8') as f:
+        old = {s['scenario']: s for s in json.load(f)['scenarios']}
+    with open(new_path, encoding='utf-8') as f:
+        new = json.load(f)['scenarios']
+    print(f"{'scenario':<24}{'tasks/s':>18}{'RSS MB':>18}{'conns':>14}")
+    for result in new:
+        before = old.get(result['scenario'])
+        if before is None:
+            continue
+
+        def cell(key):
+            return f"{before[key]}→{result[key]}"
+        print(f"{result['scenario']:<24}{cell('tasks_per_sec'):>18}{cell('peak_rss_mb'):>18}"
+              f"{cell('http_connections_opened'):>14}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Offline end-to-end benchmark with fake WordPress and Gemini.")
+    parser.add_argument('--scenarios', nargs='+', default=list(SCENARIOS), choices=list(SCENARIOS))
+    parser.add_argument('--tasks', type=int, default=200)
+    parser.add_argument('--sites', type=int, default=20, help="Number of fake satellites (one port each)")
+    parser.add_argument('--seed-posts', type=int, default=30, help="Existing posts per satellite")
+    parser.add_argument('--pool-size', type=int, default=10)
+    parser.add_argument('--wp-latency', type=float, default=0.05)
+    parser.add_argument('--wp-error-rate', type=float, default=0.0)
+    parser.add_argument('--wp-429-rate', type=float, default=0.0)
+    parser.add_argument('--gemini-latency', type=float, default=0.2)
+    parser.add_argument('--gemini-429-rate', type=float, default=0.0)
+    parser.add_argument('--gemini-malformed-rate', type=float, default=0.0,
+                        help="Share of batch answers returned as broken JSON")
+    parser.add_argument('--journal', action='store_true', help="Record task state in a temporary journal")
+    parser.add_argument('--output', default=None, help="Results JSON (default: benchmarks/results/<time>-<rev>.json)")
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'), help="Compare two results files")
+    parser.add_argument('--child', default=None, help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.compare:
+        compare(*args.compare)
+    elif args.child:
+        print(json.dumps(run_scenario(args.child, args), ensure_ascii=False))
+    else:
+        run_all(args)
@@ -0,0 +1,145 @@
+import html
+import json
+import threading
+
+
+class BatchItemError(Exception):
+    """
+    One article of a batch was missing or failed validation.
+    """
+
+
+def build_batch_prompt(style_instruction, briefs):
+    """
+    One prompt for several articles of the same style. `briefs` is a list of
+    (topic, target_link, anchor_text); the answer must be a JSON array with
+    one {"id", "html"} object per brief.
+    """
+    lines = [f'{i}. Topic: {topic}\n   Link: "{target}"\n   Anchor text: "{anchor}"'
+             for i, (topic, target, anchor) in enumerate(briefs, 1)]
+    return f"""
+    You are a professional blog writer. {style_instruction}
+    Task: Write {len(briefs)} separate SEO-optimized articles, one per brief below, each in HTML format (use <h1>, <h2>, <p> tags only).
+    Requirement 1: Every article must include a natural link to its brief's Link with exactly its Anchor text.
+    Requirement 2: Make every article engaging and around 600 words.
+    Requirement 3: Return ONLY a JSON array of {len(briefs)} objects in brief order: [{{"id": <brief number>, "html": "<article HTML>"}}]. No markdown symbols like ```json.
+    Briefs:
+{chr(10).join(lines)}
+    """
+
+
+def validate_article(content, target_link, anchor_text):
+    """
+    True if the article HTML links to `target_link` with `anchor_text`.
+    """
+    if not content or target_link not in content:
+        return False
+    return anchor_text in content or html.escape(anchor_text) in content
+
+
+def parse_batch_response(text, briefs):
+    """
+    Splits a batch answer into one HTML article per brief. Returns a list
+    aligned with `briefs` holding the HTML or a BatchItemError for articles
+    that are missing or lack their link. Raises ValueError if the answer is
+    not a usable JSON array at all.
+    """
+    text = (text or '').strip()
+    if text.startswith('```'):
+        text = text.strip('`')
+        text = text[text.find('['):] if '[' in text else text
+    data = json.loads(text)
+    if isinstance(data, dict):
+        data = data.get('articles')
+    if not isinstance(data, list):
+        raise ValueError("batch response is not a JSON array")
+
+    by_id = {}
+    for position, entry in enumerate(data, 1):
+        if not isinstance(entry, dict):
+            continue
+        try:
+            article_id = int(entry.get('id', position))
+        except (TypeError, ValueError):
+            article_id = position
+        by_id.setdefault(article_id, entry.get('html'))
+
+    articles = []
+    for i, (topic, target, anchor) in enumerate(briefs, 1):
+        content = by_id.get(i)
+        if isinstance(content, str):
+            content = content.replace('```html', '').replace('```', '').strip()
+        if not isinstance(content, str) or not validate_article(content, target, anchor):
+            articles.append(BatchItemError(f"article {i} missing or without its link"))
+        else:
+            articles.append(content)
+    return articles
+
+
+class _Slot:
+    __slots__ = ('item', 'result', 'error', 'done')
+
+    def __init__(self, item):
+        self.item = item
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class MicroBatcher:
+    """
+    Groups concurrent calls with the same key into one `func(key, items)`
+    call, which must return one result (or Exception) per item.
+
+    The thread that fills a batch up to `batch_size` runs it; a batch that
+    stays short is run by its first caller once `max_wait` seconds pass, so
+    a lone task is delayed at most that long.
+    """
+
+    def __init__(self, func, batch_size=4, max_wait=2.0):
+        self.func = func
+        self.batch_size = max(1, batch_size)
+        self.max_wait = max_wait
+        self._lock = threading.Lock()
+        self._pending = {}
+        self.batches = 0
+        self.items = 0
+
+    def submit(self, key, item):
+        slot = _Slot(item)
+        batch = None
+        with self._lock:
+            pending = self._pending.setdefault(key, [])
+            pending.append(slot)
+            if len(pending) >= self.batch_size:
+                batch = self._pending.pop(key)
+        if batch is None and not slot.done.wait(self.max_wait):
+            with self._lock:
+                pending = self._pending.get(key)
+                if pending and slot in pending:
+                    batch = self._pending.pop(key)
+        if batch is not None:
+            self._run(key, batch)
+        slot.done.wait()
+        if slot.error is not None:
+            raise slot.error
+        return slot.result
+
+    def _run(self, key, batch):
+        with self._lock:
+            self.batches += 1
+            self.items += len(batch)
+        try:
+            results = self.func(key, [slot.item for slot in batch])
+        except Exception as e:
+            results = [e] * len(batch)
+        for slot, result in zip(batch, results):
+            if isinstance(result, Exception):
+                slot.error = result
+            else:
+                slot.result = result
+            slot.done.set()
+
+    def stats(self):
+        with self._lock:
+            return {'batches': self.batches, 'items': self.items}
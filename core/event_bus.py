@@ -0,0 +1,252 @@
+import atexit
+import queue
+import random
+import threading
+import time
+from datetime import datetime
+
+_STOP = object()
+
+# Сколько еще попыток у синка без лимита попыток, когда процесс завершается
+CLOSE_RETRIES = 3
+# Сколько flush() ждет доставки, прежде чем вернуть управление (сек)
+FLUSH_TIMEOUT = 30.0
+
+
+class _Flush:
+    """
+    Queue marker of one flush() call, set once everything before it is handled.
+    """
+    __slots__ = ('done',)
+
+    def __init__(self):
+        self.done = threading.Event()
+
+
+class Sink:
+    """
+    Base class of an event consumer with its own queue and thread.
+
+    Events are delivered to handle_batch() in batches of up to `batch_size`,
+    or whatever arrived within `flush_interval` seconds. A failing batch is
+    retried with exponential backoff (capped at `max_delay`) and dropped
+    after `max_retries`, or once `retry_window` seconds have passed since
+    its first failure (`max_retries=None` leaves only the window). Once the
+    sink is closing, a failing batch gets at most CLOSE_RETRIES more
+    attempts. When the queue is full new events are dropped instead of
+    blocking the publisher. Subclasses set `types` to the event types they
+    care about.
+    """
+
+    name = 'sink'
+    types = None
+
+    def __init__(self, batch_size=50, flush_interval=5.0, max_retries=3, base_delay=1.0, max_delay=60.0,
+                 retry_window=None, max_queue=10_000):
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.retry_window = retry_window
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._thread = None
+        self._lock = threading.Lock()
+        self._closing = threading.Event()
+        self.delivered = 0
+        self.failed = 0
+        self.dropped = 0
+        self.retries = 0
+
+    def accepts(self, event):
+        return self.types is None or event['type'] in self.types
+
+    def handle_batch(self, events):
+        raise NotImplementedError
+
+    def on_close(self):
+        pass
+
+    # --- queue & thread ---
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name=f"sink-{self.name}", daemon=True)
+                self._thread.start()
+
+    def put(self, event):
+        try:
+            self._queue.put_nowait(event)
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self):
+        batch = []
+        deadline = None
+        while True:
+            timeout = None if not batch else max(0.0, deadline - time.monotonic())
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+            marker = item is _STOP or isinstance(item, _Flush)
+            if item is not None and not marker:
+                batch.append(item)
+                if len(batch) == 1:
+                    deadline = time.monotonic() + self.flush_interval
+            if batch and (marker or len(batch) >= self.batch_size or time.monotonic() >= deadline):
+                self._deliver(batch)
+                batch = []
+            if isinstance(item, _Flush):
+                item.done.set()
+            if item is _STOP:
+                return
+
+    def _deliver(self, batch):
+        retries_left = self.max_retries
+        attempt = 0
+        first_failure = None
+        closing = False
+        while True:
+            try:
+                self.handle_batch(batch)
+                self.delivered += len(batch)
+                return
+            except Exception as e:
+                if first_failure is None:
+                    first_failure = time.monotonic()
+                if self._closing.is_set() and not closing:
+                    # Процесс завершается - еще несколько быстрых попыток, и хватит
+                    closing, attempt = True, 0
+                    if retries_left is None or retries_left > CLOSE_RETRIES:
+                        retries_left = CLOSE_RETRIES
+                expired = self.retry_window is not None and time.monotonic() - first_failure >= self.retry_window
+                if expired or (retries_left is not None and retries_left <= 0):
+                    print(f"⚠️ Sink {self.name}: {len(batch)} событий потеряно ({e})")
+                    self.failed += len(batch)
+                    return
+                if attempt == 0:
+                    print(f"⚠️ Sink {self.name}: ошибка доставки ({e}), повторяем")
+                if retries_left is not None:
+                    retries_left -= 1
+                self.retries += 1
+                delay = min(self.max_delay, self.base_delay * (2 ** min(attempt, 16)))
+                attempt += 1
+                delay = delay / 2 + random.uniform(0, delay / 2)
+                if closing:
+                    time.sleep(delay)
+                else:
+                    self._closing.wait(delay)
+
+    def flush(self, timeout=FLUSH_TIMEOUT):
+        """
+        Blocks until every event queued so far has been handled, or for at
+        most `timeout` seconds. Returns False if delivery is still pending
+        (the events stay queued and keep being retried).
+        """
+        if self._thread is None:
+            return True
+        marker = _Flush()
+        started = time.monotonic()
+        try:
+            self._queue.put(marker, timeout=timeout)
+        except queue.Full:
+            return False
+        return marker.done.wait(max(0.0, timeout - (time.monotonic() - started)))
+
+    def close(self):
+        self._closing.set()
+        if self._thread is not None:
+            try:
+                self._queue.put(_STOP, timeout=60)
+            except queue.Full:
+                pass
+            self._thread.join(timeout=60)
+            self._thread = None
+        self.on_close()
+
+    def stats(self):
+        return {'delivered': self.delivered, 'failed': self.failed, 'dropped': self.dropped,
+                'retries': self.retries, 'queued': self._queue.qsize()}
+
+
+class EventBus:
+    """
+    In-process fan-out of task events to the subscribed sinks.
+
+    emit() only enqueues (it never waits on a sink), so a slow Sheets API or
+    Telegram outage does not hold up publishing.
+    """
+
+    def __init__(self, sinks=(), run_id=None):
+        self.run_id = run_id or datetime.now().strftime('%Y%m%dT%H%M%S')
+        self.sinks = []
+        self._closed = False
+        for sink in sinks:
+            self.subscribe(sink)
+
+    def subscribe(self, sink):
+        sink.start()
+        self.sinks.append(sink)
+        return sink
+
+    def emit(self, event_type, **payload):
+        event = {'type': event_type, 'timestamp': time.time(), 'run_id': self.run_id, **payload}
+        for sink in self.sinks:
+            if sink.accepts(event):
+                sink.put(event)
+
+    def flush(self, timeout=FLUSH_TIMEOUT):
+        """
+        Waits for every sink to deliver what was emitted so far, for at most
+        `timeout` seconds in total.
+        """
+        deadline = time.monotonic() + timeout
+        for sink in self.sinks:
+            if not sink.flush(max(0.0, deadline - time.monotonic())):
+                print(f"⚠️ Sink {sink.name}: доставка не завершилась за {timeout:.0f}s, продолжаем без ожидания")
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        for sink in self.sinks:
+            try:
+                sink.close()
+            except Exception as e:
+                print(f"⚠️ Sink {sink.name}: ошибка при закрытии ({e})")
+
+    def stats(self):
+        return {sink.name: sink.stats() for sink in self.sinks}
+
+
+_default_bus = None
+_default_lock = threading.Lock()
+
+
+def get_event_bus():
+    """
+    Returns the process-wide event bus. Until configured it only feeds the
+    Google Sheets report, like the publisher always did.
+    """
+    global _default_bus
+    with _default_lock:
+        if _default_bus is None:
+            from event_sinks import SheetsSink
+            _default_bus = EventBus([SheetsSink()])
+            atexit.register(_default_bus.close)
+        return _default_bus
+
+
+def configure_event_bus(sinks, run_id=None):
+    """
+    Replaces the process-wide bus (closing the previous one and its sinks).
+    """
+    global _default_bus
+    with _default_lock:
+        if _default_bus is not None:
+            _default_bus.close()
+        _default_bus = EventBus(sinks, run_id=run_id)
+        atexit.register(_default_bus.close)
+        return _default_bus
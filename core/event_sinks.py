@@ -0,0 +1,175 @@
+import json
+import os
+import sqlite3
+import time
+from collections import Counter
+from datetime import datetime
+
+from event_bus import Sink
+from google_sheets_logger import build_row, get_sheets_logger
+from metrics import DEFAULT_METRICS_DB, TASK_EVENTS_TABLE
+
+# Сколько секунд повторяем запись пакета в таблицу, прежде чем сдаться
+SHEETS_RETRY_WINDOW = 10 * 60
+
+
+class SheetsSink(Sink):
+    """
+    Appends one row per finished task to the Google Sheets report. Quota
+    429s can last a minute, so a failed batch is retried (backoff capped at
+    60s) for up to SHEETS_RETRY_WINDOW seconds; a sheet that stays
+    unreachable (revoked credentials, deleted sheet) loses the batch
+    instead of holding up the run.
+    """
+
+    name = 'sheets'
+    types = {'task_finished'}
+
+    def __init__(self, logger=None, **kwargs):
+        kwargs.setdefault('flush_interval', 10.0)
+        kwargs.setdefault('max_retries', None)
+        kwargs.setdefault('retry_window', SHEETS_RETRY_WINDOW)
+        super().__init__(**kwargs)
+        self._logger = logger
+
+    @property
+    def logger(self):
+        return self._logger or get_sheets_logger()
+
+    def handle_batch(self, events):
+        self.logger.append_rows([build_row(e['site'], e['topic'], e['status'], e.get('link'), e.get('model'))
+                                 for e in events])
+
+
+class SQLiteSink(Sink):
+    """
+    Stores finished tasks in the `task_events` table of the metrics DB.
+    """
+
+    name = 'sqlite'
+    types = {'task_finished'}
+
+    def __init__(self, db_path=DEFAULT_METRICS_DB, **kwargs):
+        kwargs.setdefault('batch_size', 200)
+        super().__init__(**kwargs)
+        self.db_path = db_path
+        self._conn = None
+
+    def _db(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute(TASK_EVENTS_TABLE)
+            self._conn.execute('CREATE INDEX IF NOT EXISTS idx_task_events_ts ON task_events (timestamp, status)')
+            self._conn.commit()
+        return self._conn
+
+    def handle_batch(self, events):
+        db = self._db()
+        with db:
+            db.executemany('INSERT INTO task_events (run_id, timestamp, site, topic, style, status, post_url, '
+                           'updated_post, model) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                           [(e['run_id'], e['timestamp'], e['site'], e.get('topic'), e.get('style'), e['status'],
+                             e.get('link'), e.get('updated_post'), e.get('model')) for e in events])
+
+    def on_close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+
+class JSONLSink(Sink):
+    """
+    Appends events as JSON lines, e.g. article_generated events to
+    generation_logs.jsonl for monitoring/dashboard.py.
+    """
+
+    name = 'jsonl'
+
+    def __init__(self, path, types=None, **kwargs):
+        super().__init__(**kwargs)
+        self.path = path
+        self.types = set(types) if types else None
+        self.name = f"jsonl:{os.path.basename(path)}"
+
+    def handle_batch(self, events):
+        lines = ''.join(json.dumps(dict(e, timestamp=datetime.fromtimestamp(e['timestamp']).isoformat()),
+                                   ensure_ascii=False) + '\n' for e in events)
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(lines)
+
+
+class TelegramDigestSink(Sink):
+    """
+    Collects finished tasks and sends a short Telegram digest every
+    `digest_interval` seconds and at the end of the run, instead of one
+    blocking message per report.
+    """
+
+    name = 'telegram'
+    types = {'task_finished', 'run_finished'}
+
+    def __init__(self, token=None, chat_id=None, digest_interval=3600, **kwargs):
+        super().__init__(**kwargs)
+        self.token = token or os.getenv("TELEGRAM_BOT_TOKEN")
+        self.chat_id = chat_id or os.getenv("TELEGRAM_CHAT_ID")
+        self.digest_interval = digest_interval
+        self._last_sent = time.monotonic()
+        self._reset()
+
+    def _reset(self):
+        self.tasks = 0
+        self.succeeded = 0
+        self.links = 0
+        self.failing_sites = Counter()
+        self.run = None
+
+    def handle_batch(self, events):
+        for e in events:
+            if e['type'] == 'run_finished':
+                self.run = e
+                continue
+            self.tasks += 1
+            self.links += bool(e.get('updated_post'))
+            if e['status'] == 'success':
+                self.succeeded += 1
+            else:
+                self.failing_sites[e['site']] += 1
+        if self.run is not None or time.monotonic() - self._last_sent >= self.digest_interval:
+            self.send_digest()
+
+    def message(self):
+        lines = [f"📊 *PBN Digest* ({datetime.now().strftime('%Y-%m-%d %H:%M')})", ""]
+        if self.tasks:
+            lines += [f"• Tasks: *{self.tasks}*", f"• Success: *{self.succeeded}*",
+                      f"• Errors: *{self.tasks - self.succeeded}*", f"• Internal links: *{self.links}*"]
+        if self.run is not None:
+            lines.append(f"• Run: *{self.run.get('succeeded', 0)}/{self.run.get('tasks', 0)}* "
+                         f"in {self.run.get('seconds', 0):.0f}s")
+        for site, count in self.failing_sites.most_common(5):
+            lines.append(f"  ❌ {site}: {count}")
+        return '\n'.join(lines)
+
+    def send_digest(self):
+        if not self.tasks and self.run is None:
+            return
+        if self.token and self.chat_id:
+            import requests  # нужен только для отправки отчета
+            text = self.message()
+            for attempt in range(self.max_retries + 1):
+                try:
+                    response = requests.post(f"https://api.telegram.org/bot{self.token}/sendMessage", json={
+                        "chat_id": self.chat_id, "text": text, "parse_mode": "Markdown"}, timeout=10)
+                    if response.status_code == 200:
+                        print("✅ Дайджест отправлен в Telegram")
+                        break
+                    print(f"⚠️ Telegram API error: {response.text}")
+                except Exception as e:
+                    print(f"⚠️ Ошибка отправки в Telegram: {e}")
+                if attempt < self.max_retries:
+                    time.sleep(self.base_delay * (2 ** attempt))
+        self._last_sent = time.monotonic()
+        self._reset()
+
+    def on_close(self):
+        self.send_digest()
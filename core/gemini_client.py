@@ -0,0 +1,187 @@
+import os
+import random
+import threading
+import time
+
+from metrics import get_metrics
+
+DEFAULT_MODEL = "gemini-2.0-flash"
+
+# Коды, при которых имеет смысл повторить запрос (лимиты и временные сбои)
+RETRYABLE_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+RETRYABLE_MARKERS = ("RESOURCE_EXHAUSTED", "UNAVAILABLE", "DEADLINE_EXCEEDED", "timed out", "Connection")
+
+# Грубая оценка: статья ~600 слов на русском, ~1500 токенов ответа
+EXPECTED_OUTPUT_TOKENS = 1500
+
+
+def estimate_tokens(prompt, outputs=1):
+    return len(prompt) // 3 + EXPECTED_OUTPUT_TOKENS * outputs
+
+
+def is_retryable(exc):
+    code = getattr(exc, 'code', None) or getattr(exc, 'status_code', None)
+    if isinstance(code, int):
+        return code in RETRYABLE_STATUS_CODES
+    if isinstance(exc, (TimeoutError, ConnectionError)):
+        return True
+    return any(marker in str(exc) for marker in RETRYABLE_MARKERS)
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket refilled continuously at `rate_per_minute`.
+    """
+
+    def __init__(self, rate_per_minute, capacity=None):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity or rate_per_minute
+        self._tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self, amount=1):
+        """
+        Blocks until `amount` tokens are available. Returns seconds waited.
+        """
+        amount = min(amount, self.capacity)
+        waited = 0.0
+        while True:
+            with self._lock:
+                self._refill()
+                if self._tokens >= amount:
+                    self._tokens -= amount
+                    return waited
+                delay = (amount - self._tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+    def adjust(self, amount):
+        """
+        Returns (positive) or charges (negative) tokens after the real cost is known.
+        """
+        with self._lock:
+            self._refill()
+            self._tokens = min(self.capacity, self._tokens + amount)
+
+
+class GeminiClient:
+    """
+    Long-lived Gemini client shared by all tasks.
+
+    Requests go through requests-per-minute and tokens-per-minute buckets and
+    are retried with exponential backoff and jitter on rate limits and
+    transient server errors. The last error is raised once retries run out.
+    """
+
+    def __init__(self, api_key=None, rpm=60, tpm=1_000_000, max_retries=5,
+                 base_delay=2.0, max_delay=60.0, client=None):
+        self.api_key = api_key or os.getenv("GEMINI_API_KEY")
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.request_bucket = TokenBucket(rpm)
+        self.token_bucket = TokenBucket(tpm)
+        self._client = client
+        self._lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.requests = 0
+        self.retries = 0
+        self.failures = 0
+        self.throttled_seconds = 0.0
+        self.backoff_seconds = 0.0
+
+    @property
+    def client(self):
+        with self._lock:
+            if self._client is None:
+                # Импорт google.genai занимает ~0.5s - платим только при первом запросе
+                from google import genai
+                self._client = genai.Client(api_key=self.api_key)
+            return self._client
+
+    def _count(self, **deltas):
+        with self._stats_lock:
+            for name, value in deltas.items():
+                setattr(self, name, getattr(self, name) + value)
+
+    def backoff_delay(self, attempt):
+        cap = min(self.max_delay, self.base_delay * (2 ** attempt))
+        return cap / 2 + random.uniform(0, cap / 2)
+
+    def generate(self, prompt, model=DEFAULT_MODEL, outputs=1, **kwargs):
+        """
+        Sends one generate_content request. `outputs` is the number of
+        articles asked for, used to reserve tokens-per-minute up front.
+        """
+        estimate = estimate_tokens(prompt, outputs)
+        attempt = 0
+        while True:
+            waited = self.request_bucket.acquire(1) + self.token_bucket.acquire(estimate)
+            self._count(requests=1, throttled_seconds=waited)
+            try:
+                response = self.client.models.generate_content(model=model, contents=prompt, **kwargs)
+            except Exception as e:
+                code = getattr(e, 'code', None) or 'error'
+                get_metrics().inc('pbn_gemini_requests', model=model, status=code)
+                if attempt >= self.max_retries or not is_retryable(e):
+                    self._count(failures=1)
+                    raise
+                get_metrics().inc('pbn_gemini_retries', model=model)
+                delay = self.backoff_delay(attempt)
+                attempt += 1
+                print(f"   ⏳ Gemini: {e}. Повтор {attempt}/{self.max_retries} через {delay:.1f}s")
+                self._count(retries=1, backoff_seconds=delay)
+                time.sleep(delay)
+                continue
+
+            get_metrics().inc('pbn_gemini_requests', model=model, status=200)
+            usage = getattr(response, 'usage_metadata', None)
+            total = getattr(usage, 'total_token_count', None)
+            if total:
+                self.token_bucket.adjust(estimate - total)
+                get_metrics().record_tokens(model, getattr(usage, 'prompt_token_count', 0),
+                                            getattr(usage, 'candidates_token_count', 0), total)
+            return response
+
+    def stats(self):
+        with self._stats_lock:
+            return {
+                'requests': self.requests,
+                'retries': self.retries,
+                'failures': self.failures,
+                'throttled_seconds': self.throttled_seconds,
+                'backoff_seconds': self.backoff_seconds,
+            }
+
+
+_default_client = None
+_default_lock = threading.Lock()
+
+
+def get_gemini_client():
+    """
+    Returns the process-wide Gemini client (key from GEMINI_API_KEY,
+    default rpm/tpm limits), created on first use.
+    """
+    global _default_client
+    with _default_lock:
+        if _default_client is None:
+            _default_client = GeminiClient()
+        return _default_client
+
+
+def configure_gemini_client(**kwargs):
+    """
+    Swaps in a client with other limits (e.g. --gemini-rpm/--gemini-tpm);
+    calls already waiting on the old one's rate limiter finish on it.
+    """
+    global _default_client
+    with _default_lock:
+        _default_client = GeminiClient(**kwargs)
+        return _default_client
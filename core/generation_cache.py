@@ -0,0 +1,147 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import zlib
+
+from paths import MONITORING_DIR
+
+DEFAULT_CACHE_PATH = os.getenv("PBN_GENERATION_CACHE", os.path.join(MONITORING_DIR, 'generation_cache.db'))
+
+
+class GenerationCache:
+    """
+    On-disk cache of generated articles keyed by a hash of (model, prompt).
+
+    Entries are stored zlib-compressed in SQLite, expire after `ttl_seconds`
+    and the least recently used ones are evicted once the cache grows past
+    `max_bytes`. Modes:
+      - "use":     read and write (default)
+      - "refresh": never read, but overwrite entries with fresh output
+      - "bypass":  neither read nor write
+    """
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, ttl_seconds=30 * 24 * 3600,
+                 max_bytes=200 * 1024 * 1024, mode="use"):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self.mode = mode
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = None
+
+    @staticmethod
+    def key(prompt, model_name):
+        return hashlib.sha256(f"{model_name}\n{prompt}".encode('utf-8')).hexdigest()
+
+    def _db(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute('''CREATE TABLE IF NOT EXISTS articles
+                                  (key TEXT PRIMARY KEY,
+                                   model TEXT,
+                                   title TEXT,
+                                   content BLOB,
+                                   size INTEGER,
+                                   created_at REAL,
+                                   accessed_at REAL)''')
+            self._conn.execute('CREATE INDEX IF NOT EXISTS idx_articles_accessed ON articles (accessed_at)')
+            self._conn.commit()
+        return self._conn
+
+    def get(self, key):
+        """
+        Returns (title, content, model) for a fresh entry, or None.
+        """
+        if self.mode != "use":
+            return None
+        now = time.time()
+        try:
+            with self._lock:
+                db = self._db()
+                row = db.execute('SELECT title, content, model, created_at FROM articles WHERE key = ?',
+                                 (key,)).fetchone()
+                if row and self.ttl_seconds and now - row[3] > self.ttl_seconds:
+                    db.execute('DELETE FROM articles WHERE key = ?', (key,))
+                    db.commit()
+                    row = None
+                if row is None:
+                    self.misses += 1
+                    return None
+                db.execute('UPDATE articles SET accessed_at = ? WHERE key = ?', (now, key))
+                db.commit()
+                self.hits += 1
+            return row[0], zlib.decompress(row[1]).decode('utf-8'), row[2]
+        except Exception as e:
+            print(f"⚠️ Generation cache read error: {e}")
+            return None
+
+    def put(self, key, title, content, model_name):
+        if self.mode == "bypass":
+            return
+        blob = zlib.compress(content.encode('utf-8'))
+        now = time.time()
+        try:
+            with self._lock:
+                db = self._db()
+                db.execute('INSERT OR REPLACE INTO articles VALUES (?, ?, ?, ?, ?, ?, ?)',
+                           (key, model_name, title, blob, len(blob), now, now))
+                self._evict(db, now)
+                db.commit()
+        except Exception as e:
+            print(f"⚠️ Generation cache write error: {e}")
+
+    def _evict(self, db, now):
+        if self.ttl_seconds:
+            db.execute('DELETE FROM articles WHERE created_at < ?', (now - self.ttl_seconds,))
+        if not self.max_bytes:
+            return
+        total = db.execute('SELECT COALESCE(SUM(size), 0) FROM articles').fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        # Удаляем самые давно использованные записи, пока не уложимся в лимит
+        for key, size in db.execute('SELECT key, size FROM articles ORDER BY accessed_at ASC').fetchall():
+            db.execute('DELETE FROM articles WHERE key = ?', (key,))
+            total -= size
+            if total <= self.max_bytes:
+                break
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'mode': self.mode}
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+_default_cache = None
+_default_lock = threading.Lock()
+
+
+def get_generation_cache():
+    """
+    Returns the process-wide cache at DEFAULT_CACHE_PATH, opened on first use.
+    """
+    global _default_cache
+    with _default_lock:
+        if _default_cache is None:
+            _default_cache = GenerationCache()
+        return _default_cache
+
+
+def configure_generation_cache(**kwargs):
+    """
+    Closes the current cache DB and opens one with `kwargs` (path, ttl,
+    size limit, mode).
+    """
+    global _default_cache
+    with _default_lock:
+        if _default_cache is not None:
+            _default_cache.close()
+        _default_cache = GenerationCache(**kwargs)
+        return _default_cache
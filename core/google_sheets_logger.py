@@ -1,49 +1,198 @@
-import gspread
-from oauth2client.service_account import ServiceAccountCredentials
+import atexit
 import os
 import json
+import threading
+import time
 from datetime import datetime
 
 # Настройки доступа (читаем JSON-ключ из переменной окружения Render)
 # На Render мы создадим переменную GOOGLE_CREDENTIALS и вставим туда содержимое JSON-файла целиком.
 
-def log_to_sheet(site_url, topic, status, link, model_used):
-    try:
+# Ссылка: https://docs.google.com/spreadsheets/d/1CJjN_mSwrGwp2tVuaLK0vENb2c5VnYPQw0JM43HTE-c/...
+SHEET_ID = "1CJjN_mSwrGwp2tVuaLK0vENb2c5VnYPQw0JM43HTE-c" # ID вашей таблицы
+SHEET_TAB_NAME = "Report" # Имя вкладки для отчетов
+SCOPE = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
+
+# Строк в буфере, которые мы храним, если таблица временно недоступна
+MAX_PENDING_ROWS = 5000
+
+
+def build_row(site_url, topic, status, link, model_used):
+    return [
+        datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        site_url,
+        topic,
+        link if link else "N/A",
+        "✅ Success" if status == "success" else "❌ Error",
+        model_used
+    ]
+
+
+class SheetsLogger:
+    """
+    Buffered Google Sheets logger.
+
+    Authorizes once, caches the worksheet handle and writes rows with a single
+    append_rows call when `batch_size` rows are buffered or `flush_interval`
+    seconds have passed. With `background=True` a daemon thread does the
+    flushing, so callers never wait on Sheets latency.
+    """
+
+    def __init__(self, sheet_id=SHEET_ID, tab_name=SHEET_TAB_NAME,
+                 batch_size=50, flush_interval=10.0, background=True):
+        self.sheet_id = sheet_id
+        self.tab_name = tab_name
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval
+        self.background = background
+        self._rows = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+        self._sheet = None
+        self._disabled = False
+        self._last_flush = time.monotonic()
+        self.rows_written = 0
+        self.api_calls = 0
+
+    def _worksheet(self):
+        if self._sheet is not None or self._disabled:
+            return self._sheet
+
         # Получаем JSON-ключ из переменной окружения
         json_creds = os.getenv("GOOGLE_CREDENTIALS")
         if not json_creds:
             print("⚠️ GOOGLE_CREDENTIALS not found. Skipping sheet logging.")
-            return
+            self._disabled = True
+            return None
+
+        # gspread/oauth2client грузятся только когда логирование в таблицу реально нужно
+        import gspread
+        from oauth2client.service_account import ServiceAccountCredentials
 
         creds_dict = json.loads(json_creds)
-        scope = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
-        creds = ServiceAccountCredentials.from_json_keyfile_dict(creds_dict, scope)
+        creds = ServiceAccountCredentials.from_json_keyfile_dict(creds_dict, SCOPE)
         client = gspread.authorize(creds)
+        spreadsheet = client.open_by_key(self.sheet_id)
+        self.api_calls += 1
+
+        # Открываем лист 'Report', если его нет - первый лист
+        try:
+            self._sheet = spreadsheet.worksheet(self.tab_name)
+        except gspread.exceptions.WorksheetNotFound:
+            print(f"⚠️ Worksheet '{self.tab_name}' not found. Using first sheet.")
+            self._sheet = spreadsheet.sheet1
+        self.api_calls += 1
+        return self._sheet
+
+    def start(self):
+        if self.background and self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="sheets-flusher", daemon=True)
+            self._thread.start()
 
-        # Открываем таблицу по ID (берем из ссылки)
-        # Ссылка: https://docs.google.com/spreadsheets/d/1CJjN_mSwrGwp2tVuaLK0vENb2c5VnYPQw0JM43HTE-c/...
-        sheet_id = "1CJjN_mSwrGwp2tVuaLK0vENb2c5VnYPQw0JM43HTE-c" 
-        
-        # Открываем лист 'Report'
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+
+    def log(self, site_url, topic, status, link, model_used):
+        if self._disabled:
+            return
+        row = build_row(site_url, topic, status, link, model_used)
+        with self._lock:
+            self._rows.append(row)
+            pending = len(self._rows)
+        if self.background:
+            self.start()
+            if pending >= self.batch_size:
+                self._wakeup.set()
+        elif pending >= self.batch_size or time.monotonic() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def append_rows(self, rows):
+        """
+        Writes `rows` right away in one append_rows call. Raises on failure
+        (the caller decides whether to retry). Returns the number of rows written.
+        """
+        sheet = self._worksheet()
+        if sheet is None or not rows:
+            return 0
         try:
-            sheet = client.open_by_key(sheet_id).worksheet("Report")
-        except:
-            # Если листа нет, открываем первый
-            sheet = client.open_by_key(sheet_id).sheet1
-
-        # Формируем строку
-        row = [
-            datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-            site_url,
-            topic,
-            link if link else "N/A",
-            "✅ Success" if status == "success" else "❌ Error",
-            model_used
-        ]
-        
-        # Добавляем строку
-        sheet.append_row(row)
-        print(f"📊 Logged to Google Sheet: {row}")
-
-    except Exception as e:
-        print(f"⚠️ Failed to log to Google Sheet: {e}")
+            sheet.append_rows(rows)
+        except Exception:
+            # Сбрасываем кеш листа - при следующей попытке авторизуемся заново
+            self._sheet = None
+            raise
+        self.api_calls += 1
+        self.rows_written += len(rows)
+        print(f"📊 Logged {len(rows)} rows to Google Sheet")
+        return len(rows)
+
+    def flush(self):
+        """
+        Writes all buffered rows in one append_rows call.
+        Rows are kept for the next attempt if the write fails.
+        """
+        with self._flush_lock:
+            with self._lock:
+                rows, self._rows = self._rows, []
+            self._last_flush = time.monotonic()
+            if not rows:
+                return 0
+            try:
+                return self.append_rows(rows)
+            except Exception as e:
+                print(f"⚠️ Failed to log to Google Sheet: {e}")
+                with self._lock:
+                    self._rows = (rows + self._rows)[-MAX_PENDING_ROWS:]
+                return 0
+
+    def stats(self):
+        with self._lock:
+            pending = len(self._rows)
+        return {'rows_written': self.rows_written, 'rows_pending': pending, 'api_calls': self.api_calls}
+
+    def close(self):
+        self._stopped.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout=30)
+            self._thread = None
+        self.flush()
+
+
+_default_logger = None
+_default_lock = threading.Lock()
+
+
+def get_sheets_logger():
+    """
+    Returns the process-wide logger, creating it on first use.
+    It is flushed automatically at interpreter exit.
+    """
+    global _default_logger
+    with _default_lock:
+        if _default_logger is None:
+            _default_logger = SheetsLogger()
+            atexit.register(_default_logger.close)
+        return _default_logger
+
+
+def configure_sheets_logger(**kwargs):
+    """
+    Replaces the process-wide logger, flushing the previous one first.
+    """
+    global _default_logger
+    with _default_lock:
+        if _default_logger is not None:
+            _default_logger.close()
+        _default_logger = SheetsLogger(**kwargs)
+        atexit.register(_default_logger.close)
+        return _default_logger
+
+
+def log_to_sheet(site_url, topic, status, link, model_used):
+    get_sheets_logger().log(site_url, topic, status, link, model_used)
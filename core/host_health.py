@@ -0,0 +1,401 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from urllib.parse import urlparse
+
+from paths import MONITORING_DIR
+
+DEFAULT_HEALTH_PATH = os.getenv("PBN_HOST_HEALTH_DB", os.path.join(MONITORING_DIR, 'host_health.db'))
+
+# Вес нового замера в скользящих средних
+EWMA_ALPHA = 0.3
+# Сколько сбоев подряд открывают цепь
+FAILURE_THRESHOLD = 3
+# Пауза перед пробой сайта после сбоев (сек), растет вдвое при каждой неудачной пробе
+FAILURE_COOLDOWN = 10 * 60
+# Неверный логин/пароль сам не исправится - проверяем реже
+AUTH_COOLDOWN = 6 * 3600
+MAX_COOLDOWN = 24 * 3600
+# Таймаут запроса = латентность * множитель, в пределах [MIN_TIMEOUT, таймаут паблишера]
+TIMEOUT_MULTIPLIER = 4
+MIN_TIMEOUT = 5.0
+
+AUTH_STATUSES = {401, 403}
+
+
+def host_key(site_url):
+    parsed = urlparse(site_url)
+    return f"{parsed.scheme}://{parsed.netloc.lower()}" if parsed.netloc else site_url.rstrip('/').lower()
+
+
+def credential_key(site_url, credentials):
+    """
+    Circuit key of one login/app password on a host. The password is only
+    stored as part of a hash.
+    """
+    login, app_password = credentials
+    digest = hashlib.sha256(f"{login}\x1f{app_password}".encode('utf-8')).hexdigest()[:16]
+    return f"{host_key(site_url)}#{digest}"
+
+
+class HostUnavailable(Exception):
+    """
+    Raised instead of sending a request to a host whose circuit is open.
+    """
+
+    def __init__(self, host, reason):
+        super().__init__(f"{host} is unavailable ({reason}), circuit open")
+        self.host = host
+        self.reason = reason
+
+
+class HostState:
+    __slots__ = ('host', 'latency', 'error_rate', 'failures', 'state', 'reason',
+                 'open_until', 'cooldown', 'last_status', 'updated_at', 'dirty')
+
+    def __init__(self, host, latency=None, error_rate=0.0, failures=0, state='closed', reason=None,
+                 open_until=0.0, cooldown=0.0, last_status=None, updated_at=0.0):
+        self.host = host
+        self.latency = latency
+        self.error_rate = error_rate
+        self.failures = failures
+        self.state = state
+        self.reason = reason
+        self.open_until = open_until
+        self.cooldown = cooldown
+        self.last_status = last_status
+        self.updated_at = updated_at
+        self.dirty = False
+
+    def as_row(self):
+        return (self.host, self.latency, self.error_rate, self.failures, self.state, self.reason,
+                self.open_until, self.cooldown, self.last_status, self.updated_at)
+
+
+class HostHealthRegistry:
+    """
+    Rolling latency/error EWMAs and a circuit breaker per satellite host.
+
+    A host's circuit opens after FAILURE_THRESHOLD failures in a row
+    (timeouts, connection errors, 5xx). A 401/403 to the credentials check
+    or a new post opens the circuit of that login/app password only (see
+    credential_key), so one stale password does not take down the other
+    tasks of the site. While a circuit is open, requests are refused
+    without touching the network; once the cooldown runs out the next
+    request is let through as a probe and either closes the circuit or
+    reopens it with a doubled cooldown. While that probe is in flight
+    (half-open) every other request is still refused. State is kept in
+    SQLite (when `path` is set) so known-bad sites stay skipped across runs.
+    """
+
+    def __init__(self, path=None, max_timeout=30.0, failure_threshold=FAILURE_THRESHOLD,
+                 failure_cooldown=FAILURE_COOLDOWN, auth_cooldown=AUTH_COOLDOWN):
+        self.path = path
+        self.max_timeout = max_timeout
+        self.failure_threshold = failure_threshold
+        self.failure_cooldown = failure_cooldown
+        self.auth_cooldown = auth_cooldown
+        self._lock = threading.Lock()
+        self._hosts = {}
+        self._probe_locks = {}
+        self.refused = 0
+        self._conn = None
+        if path:
+            self._conn = sqlite3.connect(path, check_same_thread=False)
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('''CREATE TABLE IF NOT EXISTS host_health
+                                  (host TEXT PRIMARY KEY,
+                                   latency REAL,
+                                   error_rate REAL,
+                                   failures INTEGER,
+                                   state TEXT,
+                                   reason TEXT,
+                                   open_until REAL,
+                                   cooldown REAL,
+                                   last_status TEXT,
+                                   updated_at REAL)''')
+            self._conn.commit()
+            for row in self._conn.execute('SELECT * FROM host_health'):
+                state = self._hosts[row[0]] = HostState(*row)
+                if state.reason == 'auth' and '#' not in state.host:
+                    # Раньше 401/403 размыкали цепь всего сайта - теперь только логина
+                    self._close(state).dirty = True
+
+    def _state(self, site_url):
+        """
+        Caller holds self._lock.
+        """
+        return self._state_of(host_key(site_url))
+
+    def _state_of(self, key):
+        """
+        Caller holds self._lock.
+        """
+        state = self._hosts.get(key)
+        if state is None:
+            state = self._hosts[key] = HostState(key)
+        return state
+
+    @staticmethod
+    def _keys(site_url, credentials):
+        keys = [host_key(site_url)]
+        if credentials and all(credentials):
+            keys.append(credential_key(site_url, credentials))
+        return keys
+
+    # --- decisions ---
+
+    def _probe_lock(self, key):
+        """
+        Caller holds self._lock.
+        """
+        lock = self._probe_locks.get(key)
+        if lock is None:
+            lock = self._probe_locks[key] = threading.Lock()
+        return lock
+
+    def admit(self, site_url, credentials=None):
+        """
+        Decides whether a request may be sent with `credentials` (login,
+        app password). Returns (True, probes) where `probes` are the keys of
+        the circuits this request is the single half-open probe of (its
+        record() call must pass them back), or (False, state) with the open
+        circuit that refuses it.
+        """
+        with self._lock:
+            probes = []
+            for key in self._keys(site_url, credentials):
+                state = self._hosts.get(key)
+                if state is None or state.state == 'closed':
+                    continue
+                if time.time() >= state.open_until and self._probe_lock(key).acquire(blocking=False):
+                    probes.append(key)
+                    continue
+                for probe in probes:
+                    self._probe_lock(probe).release()
+                self.refused += 1
+                return False, state
+            return True, tuple(probes)
+
+    def check(self, site_url, credentials=None):
+        """
+        Raises HostUnavailable if the host's or the credentials' circuit is
+        open (or half-open with another probe in flight). Returns the keys
+        this request probes (empty for a normal request).
+        """
+        admitted, probes = self.admit(site_url, credentials)
+        if not admitted:
+            raise HostUnavailable(probes.host, probes.reason)
+        return probes
+
+    def open_state(self, site_url, credentials=None):
+        """
+        Returns the open circuit (host or credentials) refusing requests, or None.
+        """
+        with self._lock:
+            for key in self._keys(site_url, credentials):
+                state = self._hosts.get(key)
+                if state is not None and state.state == 'open':
+                    return state
+            return None
+
+    def is_open(self, site_url, credentials=None):
+        return self.open_state(site_url, credentials) is not None
+
+    def needs_probe(self, site_url, credentials=None):
+        with self._lock:
+            for key in self._keys(site_url, credentials):
+                state = self._hosts.get(key)
+                if state is not None and state.state == 'open' and time.time() >= state.open_until \
+                        and not self._probe_lock(key).locked():
+                    return True
+            return False
+
+    def wait_probe(self, site_url, credentials=None):
+        """
+        Blocks while a probe of the host (or credentials) is in flight, so
+        concurrent tasks for the same site wait for its result instead of
+        probing it all at once.
+        """
+        with self._lock:
+            locks = [self._probe_lock(key) for key in self._keys(site_url, credentials)]
+        for lock in locks:
+            with lock:
+                pass
+
+    def timeout(self, site_url):
+        """
+        Request timeout for the host: a multiple of its usual latency, so a
+        hanging satellite is given up on long before the global timeout.
+        Probes of a failing host get the minimum. Only meant for idempotent
+        requests: the publisher never cuts a POST/PATCH short.
+        """
+        with self._lock:
+            state = self._hosts.get(host_key(site_url))
+            if state is None or state.latency is None:
+                return self.max_timeout
+            if state.state == 'open':
+                return min(MIN_TIMEOUT, self.max_timeout)
+            return max(MIN_TIMEOUT, min(self.max_timeout, state.latency * TIMEOUT_MULTIPLIER))
+
+    def rank(self, site_url, credentials=None):
+        """
+        Sort key for scheduling: 1 for a host (or credentials) with an open
+        circuit, else 0, so a stable sort only moves known-bad tasks to the end.
+        """
+        return 1 if self.is_open(site_url, credentials) else 0
+
+    def get(self, site_url):
+        with self._lock:
+            return self._state(site_url)
+
+    # --- recording ---
+
+    def record(self, site_url, seconds, status, auth_check=False, probes=(), credentials=None):
+        """
+        Feeds the outcome of one request (`status` is the HTTP code, or
+        'error' for timeouts and connection failures) into the host's state.
+        401/403 to an `auth_check` request (users/me, creating a post) open
+        the circuit of its `credentials`; elsewhere they are a per-request
+        error, e.g. an Author account not allowed to edit someone else's
+        post. `probes` are the keys returned by check(); their outcome closes
+        or reopens those circuits and lets the next probe through.
+        """
+        auth_failed = auth_check and status in AUTH_STATUSES
+        failed = not isinstance(status, int) or status >= 500
+        now = time.time()
+        changed = []
+        with self._lock:
+            state = self._state(site_url)
+            state.error_rate += EWMA_ALPHA * ((1.0 if failed or status == 429 else 0.0) - state.error_rate)
+            if isinstance(status, int):
+                state.latency = seconds if state.latency is None else \
+                    state.latency + EWMA_ALPHA * (seconds - state.latency)
+            state.last_status = str(status)
+            state.updated_at = now
+            state.dirty = True
+            probe = state.host in probes
+            if not failed:
+                state.failures = 0
+                if state.state == 'open' and status != 429:
+                    changed.append(self._close(state))
+            else:
+                state.failures += 1
+                if probe and state.state == 'open':
+                    # Неудачная проба
+                    changed.append(self._open(state, state.reason or 'errors', state.cooldown * 2, now))
+                elif state.failures >= self.failure_threshold and state.state == 'closed':
+                    changed.append(self._open(state, 'unreachable' if status == 'error' else 'errors',
+                                              self.failure_cooldown, now))
+
+            if credentials and all(credentials) and auth_check and not failed:
+                key = credential_key(site_url, credentials)
+                # Состояние логина заводится только после первого отказа
+                login = self._state_of(key) if auth_failed else self._hosts.get(key)
+            else:
+                login = None
+            if login is not None:
+                login.last_status, login.updated_at, login.dirty = str(status), now, True
+                if auth_failed:
+                    login.failures += 1
+                    if login.state == 'closed' or login.host in probes:
+                        changed.append(self._open(login, 'auth', max(self.auth_cooldown, login.cooldown * 2), now))
+                elif login.state == 'open' and status < 400:
+                    login.failures = 0
+                    changed.append(self._close(login))
+            for key in probes:
+                self._probe_lock(key).release()
+        for state in changed:
+            if state.state == 'open':
+                print(f"   🔴 {state.host}: цепь разомкнута ({state.reason}), "
+                      f"следующая проверка через {state.cooldown / 60:.0f} мин")
+            else:
+                print(f"   🟢 {state.host}: {'логин снова принят' if '#' in state.host else 'сайт снова доступен'}")
+        if changed:
+            self.flush()
+
+    def _close(self, state):
+        state.state, state.reason, state.cooldown, state.open_until = 'closed', None, 0.0, 0.0
+        return state
+
+    def _open(self, state, reason, cooldown, now):
+        cooldown = min(MAX_COOLDOWN, max(cooldown, self.failure_cooldown))
+        state.state, state.reason, state.cooldown, state.open_until = 'open', reason, cooldown, now + cooldown
+        return state
+
+    def reset(self, site_url=None):
+        """
+        Closes the circuits of one host and its credentials (or of all
+        hosts) and forgets their failures.
+        """
+        with self._lock:
+            if site_url:
+                key = host_key(site_url)
+                states = [self._state(site_url)] + [s for s in self._hosts.values() if s.host.startswith(key + '#')]
+            else:
+                states = list(self._hosts.values())
+            for state in states:
+                state.state, state.reason, state.failures, state.open_until, state.cooldown = 'closed', None, 0, 0.0, 0.0
+                state.error_rate = 0.0
+                state.dirty = True
+        self.flush()
+
+    # --- persistence & reporting ---
+
+    def flush(self):
+        if self._conn is None:
+            return
+        with self._lock:
+            rows = [s.as_row() for s in self._hosts.values() if s.dirty]
+            for state in self._hosts.values():
+                state.dirty = False
+            if not rows:
+                return
+            try:
+                self._conn.executemany('INSERT OR REPLACE INTO host_health VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', rows)
+                self._conn.commit()
+            except Exception as e:
+                print(f"⚠️ Ошибка записи состояния сайтов: {e}")
+
+    def stats(self):
+        with self._lock:
+            open_hosts = {s.host: s.reason for s in self._hosts.values() if s.state == 'open'}
+            hosts = sum(1 for key in self._hosts if '#' not in key)
+            return {'hosts': hosts, 'open': open_hosts, 'refused': self.refused}
+
+    def close(self):
+        self.flush()
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+_default_registry = None
+_default_lock = threading.Lock()
+
+
+def get_host_health():
+    """
+    Returns the process-wide host health registry (in-memory only until configured).
+    """
+    global _default_registry
+    with _default_lock:
+        if _default_registry is None:
+            _default_registry = HostHealthRegistry()
+        return _default_registry
+
+
+def configure_host_health(**kwargs):
+    """
+    Flushes and closes the current registry, then builds one from `kwargs`
+    (the CLI passes the health DB path).
+    """
+    global _default_registry
+    with _default_lock:
+        if _default_registry is not None:
+            _default_registry.close()
+        _default_registry = HostHealthRegistry(**kwargs)
+        return _default_registry
@@ -1,44 +1,214 @@
+import argparse
 import csv
 import json
 import os
-import sys
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse, urlunparse
 
-def csv_to_json(csv_file='sites_import.csv', json_file='sites_data.json'):
+from wp_publisher import get_publisher
+
+STYLES = ('expert', 'lifestyle', 'neutral')
+
+def row_to_site(row):
+    """
+    Maps one CSV row (Google Sheets export layout) to a task entry.
+    """
+    return {
+        "site_url": (row.get('Site URL') or '').strip(),
+        "login": (row.get('Login') or '').strip(),
+        "app_password": (row.get('App Password') or '').strip(),
+        "target_url": (row.get('Target Link') or '').strip(),
+        "anchor": (row.get('Anchor Text') or '').strip(),
+        "topic": (row.get('Article Topic') or '').strip(),
+        "author_style": (row.get('Author Style (expert/lifestyle/neutral)') or 'neutral').strip().lower()
+    }
+
+def iter_csv_sites(csv_file):
+    """
+    Lazily yields task entries from the CSV, one row at a time.
+    Rows without the essential fields are skipped.
+    """
+    with open(csv_file, mode='r', encoding='utf-8') as f:
+        reader = csv.DictReader(f)
+        for row in reader:
+            site_entry = row_to_site(row)
+            # Only add if essential fields are present
+            if site_entry["site_url"] and site_entry["app_password"]:
+                yield site_entry
+
+def normalize_url(url):
+    """
+    Returns the URL with a scheme (https by default), lowercase host and no
+    trailing slash, or None if it does not look like a site address.
+    """
+    url = (url or '').strip()
+    if not url:
+        return None
+    if '://' not in url:
+        url = 'https://' + url
+    parsed = urlparse(url)
+    host = parsed.hostname or ''
+    if parsed.scheme not in ('http', 'https') or not host or ' ' in url or \
+            ('.' not in host and host != 'localhost'):
+        return None
+    # Логин:пароль в адресе чувствительны к регистру - приводим только хост
+    userinfo, at, host_port = parsed.netloc.rpartition('@')
+    return urlunparse((parsed.scheme, userinfo + at + host_port.lower(), parsed.path.rstrip('/'), '', parsed.query, ''))
+
+def normalize_site(entry):
+    """
+    Cleans up one task entry. Returns (entry, None) or (None, problem).
+    The target link is only validated and kept verbatim: its trailing slash
+    and fragment are part of the link being promoted.
+    """
+    site_url = normalize_url(entry.get('site_url'))
+    if site_url is None:
+        return None, 'invalid_site_url'
+    if normalize_url(entry.get('target_url')) is None:
+        return None, 'invalid_target_url'
+    missing = [field for field in ('login', 'app_password', 'anchor', 'topic') if not entry.get(field)]
+    if missing:
+        return None, 'missing_' + '_'.join(missing)
+    style = entry.get('author_style') or 'neutral'
+    return dict(entry, site_url=site_url,
+                author_style=style if style in STYLES else 'neutral'), None
+
+def iter_normalized_sites(csv_file, problems):
+    """
+    Streams normalized, deduplicated task entries from the CSV. Rejected and
+    duplicate rows are collected in `problems` ({reason: [(site_url, line)]}).
+    """
+    seen = set()
+    with open(csv_file, mode='r', encoding='utf-8') as f:
+        for line_no, row in enumerate(csv.DictReader(f), 2):
+            raw = row_to_site(row)
+            if not any(raw.values()):
+                continue
+            entry, problem = normalize_site(raw)
+            if problem:
+                problems.setdefault(problem, []).append((raw['site_url'], line_no))
+                continue
+            key = (entry['site_url'], entry['login'], entry['target_url'], entry['anchor'],
+                   entry['topic'], entry['author_style'])
+            if key in seen:
+                problems.setdefault('duplicate', []).append((entry['site_url'], line_no))
+                continue
+            seen.add(key)
+            yield entry
+
+def preflight_site(site_url, login, app_password, timeout=10):
+    """
+    Checks that the REST API answers and the app password is accepted.
+    Returns (status, detail) with status 'ok', 'unreachable', 'no_rest_api'
+    or 'unauthorized'.
+    """
+    publisher = get_publisher()
+    try:
+        response = publisher.request('GET', site_url, '/wp-json/', timeout=timeout, params={'_fields': 'namespaces'})
+    except Exception as e:
+        return 'unreachable', type(e).__name__
+    if response.status_code != 200:
+        return 'no_rest_api', f"/wp-json/ -> {response.status_code}"
+    try:
+        namespaces = response.json().get('namespaces') or []
+    except ValueError:
+        return 'no_rest_api', "/wp-json/ is not JSON"
+    if 'wp/v2' not in namespaces:
+        return 'no_rest_api', "wp/v2 namespace missing"
+    try:
+        response = publisher.request('GET', site_url, '/wp-json/wp/v2/users/me', login, app_password,
+                                     timeout=timeout, params={'_fields': 'id'})
+    except Exception as e:
+        return 'unreachable', type(e).__name__
+    if response.status_code in (401, 403):
+        return 'unauthorized', f"users/me -> {response.status_code}"
+    if response.status_code != 200:
+        return 'unreachable', f"users/me -> {response.status_code}"
+    return 'ok', ''
+
+def run_preflight(credentials, workers=16, timeout=10):
+    """
+    Pre-flights every distinct (site_url, login, app_password) on a bounded
+    thread pool. Yields ((site_url, login, app_password), status, detail).
+    """
+    window = deque()
+    credentials = iter(credentials)
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="preflight") as executor:
+        while True:
+            for cred in credentials:
+                window.append((cred, executor.submit(preflight_site, *cred, timeout=timeout)))
+                if len(window) >= workers * 2:
+                    break
+            if not window:
+                return
+            cred, future = window.popleft()
+            yield (cred, *future.result())
+
+def write_report(report_file, rows, problems):
+    with open(report_file, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['Site URL', 'Login', 'Status', 'Detail', 'Tasks'])
+        writer.writerows(rows)
+        for problem, sites in sorted(problems.items()):
+            for site_url, line_no in sites:
+                writer.writerow([site_url, '', problem, f"CSV line {line_no}", 1])
+
+def csv_to_json(csv_file='sites_import.csv', json_file='sites_data.json', preflight=True,
+                workers=16, timeout=10, report_file=None):
     """
     Converts a Google Sheets exported CSV into the formatted sites_data.json.
+
+    Rows are normalized and deduplicated; with `preflight` every satellite's
+    REST API and app password are checked concurrently and tasks for sites
+    that fail are left out. Rejected rows and failing sites are written to
+    `report_file` (default: <json_file>.preflight.csv).
     """
     if not os.path.exists(csv_file):
         print(f"❌ Ошибка: Файл {csv_file} не найден. Сначала экспортируйте таблицу в CSV.")
         return
 
-    sites_data = []
     try:
-        with open(csv_file, mode='r', encoding='utf-8') as f:
-            reader = csv.DictReader(f)
-            for row in reader:
-                # Basic validation and cleaning
-                site_entry = {
-                    "site_url": row.get('Site URL', '').strip(),
-                    "login": row.get('Login', '').strip(),
-                    "app_password": row.get('App Password', '').strip(),
-                    "target_url": row.get('Target Link', '').strip(),
-                    "anchor": row.get('Anchor Text', '').strip(),
-                    "topic": row.get('Article Topic', '').strip(),
-                    "author_style": row.get('Author Style (expert/lifestyle/neutral)', 'neutral').strip().lower()
-                }
-                
-                # Only add if essential fields are present
-                if site_entry["site_url"] and site_entry["app_password"]:
-                    sites_data.append(site_entry)
+        problems = {}
+        tasks_by_site = OrderedDict()
+        for entry in iter_normalized_sites(csv_file, problems):
+            tasks_by_site.setdefault((entry['site_url'], entry['login'], entry['app_password']), []).append(entry)
+
+        report_rows = []
+        if preflight and tasks_by_site:
+            print(f"🩺 Проверка {len(tasks_by_site)} сайтов ({workers} потоков)...")
+            for cred, status, detail in run_preflight(list(tasks_by_site), workers, timeout):
+                if status != 'ok':
+                    site_tasks = tasks_by_site.pop(cred)
+                    report_rows.append([cred[0], cred[1], status, detail, len(site_tasks)])
+                    print(f"   ❌ {cred[0]}: {status} {detail}")
 
+        sites_data = [task for site_tasks in tasks_by_site.values() for task in site_tasks]
         with open(json_file, 'w', encoding='utf-8') as f:
             json.dump(sites_data, f, indent=2, ensure_ascii=False)
-            
+
         print(f"✅ Успех! {len(sites_data)} сайтов импортировано в {json_file}")
-        
+        if report_rows or problems:
+            report_file = report_file or os.path.splitext(json_file)[0] + '.preflight.csv'
+            write_report(report_file, report_rows, problems)
+            skipped = sum(row[4] for row in report_rows)
+            print(f"⚠️ Отброшено: {skipped} задач на {len(report_rows)} проблемных сайтах, "
+                  f"{sum(len(v) for v in problems.values())} строк CSV ({', '.join(sorted(problems)) or '-'}). "
+                  f"Отчет: {report_file}")
+
     except Exception as e:
         print(f"❌ Ошибка при конвертации: {e}")
 
 if __name__ == "__main__":
-    csv_file_arg = sys.argv[1] if len(sys.argv) > 1 else 'sites_import.csv'
-    csv_to_json(csv_file_arg)
+    parser = argparse.ArgumentParser(description="Import satellites from a Google Sheets CSV export.")
+    parser.add_argument('csv_file', nargs='?', default='sites_import.csv')
+    parser.add_argument('--output', default='sites_data.json')
+    parser.add_argument('--report', default=None,
+                        help="CSV report of rejected rows and failing sites (default: <output>.preflight.csv)")
+    parser.add_argument('--no-preflight', action='store_true',
+                        help="Only normalize and deduplicate, do not contact the satellites")
+    parser.add_argument('--workers', type=int, default=16, help="Concurrent pre-flight checks (default: 16)")
+    parser.add_argument('--timeout', type=float, default=10, help="Per-request timeout in seconds (default: 10)")
+    args = parser.parse_args()
+    csv_to_json(args.csv_file, args.output, preflight=not args.no_preflight, workers=args.workers,
+                timeout=args.timeout, report_file=args.report)
@@ -0,0 +1,353 @@
+import html
+import math
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import Counter, OrderedDict
+
+import relevance
+from wp_publisher import get_publisher
+from paths import MONITORING_DIR
+
+DEFAULT_INDEX_PATH = os.getenv("PBN_POST_INDEX_DB", os.path.join(MONITORING_DIR, 'post_index.db'))
+
+# Предохранитель из MANAGEMENT.md: не трогаем посты, где уже больше 4 ссылок
+MAX_LINKS_PER_POST = 4
+# Как часто (сек) перезапрашивать изменения одного сайта в рамках запуска
+REFRESH_INTERVAL = 600
+PER_PAGE = 100
+LIST_FIELDS = 'id,link,modified,title,excerpt'
+# Сколько сайтов держим с готовой TF-IDF матрицей (LRU), остальные пересобираются из SQLite
+MAX_CACHED_SITES = 32
+
+STOP_WORDS = {
+    'и', 'в', 'во', 'не', 'что', 'он', 'на', 'я', 'с', 'со', 'как', 'а', 'то', 'все', 'она', 'так', 'его',
+    'но', 'да', 'ты', 'к', 'у', 'же', 'вы', 'за', 'бы', 'по', 'только', 'ее', 'мне', 'было', 'вот', 'от',
+    'меня', 'еще', 'нет', 'о', 'из', 'ему', 'для', 'или', 'это', 'этот', 'при', 'без', 'под', 'над',
+    'the', 'and', 'for', 'with', 'that', 'this', 'from', 'are', 'was', 'you', 'your', 'how', 'what',
+}
+
+TAG_RE = re.compile(r'<[^>]+>')
+WORD_RE = re.compile(r'\w+', re.UNICODE)
+LINK_RE = re.compile(r'<a\s', re.IGNORECASE)
+HREF_RE = re.compile(r'<a\s[^>]*?href\s*=\s*(?:"([^"]*)"|\'([^\']*)\'|([^\s>]+))', re.IGNORECASE)
+
+
+def strip_html(text):
+    return html.unescape(TAG_RE.sub(' ', text or ''))
+
+
+def tokenize(text):
+    """
+    Lowercased word stems. Russian words are cut to their first 6 letters,
+    a cheap stand-in for stemming that folds most case endings together.
+    """
+    text = strip_html(text).lower().replace('ё', 'е')
+    terms = []
+    for word in WORD_RE.findall(text):
+        if len(word) < 3 or word in STOP_WORDS or word.isdigit():
+            continue
+        terms.append(word[:6])
+    return terms
+
+
+class PostCatalogue:
+    """
+    Local per-site inverted index (term -> post IDs) of satellite posts.
+
+    The first refresh pages through the whole archive with small `_fields`
+    payloads; later ones only ask for posts with `modified_after` the newest
+    one already indexed.
+
+    Topics announced with expect() are ranked together: the first search()
+    for a site scores all of them in one matrix multiply and keeps the
+    answers for the tasks that follow.
+    """
+
+    def __init__(self, path=DEFAULT_INDEX_PATH, refresh_interval=REFRESH_INTERVAL, max_cached_sites=MAX_CACHED_SITES):
+        self.path = path
+        self.refresh_interval = refresh_interval
+        self.max_cached_sites = max(1, max_cached_sites)
+        self._lock = threading.Lock()
+        self._site_locks = {}
+        self._refreshed = {}
+        self._vectors = OrderedDict()
+        self._expected = {}
+        self._ranked = {}
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.executescript('''
+            CREATE TABLE IF NOT EXISTS posts
+                (site TEXT, post_id INTEGER, link TEXT, title TEXT, modified TEXT, length INTEGER,
+                 PRIMARY KEY (site, post_id));
+            CREATE TABLE IF NOT EXISTS postings
+                (site TEXT, term TEXT, post_id INTEGER, tf INTEGER,
+                 PRIMARY KEY (site, term, post_id));
+            CREATE INDEX IF NOT EXISTS idx_postings_post ON postings (site, post_id);
+            CREATE TABLE IF NOT EXISTS sync_state
+                (site TEXT PRIMARY KEY, last_modified TEXT, synced_at REAL);
+        ''')
+        self._conn.commit()
+        self.pages_fetched = 0
+
+    @staticmethod
+    def site_key(site_url):
+        return site_url.rstrip('/').lower()
+
+    def _site_lock(self, site):
+        with self._lock:
+            return self._site_locks.setdefault(site, threading.Lock())
+
+    def refresh(self, site_url, username, app_password):
+        """
+        Pulls new and modified posts into the index. Returns the number of posts indexed.
+        """
+        site = self.site_key(site_url)
+        with self._site_lock(site):
+            if time.monotonic() - self._refreshed.get(site, -math.inf) < self.refresh_interval:
+                return 0
+            with self._lock:
+                row = self._conn.execute('SELECT last_modified FROM sync_state WHERE site = ?', (site,)).fetchone()
+            last_modified = row[0] if row else None
+
+            params = {'per_page': PER_PAGE, '_fields': LIST_FIELDS, 'orderby': 'modified', 'order': 'asc'}
+            if last_modified:
+                params['modified_after'] = last_modified
+            indexed, page, total_pages = 0, 1, 1
+            while page <= total_pages:
+                params['page'] = page
+                response = get_publisher().request('GET', site_url, '/wp-json/wp/v2/posts',
+                                                   username, app_password, params=params)
+                if response.status_code != 200:
+                    print(f"   ⚠️ Не удалось получить список постов: {response.status_code}")
+                    break
+                self.pages_fetched += 1
+                total_pages = int(response.headers.get('X-WP-TotalPages', 1) or 1)
+                posts = response.json()
+                self._index_posts(site, posts)
+                indexed += len(posts)
+                if posts:
+                    last_modified = max(last_modified or '', *(p.get('modified', '') for p in posts))
+                page += 1
+
+            with self._lock:
+                self._conn.execute('INSERT OR REPLACE INTO sync_state VALUES (?, ?, ?)',
+                                   (site, last_modified, time.time()))
+                self._conn.commit()
+            self._refreshed[site] = time.monotonic()
+            return indexed
+
+    def _index_posts(self, site, posts):
+        with self._lock:
+            for post in posts:
+                title = (post.get('title') or {}).get('rendered', '')
+                excerpt = (post.get('excerpt') or {}).get('rendered', '')
+                # Заголовок весит больше, чем анонс
+                terms = Counter(tokenize(title) * 2 + tokenize(excerpt))
+                self._conn.execute('DELETE FROM postings WHERE site = ? AND post_id = ?', (site, post['id']))
+                self._conn.execute('INSERT OR REPLACE INTO posts VALUES (?, ?, ?, ?, ?, ?)',
+                                   (site, post['id'], post.get('link'), strip_html(title).strip(),
+                                    post.get('modified'), sum(terms.values())))
+                self._conn.executemany('INSERT INTO postings VALUES (?, ?, ?, ?)',
+                                       [(site, term, post['id'], tf) for term, tf in terms.items()])
+            self._conn.commit()
+            if posts:
+                self._vectors.pop(site, None)
+                self._ranked.pop(site, None)
+
+    def forget(self, site_url, post_id):
+        site = self.site_key(site_url)
+        with self._lock:
+            self._conn.execute('DELETE FROM postings WHERE site = ? AND post_id = ?', (site, post_id))
+            self._conn.execute('DELETE FROM posts WHERE site = ? AND post_id = ?', (site, post_id))
+            self._conn.commit()
+            self._vectors.pop(site, None)
+            self._ranked.pop(site, None)
+
+    def _site_vectors(self, site):
+        """
+        Sparse TF-IDF matrix of all indexed posts of the site, rebuilt only
+        after the site's posts change. Only the `max_cached_sites` most
+        recently used sites are kept. Caller holds self._lock.
+        """
+        index = self._vectors.get(site)
+        if index is not None:
+            self._vectors.move_to_end(site)
+        else:
+            docs = {}
+            for post_id, term, tf in self._conn.execute(
+                    'SELECT post_id, term, tf FROM postings WHERE site = ?', (site,)):
+                docs.setdefault(post_id, {})[term] = tf
+            index = relevance.RelevanceIndex(docs.keys(), list(docs.values()))
+            self._vectors[site] = index
+            while len(self._vectors) > self.max_cached_sites:
+                self._vectors.popitem(last=False)
+        return index
+
+    def search_many(self, site_url, topics, limit=5):
+        """
+        Ranks indexed posts of the site against every topic of a batch.
+        With numpy/scipy this is one sparse matrix multiply for the whole
+        batch; otherwise each topic is looked up in the SQLite index.
+        Returns a list (one per topic) of [(post_id, link, score)], best first.
+        """
+        if not relevance.available():
+            return [self._search_sql(site_url, topic, limit) for topic in topics]
+        site = self.site_key(site_url)
+        with self._lock:
+            index = self._site_vectors(site)
+            if not len(index):
+                return [[] for _ in topics]
+            ranked = index.top_k([Counter(tokenize(topic)) for topic in topics], k=limit)
+            return [[(post_id, self._link(site, post_id), score) for post_id, score in top] for top in ranked]
+
+    def expect(self, site_url, topic):
+        """
+        Announces that `topic` will be looked up on the site soon, so it is
+        ranked in the same batch as the site's next search().
+        """
+        if not relevance.available():
+            return
+        with self._lock:
+            self._expected.setdefault(self.site_key(site_url), set()).add(topic)
+
+    def search(self, site_url, topic, limit=5):
+        """
+        Ranks the site's posts against `topic`. Without a stored answer every
+        topic expected for the site is scored in the same search_many() call
+        and the other answers are kept until the index of the site changes.
+        """
+        if not relevance.available():
+            return self._search_sql(site_url, topic, limit)
+        site = self.site_key(site_url)
+        with self._lock:
+            ranked = self._ranked.get(site)
+            if ranked and (topic, limit) in ranked:
+                return ranked.pop((topic, limit))
+            topics = [topic] + sorted(self._expected.pop(site, set()) - {topic})
+        results = self.search_many(site_url, topics, limit)
+        if len(topics) > 1:
+            with self._lock:
+                self._ranked.setdefault(site, {}).update(
+                    ((other, limit), result) for other, result in zip(topics[1:], results[1:]))
+        return results[0]
+
+    def _link(self, site, post_id):
+        row = self._conn.execute('SELECT link FROM posts WHERE site = ? AND post_id = ?', (site, post_id)).fetchone()
+        return row[0] if row else None
+
+    def _search_sql(self, site_url, topic, limit=5):
+        """
+        Ranks indexed posts of the site against `topic` with TF-IDF.
+        Returns [(post_id, link, score)], best first.
+        """
+        site = self.site_key(site_url)
+        terms = set(tokenize(topic))
+        if not terms:
+            return []
+        with self._lock:
+            total = self._conn.execute('SELECT COUNT(*) FROM posts WHERE site = ?', (site,)).fetchone()[0]
+            if not total:
+                return []
+            scores = Counter()
+            for term in terms:
+                rows = self._conn.execute('SELECT post_id, tf FROM postings WHERE site = ? AND term = ?',
+                                          (site, term)).fetchall()
+                if not rows:
+                    continue
+                idf = math.log(1 + total / len(rows))
+                for post_id, tf in rows:
+                    scores[post_id] += (1 + math.log(tf)) * idf
+            return [(post_id, self._link(site, post_id), score) for post_id, score in scores.most_common(limit)]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def links_to(content, target_url):
+    """
+    True if the HTML already has a link to `target_url` (hrefs are compared
+    unescaped, so '&amp;' in the markup matches '&' in the URL).
+    """
+    return any(html.unescape(next(filter(None, groups), '')) == target_url for groups in HREF_RE.findall(content))
+
+
+def insert_link(content, target_url, anchor, topic):
+    """
+    Adds the anchor link at the end of the paragraph that best matches the
+    topic (or a new paragraph if there are none).
+    """
+    link = f'<a href="{html.escape(target_url, quote=True)}">{html.escape(anchor)}</a>'
+    paragraphs = content.split('</p>')
+    if len(paragraphs) < 2:
+        return content + f'\n<p>Читайте также: {link}.</p>'
+    terms = set(tokenize(topic))
+    best = max(range(len(paragraphs) - 1),
+               key=lambda i: (len(terms & set(tokenize(paragraphs[i]))), -i))
+    paragraph = paragraphs[best].rstrip()
+    if not TAG_RE.sub('', paragraph).rstrip().endswith(('.', '!', '?', ':', ';')):
+        paragraph += '.'
+    paragraphs[best] = paragraph + f' Читайте также: {link}.'
+    return '</p>'.join(paragraphs)
+
+
+def link_existing_post(site_url, username, app_password, target_url, anchor, topic, catalogue, candidates=5):
+    """
+    Finds the most relevant existing post and adds the anchor link to it.
+    Returns {'id', 'link'} of the updated post, or None.
+    """
+    catalogue.refresh(site_url, username, app_password)
+    publisher = get_publisher()
+    for post_id, link, score in catalogue.search(site_url, topic, limit=candidates):
+        response = publisher.request('GET', site_url, f'/wp-json/wp/v2/posts/{post_id}', username, app_password,
+                                     params={'context': 'edit', '_fields': 'id,link,content'})
+        if response.status_code == 404:
+            catalogue.forget(site_url, post_id)
+            continue
+        if response.status_code != 200:
+            print(f"   ⚠️ Не удалось открыть пост {post_id}: {response.status_code}")
+            continue
+        content = (response.json().get('content') or {}).get('raw', '')
+        if links_to(content, target_url):
+            print(f"   ⏭️ Пост {post_id} уже ссылается на {target_url}")
+            return None
+        if len(LINK_RE.findall(content)) > MAX_LINKS_PER_POST:
+            continue
+        response = publisher.request('PATCH', site_url, f'/wp-json/wp/v2/posts/{post_id}', username, app_password,
+                                     params={'_fields': 'id,link'},
+                                     json={'content': insert_link(content, target_url, anchor, topic)})
+        if response.status_code == 200:
+            return {'id': post_id, 'link': response.json().get('link', link)}
+        print(f"   ⚠️ Не удалось обновить пост {post_id}: {response.status_code}")
+    return None
+
+
+_default_catalogue = None
+_default_lock = threading.Lock()
+
+
+def get_catalogue():
+    """
+    Returns the process-wide post catalogue backed by DEFAULT_INDEX_PATH.
+    """
+    global _default_catalogue
+    with _default_lock:
+        if _default_catalogue is None:
+            _default_catalogue = PostCatalogue()
+        return _default_catalogue
+
+
+def configure_catalogue(**kwargs):
+    """
+    Closes the current index DB (dropping its cached matrices) and opens a
+    catalogue with `kwargs`.
+    """
+    global _default_catalogue
+    with _default_lock:
+        if _default_catalogue is not None:
+            _default_catalogue.close()
+        _default_catalogue = PostCatalogue(**kwargs)
+        return _default_catalogue
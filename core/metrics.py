@@ -0,0 +1,297 @@
+import bisect
+import os
+import sqlite3
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from paths import MONITORING_DIR
+
+DEFAULT_METRICS_DB = os.getenv("PBN_METRICS_DB", os.path.join(MONITORING_DIR, 'pbn_metrics.db'))
+
+BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+# Сколько последних замеров на этап держим в памяти для p50/p95/p99
+SAMPLES_PER_STAGE = 50_000
+# Сколько строк копим перед записью в SQLite
+DB_BATCH_SIZE = 200
+
+# Итоги задач (пишет event_sinks.SQLiteSink)
+TASK_EVENTS_TABLE = '''CREATE TABLE IF NOT EXISTS task_events
+                       (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        run_id TEXT,
+                        timestamp REAL,
+                        site TEXT,
+                        topic TEXT,
+                        style TEXT,
+                        status TEXT,
+                        post_url TEXT,
+                        updated_post TEXT,
+                        model TEXT)'''
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(q / 100 * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{k}="{str(v)}"' for k, v in sorted(labels)) + '}'
+
+
+class Metrics:
+    """
+    In-process latency histograms and counters for the publishing hot path.
+
+    Exported in OpenMetrics text format on an optional local /metrics
+    endpoint. Prometheus series are labelled by stage/status only to keep
+    cardinality low; every sample is also written (batched) to the SQLite
+    metrics DB together with the satellite, for per-host percentiles.
+    """
+
+    def __init__(self, db_path=None, run_id=None):
+        self.db_path = db_path
+        self.run_id = run_id or datetime.now().strftime('%Y%m%dT%H%M%S')
+        self._lock = threading.Lock()
+        self._buckets = defaultdict(lambda: [0] * (len(BUCKETS) + 1))
+        self._sums = defaultdict(float)
+        self._counts = defaultdict(int)
+        self._samples = defaultdict(lambda: deque(maxlen=SAMPLES_PER_STAGE))
+        self._counters = defaultdict(float)
+        self._pending_samples = []
+        self._pending_tokens = []
+        self._conn = None
+        self._server = None
+
+    # --- recording ---
+
+    def observe(self, stage, seconds, site=None, status='ok'):
+        with self._lock:
+            self._buckets[stage][bisect.bisect_left(BUCKETS, seconds)] += 1
+            self._sums[stage] += seconds
+            self._counts[stage] += 1
+            self._samples[stage].append(seconds)
+            if self.db_path:
+                self._pending_samples.append((self.run_id, time.time(), stage, site, seconds, str(status)))
+                flush = len(self._pending_samples) >= DB_BATCH_SIZE
+            else:
+                flush = False
+        if flush:
+            self.flush()
+
+    @contextmanager
+    def timer(self, stage, site=None):
+        started = time.perf_counter()
+        status = 'ok'
+        try:
+            yield
+        except Exception:
+            status = 'exception'
+            raise
+        finally:
+            self.observe(stage, time.perf_counter() - started, site, status)
+
+    def inc(self, name, value=1, **labels):
+        with self._lock:
+            self._counters[(name, tuple(sorted(labels.items())))] += value
+
+    def record_tokens(self, model, prompt_tokens, output_tokens, total_tokens):
+        self.inc('pbn_gemini_tokens', prompt_tokens or 0, kind='prompt', model=model)
+        self.inc('pbn_gemini_tokens', output_tokens or 0, kind='output', model=model)
+        if self.db_path:
+            with self._lock:
+                self._pending_tokens.append((self.run_id, time.time(), model, prompt_tokens or 0,
+                                             output_tokens or 0, total_tokens or 0))
+
+    # --- reporting ---
+
+    def percentiles(self):
+        """
+        {stage: {'count', 'p50', 'p95', 'p99'}} over the recent in-memory samples.
+        """
+        with self._lock:
+            samples = {stage: list(values) for stage, values in self._samples.items()}
+        return {stage: {'count': len(values),
+                        'p50': percentile(values, 50),
+                        'p95': percentile(values, 95),
+                        'p99': percentile(values, 99)} for stage, values in samples.items()}
+
+    def counters(self):
+        with self._lock:
+            return dict(self._counters)
+
+    def render(self):
+        """
+        Returns all metrics in OpenMetrics text format.
+        """
+        lines = ['# TYPE pbn_stage_seconds histogram']
+        with self._lock:
+            for stage, buckets in sorted(self._buckets.items()):
+                cumulative = 0
+                for bound, count in zip(BUCKETS + ('+Inf',), buckets):
+                    cumulative += count
+                    lines.append(f'pbn_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+                lines.append(f'pbn_stage_seconds_sum{{stage="{stage}"}} {self._sums[stage]}')
+                lines.append(f'pbn_stage_seconds_count{{stage="{stage}"}} {self._counts[stage]}')
+            names = sorted({name for name, _ in self._counters})
+            for name in names:
+                lines.append(f'# TYPE {name} counter')
+                for (counter, labels), value in sorted(self._counters.items()):
+                    if counter == name:
+                        lines.append(f'{name}_total{_labels(labels)} {value}')
+        lines.append('# EOF')
+        return '\n'.join(lines) + '\n'
+
+    def serve(self, port, host='127.0.0.1'):
+        """
+        Starts a background HTTP server exposing /metrics.
+        """
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = metrics.render().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/openmetrics-text; version=1.0.0; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=self._server.serve_forever, name="metrics-http", daemon=True).start()
+        print(f"📈 Metrics: http://{host}:{self._server.server_address[1]}/metrics")
+        return self._server
+
+    # --- persistence ---
+
+    def _db(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('''CREATE TABLE IF NOT EXISTS stage_samples
+                                  (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                                   run_id TEXT,
+                                   timestamp REAL,
+                                   stage TEXT,
+                                   site TEXT,
+                                   seconds REAL,
+                                   status TEXT)''')
+            self._conn.execute('CREATE INDEX IF NOT EXISTS idx_stage_samples_ts ON stage_samples (timestamp, stage)')
+            self._conn.execute('CREATE INDEX IF NOT EXISTS idx_stage_samples_site ON stage_samples (site, stage)')
+            self._conn.execute('''CREATE TABLE IF NOT EXISTS token_usage
+                                  (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                                   run_id TEXT,
+                                   timestamp REAL,
+                                   model TEXT,
+                                   prompt_tokens INTEGER,
+                                   output_tokens INTEGER,
+                                   total_tokens INTEGER)''')
+            self._conn.execute(TASK_EVENTS_TABLE)
+            self._conn.commit()
+        return self._conn
+
+    def flush(self):
+        if not self.db_path:
+            return
+        with self._lock:
+            samples, self._pending_samples = self._pending_samples, []
+            tokens, self._pending_tokens = self._pending_tokens, []
+            if not samples and not tokens:
+                return
+            try:
+                db = self._db()
+                db.executemany('INSERT INTO stage_samples (run_id, timestamp, stage, site, seconds, status) '
+                               'VALUES (?, ?, ?, ?, ?, ?)', samples)
+                db.executemany('INSERT INTO token_usage (run_id, timestamp, model, prompt_tokens, output_tokens, '
+                               'total_tokens) VALUES (?, ?, ?, ?, ?, ?)', tokens)
+                db.commit()
+            except Exception as e:
+                print(f"⚠️ Ошибка записи метрик в БД: {e}")
+
+    def close(self):
+        self.flush()
+        if self._server is not None:
+            self._server.shutdown()
+            self._server = None
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+_default_metrics = None
+_default_lock = threading.Lock()
+
+
+def get_metrics():
+    """
+    Returns the process-wide metrics registry (in-memory only until configured).
+    """
+    global _default_metrics
+    with _default_lock:
+        if _default_metrics is None:
+            _default_metrics = Metrics()
+        return _default_metrics
+
+
+def configure_metrics(db_path=DEFAULT_METRICS_DB, port=None, run_id=None):
+    """
+    Replaces the process-wide registry; optionally persists samples to
+    `db_path` and serves /metrics on `port`.
+    """
+    global _default_metrics
+    with _default_lock:
+        if _default_metrics is not None:
+            _default_metrics.close()
+        _default_metrics = Metrics(db_path=db_path, run_id=run_id)
+    if port is not None:
+        _default_metrics.serve(port)
+    return _default_metrics
+
+
+def merge_metrics_dbs(target, sources):
+    """
+    Copies stage samples, token usage and task events from per-process metrics DBs into
+    `target` in a single transaction. Missing sources are ignored.
+    """
+    sources = [path for path in sources if path and os.path.exists(path)]
+    if not sources:
+        return 0
+    registry = Metrics(db_path=target)
+    db = registry._db()
+    merged = 0
+    try:
+        for i, path in enumerate(sources):
+            db.execute(f'ATTACH DATABASE ? AS shard{i}', (path,))
+        with db:
+            for i in range(len(sources)):
+                merged += db.execute(f'INSERT INTO stage_samples (run_id, timestamp, stage, site, seconds, status) '
+                                     f'SELECT run_id, timestamp, stage, site, seconds, status '
+                                     f'FROM shard{i}.stage_samples').rowcount
+                db.execute(f'INSERT INTO token_usage (run_id, timestamp, model, prompt_tokens, output_tokens, '
+                           f'total_tokens) SELECT run_id, timestamp, model, prompt_tokens, output_tokens, '
+                           f'total_tokens FROM shard{i}.token_usage')
+                has_events = db.execute(f"SELECT 1 FROM shard{i}.sqlite_master WHERE type = 'table' "
+                                        f"AND name = 'task_events'").fetchone()
+                if has_events:
+                    db.execute(f'INSERT INTO task_events (run_id, timestamp, site, topic, style, status, post_url, '
+                               f'updated_post, model) SELECT run_id, timestamp, site, topic, style, status, '
+                               f'post_url, updated_post, model FROM shard{i}.task_events')
+        for i in range(len(sources)):
+            db.execute(f'DETACH DATABASE shard{i}')
+    finally:
+        registry.close()
+    return merged
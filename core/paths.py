@@ -0,0 +1,4 @@
+import os
+
+# Все базы времени выполнения (метрики, журнал, кеши) лежат рядом с дашбордом
+MONITORING_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'monitoring')
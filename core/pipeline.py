@@ -0,0 +1,155 @@
+import queue
+import threading
+import time
+
+_STOP = object()
+
+
+class Stage:
+    """
+    One pipeline step: `func(item)` runs on `workers` threads and its return
+    value is handed to the next stage. `None` items are passed through
+    untouched so skipped tasks keep their place in the output order.
+    """
+
+    def __init__(self, name, func, workers=1):
+        self.name = name
+        self.func = func
+        self.workers = max(1, workers)
+        self.processed = 0
+        self.errors = 0
+        self.busy_seconds = 0.0
+        self.max_depth = 0
+        self.input = None
+        self._alive = 0
+        self._lock = threading.Lock()
+
+    def stats(self, elapsed):
+        with self._lock:
+            return {
+                'workers': self.workers,
+                'processed': self.processed,
+                'errors': self.errors,
+                'queue_depth': self.input.qsize() if self.input else 0,
+                'max_queue_depth': self.max_depth,
+                'busy_seconds': round(self.busy_seconds, 3),
+                'throughput_per_sec': round(self.processed / elapsed, 3) if elapsed else 0.0,
+            }
+
+
+class Pipeline:
+    """
+    Streams items through stages connected by bounded queues.
+
+    Each stage has its own worker threads, so stage N+1 of one item overlaps
+    with stage N of the next one. Bounded queues apply backpressure to the
+    feeder, and at most `max_in_flight` items exist between the input and the
+    ordered output, which keeps memory flat regardless of input size.
+    Results are yielded in input order.
+    """
+
+    def __init__(self, stages, queue_size=50, max_in_flight=None, report_interval=None):
+        self.stages = stages
+        self.queue_size = max(1, queue_size)
+        self.max_in_flight = max_in_flight or (
+            self.queue_size * (len(stages) + 1) + sum(s.workers for s in stages))
+        self.report_interval = report_interval
+        self._started = None
+        self._finished = None
+
+    def _worker(self, index):
+        stage = self.stages[index]
+        next_queue = self.stages[index + 1].input if index + 1 < len(self.stages) else self._output
+        while True:
+            depth = stage.input.qsize()
+            item = stage.input.get()
+            if item is _STOP:
+                break
+            seq, payload = item
+            if payload is not None:
+                started = time.monotonic()
+                try:
+                    payload = stage.func(payload)
+                    failed = False
+                except Exception as e:
+                    print(f"❌ Stage '{stage.name}' failed: {e}")
+                    payload = None
+                    failed = True
+                with stage._lock:
+                    stage.processed += 1
+                    stage.errors += failed
+                    stage.busy_seconds += time.monotonic() - started
+                    stage.max_depth = max(stage.max_depth, depth)
+            next_queue.put((seq, payload))
+
+        with stage._lock:
+            stage._alive -= 1
+            last = stage._alive == 0
+        if last:
+            if index + 1 < len(self.stages):
+                for _ in range(self.stages[index + 1].workers):
+                    next_queue.put(_STOP)
+            else:
+                next_queue.put(_STOP)
+
+    def _feed(self, items):
+        first = self.stages[0]
+        try:
+            for seq, item in enumerate(items):
+                self._window.acquire()
+                first.input.put((seq, item))
+        except Exception as e:
+            print(f"❌ Pipeline input failed: {e}")
+        finally:
+            for _ in range(first.workers):
+                first.input.put(_STOP)
+
+    def _report(self):
+        while not self._done.wait(self.report_interval):
+            depths = ", ".join(f"{s.name}={s.input.qsize()}" for s in self.stages)
+            print(f"📈 Pipeline queues: {depths}, done={self._emitted}")
+
+    def run(self, items):
+        """
+        Feeds `items` through the stages and yields final results in order.
+        """
+        self._window = threading.BoundedSemaphore(self.max_in_flight)
+        self._output = queue.Queue()
+        self._done = threading.Event()
+        self._emitted = 0
+        for stage in self.stages:
+            stage.input = queue.Queue(maxsize=self.queue_size)
+            stage._alive = stage.workers
+
+        self._started = time.monotonic()
+        threads = [threading.Thread(target=self._feed, args=(items,), name="pipeline-feed", daemon=True)]
+        for index, stage in enumerate(self.stages):
+            for n in range(stage.workers):
+                threads.append(threading.Thread(target=self._worker, args=(index,),
+                                                name=f"pipeline-{stage.name}-{n}", daemon=True))
+        if self.report_interval:
+            threads.append(threading.Thread(target=self._report, name="pipeline-report", daemon=True))
+        for thread in threads:
+            thread.start()
+
+        pending = {}
+        try:
+            while True:
+                item = self._output.get()
+                if item is _STOP:
+                    break
+                seq, payload = item
+                pending[seq] = payload
+                while self._emitted in pending:
+                    result = pending.pop(self._emitted)
+                    self._emitted += 1
+                    self._window.release()
+                    yield result
+        finally:
+            self._done.set()
+            self._finished = time.monotonic()
+
+    def stats(self):
+        end = self._finished or time.monotonic()
+        elapsed = end - self._started if self._started else 0.0
+        return {stage.name: stage.stats(elapsed) for stage in self.stages}
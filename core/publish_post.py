@@ -1,15 +1,38 @@
 import requests
 import json
-import base64
 import sys
 import os
-from google import genai
 from dotenv import load_dotenv
-import datetime
 import warnings
-# Google Sheets Imports
-import gspread
-from oauth2client.service_account import ServiceAccountCredentials
+import argparse
+import signal
+import copy
+import html
+import itertools
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, redirect_stdout
+from urllib.parse import urlparse
+from google_sheets_logger import get_sheets_logger
+from wp_publisher import get_publisher, configure_publisher
+from internal_linking import link_existing_post, get_catalogue
+from generation_cache import get_generation_cache, configure_generation_cache
+from gemini_client import DEFAULT_MODEL, get_gemini_client, configure_gemini_client
+from pipeline import Pipeline, Stage
+from task_io import iter_tasks, is_streaming_output, ResultsWriter
+from metrics import DEFAULT_METRICS_DB, get_metrics, configure_metrics, merge_metrics_dbs
+from task_journal import (DEFAULT_JOURNAL_PATH, TaskJournal, task_key, get_journal, configure_journal,
+                          merge_journal_segments)
+from host_health import DEFAULT_HEALTH_PATH, get_host_health, configure_host_health
+from sharding import run_sharded, merge_results
+from startup_profile import profile_command
+from event_bus import get_event_bus, configure_event_bus
+from event_sinks import SheetsSink, SQLiteSink, JSONLSink, TelegramDigestSink
+from task_daemon import TaskDaemon, submit
+from batch_generation import BatchItemError, MicroBatcher, build_batch_prompt, parse_batch_response
 
 # Suppress noisy warnings
 warnings.filterwarnings("ignore", category=FutureWarning)
@@ -23,74 +46,25 @@ except:
 load_dotenv()
 
 # --- CONFIGURATION ---
-SHEET_ID = "1CJjN_mSwrGwp2tVuaLK0vENb2c5VnYPQw0JM43HTE-c" # ID вашей таблицы
-SHEET_TAB_NAME = "Report" # Имя вкладки для отчетов
-
 STYLE_PROMPTS = {
     "expert": "Пиши сухим, аналитическим, техническим языком. Используй терминологию, цифры и глубокий анализ. Минимум эмоций, максимум фактов.",
     "lifestyle": "Пиши эмоционально, легко и доступно. Используй личные примеры, сторителлинг и обращайся к читателю на 'ты'. Статья должна выглядеть как пост в личном блоге.",
     "neutral": "Пиши в стандартном информационном стиле новостного портала. Объективно и сбалансировано."
 }
+# Сколько задач просматриваем вперед, чтобы сначала отдать работу здоровым сайтам
+SCHEDULE_LOOKAHEAD = 200
+# Модель, которой помечаются статьи из шаблона (Gemini недоступен)
+FALLBACK_MODEL = "Template (Fallback)"
 
 # --- HELPER FUNCTIONS ---
 
-def log_to_google_sheet(site_url, topic, status, link, model_used):
-    """
-    Logs the execution result to Google Sheets using credentials from env.
-    """
-    try:
-        json_creds = os.getenv("GOOGLE_CREDENTIALS")
-        if not json_creds:
-            print("⚠️ GOOGLE_CREDENTIALS missing. Skipping sheet log.")
-            return
-
-        # Parse JSON credentials
-        creds_dict = json.loads(json_creds)
-        scope = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
-        creds = ServiceAccountCredentials.from_json_keyfile_dict(creds_dict, scope)
-        client = gspread.authorize(creds)
-
-        # Open Sheet
-        try:
-            sheet = client.open_by_key(SHEET_ID).worksheet(SHEET_TAB_NAME)
-        except gspread.exceptions.WorksheetNotFound:
-            print(f"⚠️ Worksheet '{SHEET_TAB_NAME}' not found. Using first sheet.")
-            sheet = client.open_by_key(SHEET_ID).sheet1
-        except Exception as e:
-            print(f"⚠️ Error opening sheet: {e}")
-            return
-
-        # Prepare Row
-        row = [
-            datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-            site_url,
-            topic,
-            link if link else "N/A",
-            "✅ Success" if status == "success" else "❌ Error",
-            model_used
-        ]
-        
-        # Append
-        sheet.append_row(row)
-        print(f"📊 Logged to Google Sheet: {row}")
-
-    except Exception as e:
-        print(f"⚠️ Critical error logging to sheet: {e}")
-
 def publish_to_wordpress(site_url, username, app_password, title, content, status='publish'):
-    auth_string = f"{username}:{app_password}"
-    auth_header = base64.b64encode(auth_string.encode()).decode()
-    headers = {
-        'Authorization': f'Basic {auth_header}',
-        'Content-Type': 'application/json',
-        'User-Agent': 'WordPress-Publisher-Bot/1.0'
-    }
-    endpoint = f"{site_url.rstrip('/')}/wp-json/wp/v2/posts"
     payload = {'title': title, 'content': content, 'status': status}
     
     try:
         print(f"   🚀 Отправка статьи в WordPress...")
-        response = requests.post(endpoint, headers=headers, json=payload, timeout=30)
+        response = get_publisher().request('POST', site_url, '/wp-json/wp/v2/posts',
+                                           username, app_password, json=payload)
         if response.status_code == 201:
             return response.json()
         print(f"   ❌ Ошибка WordPress: {response.status_code}")
@@ -99,6 +73,29 @@ def publish_to_wordpress(site_url, username, app_password, title, content, statu
         print(f"   ❌ Ошибка публикации: {e}")
         return None
 
+def find_existing_post(site_url, username, app_password, title):
+    """
+    Looks for a post with exactly this title on the site, so a resumed task
+    whose earlier publish may have gone through is not posted twice.
+    """
+    try:
+        response = get_publisher().request('GET', site_url, '/wp-json/wp/v2/posts', username, app_password, params={
+            'search': title,
+            'status': 'publish,future,draft,pending',
+            'context': 'edit',
+            '_fields': 'id,link,title',
+            'per_page': 20,
+        })
+        if response.status_code != 200:
+            return None
+        for post in response.json():
+            post_title = post.get('title') or {}
+            if post_title.get('raw') == title or html.unescape(post_title.get('rendered', '')) == title:
+                return post
+    except Exception as e:
+        print(f"   ⚠️ Не удалось проверить существующие посты: {e}")
+    return None
+
 def generate_article_template(topic, target_link, anchor_text):
     title = f"{topic}: Полный обзор и советы"
     content = f"""
@@ -111,13 +108,23 @@ def generate_article_template(topic, target_link, anchor_text):
     return title, content
 
 def update_existing_post(site_url, username, app_password, target_url, anchor, topic):
+    """
+    Adds the anchor link to the most relevant existing post on the satellite.
+    Returns {'id', 'link'} of the updated post, or None.
+    """
     print(f"   🔍 Поиск релевантных статей для перелинковки по теме '{topic}'...")
-    return None
+    try:
+        updated = link_existing_post(site_url, username, app_password, target_url, anchor, topic, get_catalogue())
+    except Exception as e:
+        print(f"   ⚠️ Ошибка перелинковки: {e}")
+        return None
+    if updated:
+        print(f"   🔗 Ссылка добавлена в существующий пост: {updated['link']}")
+    return updated
 
-def generate_article(topic, target_link, anchor_text, author_style='neutral'):
-    print(f"Generating NEW content (Style: {author_style}) for topic: {topic}")
+def build_prompt(topic, target_link, anchor_text, author_style='neutral'):
     style_instruction = STYLE_PROMPTS.get(author_style, STYLE_PROMPTS['neutral'])
-    prompt = f"""
+    return f"""
     You are a professional blog writer. {style_instruction}
     Task: Write a SEO-optimized article provided in HTML format (use <h1>, <h2>, <p> tags only).
     Topic: {topic}
@@ -125,17 +132,35 @@ def generate_article(topic, target_link, anchor_text, author_style='neutral'):
     Requirement 2: Make the article engaging and around 600 words.
     Requirement 3: Return ONLY HTML code, no markdown symbols like ```html.
     """
+
+def generate_article(topic, target_link, anchor_text, author_style='neutral'):
+    print(f"Generating NEW content (Style: {author_style}) for topic: {topic}")
+    prompt = build_prompt(topic, target_link, anchor_text, author_style)
     
-    model_name = "gemini-2.0-flash"
+    model_name = DEFAULT_MODEL
+    cache = get_generation_cache()
+    cache_key = cache.key(prompt, model_name)
+    cached = cache.get(cache_key)
+    if cached:
+        print("   ♻️ Статья взята из кеша генерации")
+        return cached
+
+    if _article_batcher is not None:
+        try:
+            return _article_batcher.submit(author_style, (topic, target_link, anchor_text))
+        except BatchItemError as e:
+            print(f"   ✂️ Пакет: {e}, повтор отдельным запросом")
+        except Exception as e:
+            print(f"⚠️ Gemini API error: {e}. Falling back to template.")
+            t, c = generate_article_template(topic, target_link, anchor_text)
+            return t, c, FALLBACK_MODEL
+
     try:
-        client = genai.Client(api_key=os.getenv("GEMINI_API_KEY"))
-        response = client.models.generate_content(
-            model=model_name,
-            contents=prompt
-        )
+        response = get_gemini_client().generate(prompt, model=model_name)
         title = f"Взгляд эксперта: {topic}"
         if response.text:
             content = response.text.replace('```html', '').replace('```', '')
+            cache.put(cache_key, title, content, model_name)
             return title, content, model_name
         else:
             raise ValueError("Empty response from AI")
@@ -143,62 +168,662 @@ def generate_article(topic, target_link, anchor_text, author_style='neutral'):
     except Exception as e:
         print(f"⚠️ Gemini API error: {e}. Falling back to template.")
         t, c = generate_article_template(topic, target_link, anchor_text)
-        return t, c, "Template (Fallback)"
+        return t, c, FALLBACK_MODEL
 
-# --- MAIN LOOP ---
+def generate_article_batch(author_style, briefs):
+    """
+    Generates all `briefs` [(topic, target_link, anchor_text)] of one style
+    with a single Gemini request. Returns, per brief, (title, content, model)
+    or a BatchItemError when that article has to be generated on its own.
+    API errors are raised (every task of the batch then falls back).
+    """
+    model_name = DEFAULT_MODEL
+    print(f"📦 Пакетная генерация: {len(briefs)} статей (Style: {author_style}) одним запросом")
+    prompt = build_batch_prompt(STYLE_PROMPTS.get(author_style, STYLE_PROMPTS['neutral']), briefs)
+    response = get_gemini_client().generate(prompt, model=model_name, outputs=len(briefs),
+                                            config={'response_mime_type': 'application/json'})
+    try:
+        articles = parse_batch_response(response.text, briefs)
+    except ValueError as e:
+        print(f"   ⚠️ Ответ на пакет не разобран ({e}), генерируем по одной")
+        return [BatchItemError("malformed batch response")] * len(briefs)
 
-def run_tasks(data, output_file='results.json'):
+    cache = get_generation_cache()
     results = []
-    for i, task in enumerate(data):
-        print(f"\n--- Task {i+1} ---")
-        site_url = task.get('site_url')
-        login = task.get('login')
-        password = task.get('app_password')
-        target_url = task.get('target_links', task.get('target_url')) 
-        anchor = task.get('anchor_text', task.get('anchor'))
-        topic = task.get('article_topic', task.get('topic'))
-        style = task.get('author_style', 'neutral')
-        
-        if not all([site_url, login, password, target_url, anchor, topic]):
-            print(f"Skip task {i+1}: Missing fields.")
+    for (topic, target_link, anchor_text), article in zip(briefs, articles):
+        if isinstance(article, Exception):
+            results.append(article)
             continue
-            
-        update_existing_post(site_url, login, password, target_url, anchor, topic)
-        
-        # Generator now returns model name too
-        title, content, model_used = generate_article(topic, target_url, anchor, style)
-        
-        print(f"Publishing to {site_url}...")
-        post_result = publish_to_wordpress(site_url, login, password, title, content)
-        
-        status = "success" if post_result else "error"
-        link = post_result.get('link') if post_result else None
-        
-        # LOG TO GOOGLE SHEETS
-        log_to_google_sheet(site_url, topic, status, link, model_used)
-        
-        task_result = {
-            "site": site_url,
-            "status": status,
-            "new_post_url": link
-        }
-        results.append(task_result)
-        
-    with open(output_file, 'w') as f:
-        json.dump(results, f, indent=2)
+        title = f"Взгляд эксперта: {topic}"
+        cache.put(cache.key(build_prompt(topic, target_link, anchor_text, author_style), model_name),
+                  title, article, model_name)
+        results.append((title, article, model_name))
     return results
 
+_article_batcher = None
+
+def configure_article_batching(batch_size=1, max_wait=2.0):
+    """
+    Enables batched generation: concurrent generate_article() calls with the
+    same author style are merged into requests of up to `batch_size` articles.
+    """
+    global _article_batcher
+    _article_batcher = MicroBatcher(generate_article_batch, batch_size, max_wait) if batch_size > 1 else None
+    return _article_batcher
+
+# --- MAIN LOOP ---
+
+class HostLimiter:
+    """
+    Caps the number of simultaneous requests per satellite host.
+    """
+    def __init__(self, per_host=1):
+        self.per_host = max(1, per_host)
+        self._lock = threading.Lock()
+        self._semaphores = {}
+
+    def _semaphore(self, site_url):
+        host = urlparse(site_url).netloc.lower() or site_url
+        with self._lock:
+            if host not in self._semaphores:
+                self._semaphores[host] = threading.BoundedSemaphore(self.per_host)
+            return self._semaphores[host]
+
+    @contextmanager
+    def hold(self, site_url):
+        semaphore = self._semaphore(site_url)
+        with semaphore:
+            yield
+
+def prepare_task(i, task):
+    """
+    Validates a raw task and turns it into the context dict passed between
+    stages. Returns None if the task has to be skipped.
+    """
+    print(f"\n--- Task {i+1} ---")
+    ctx = {
+        'index': i,
+        'site_url': task.get('site_url'),
+        'login': task.get('login'),
+        'password': task.get('app_password'),
+        'target_url': task.get('target_links', task.get('target_url')),
+        'anchor': task.get('anchor_text', task.get('anchor')),
+        'topic': task.get('article_topic', task.get('topic')),
+        'style': task.get('author_style', 'neutral'),
+    }
+    required = ['site_url', 'login', 'password', 'target_url', 'anchor', 'topic']
+    if not all(ctx[field] for field in required):
+        print(f"Skip task {i+1}: Missing fields.")
+        return None
+
+    journal = get_journal()
+    if journal is not None:
+        ctx['key'] = task_key(ctx)
+        entry = journal.get(ctx['key']) if journal.resume else None
+        if entry:
+            _restore_from_journal(ctx, entry, journal)
+        journal.mark_pending(ctx['key'], ctx, reset=not journal.resume)
+    if 'post_result' not in ctx and not host_available(ctx['site_url'], ctx['login'], ctx['password']):
+        # Сайт недоступен - не тратим запрос к Gemini на статью, которую некуда публиковать
+        ctx['post_result'], ctx['model_used'] = None, None
+    if 'post_result' not in ctx and ctx.get('fallback_title'):
+        _find_fallback_post(ctx, journal)
+    if 'post_result' not in ctx:
+        # Пока статья генерируется, тема ждет общего ранжирования с другими задачами сайта
+        get_catalogue().expect(ctx['site_url'], ctx['topic'])
+    return ctx
+
+def host_available(site_url, username, app_password):
+    """
+    False if the satellite's (or these credentials') circuit is open. A
+    circuit whose cooldown is over is first probed with one cheap
+    authenticated request; concurrent tasks for the same host wait for that
+    single probe instead of sending their own.
+    """
+    health = get_host_health()
+    credentials = (username, app_password)
+    if health.needs_probe(site_url, credentials):
+        print(f"   🩺 Проверка доступности {site_url}...")
+        try:
+            get_publisher().request('GET', site_url, '/wp-json/wp/v2/users/me', username, app_password,
+                                    params={'_fields': 'id'})
+        except Exception:
+            pass
+    health.wait_probe(site_url, credentials)
+    state = health.open_state(site_url, credentials)
+    if state is None:
+        return True
+    if state.reason == 'auth':
+        print(f"   ⛔ Задача пропущена: логин {username} не принят сайтом {site_url}")
+    else:
+        print(f"   ⛔ Сайт {state.host} пропущен: цепь разомкнута ({state.reason})")
+    return False
+
+def _restore_from_journal(ctx, entry, journal):
+    state = entry['state']
+    published = {'id': entry['post_id'], 'link': entry['post_link']}
+    if state == 'logged' and entry['status'] == 'success':
+        print("   ⏭️ Задача уже выполнена ранее, пропускаем")
+        ctx['post_result'], ctx['model_used'], ctx['done'] = published, entry['model'], True
+        journal.count('skipped')
+    elif state == 'published':
+        print("   ⏭️ Пост уже опубликован, осталось только логирование")
+        ctx['post_result'], ctx['model_used'] = published, entry['model']
+    elif entry['content'] and entry['model'] == FALLBACK_MODEL:
+        # Шаблонную заглушку заново не публикуем, но она могла уйти на сайт перед падением
+        ctx['fallback_title'] = entry['title']
+    elif entry['content']:
+        # Статья сгенерирована, но публикация не записана (падение или ошибка WordPress)
+        print("   ♻️ Используем сохраненную статью из журнала")
+        ctx['title'], ctx['content'], ctx['model_used'] = entry['title'], entry['content'], entry['model']
+        # Прошлый запуск мог успеть опубликовать статью перед падением
+        ctx['check_existing'] = True
+        journal.count('reused_content')
+
+def _find_fallback_post(ctx, journal):
+    """
+    A journaled fallback-template article is regenerated on resume unless
+    the previous run already got it onto the site.
+    """
+    existing = find_existing_post(ctx['site_url'], ctx['login'], ctx['password'], ctx['fallback_title'])
+    if not existing:
+        print("   🔁 В журнале шаблонная статья - генерируем заново")
+        return
+    print(f"   ⏭️ Шаблонная статья уже есть на сайте: {existing.get('link')}")
+    journal.count('found_existing')
+    journal.mark_published(ctx['key'], existing.get('id'), existing.get('link'))
+    ctx['post_result'], ctx['model_used'] = existing, FALLBACK_MODEL
+
+def generate_stage(ctx):
+    if 'content' in ctx or 'post_result' in ctx:
+        return ctx
+    # Generator now returns model name too
+    with get_metrics().timer('generate', ctx['site_url']):
+        ctx['title'], ctx['content'], ctx['model_used'] = generate_article(
+            ctx['topic'], ctx['target_url'], ctx['anchor'], ctx['style'])
+    get_event_bus().emit('article_generated', site=ctx['site_url'], topic=ctx['topic'], style=ctx['style'],
+                         model=ctx['model_used'], length=len(ctx['content']))
+    journal = get_journal()
+    if journal is not None:
+        journal.mark_generated(ctx['key'], ctx['title'], ctx['content'], ctx['model_used'])
+    return ctx
+
+def publish_stage(ctx, host_limiter):
+    if 'post_result' in ctx:
+        return ctx
+    site_url = ctx['site_url']
+    print(f"Publishing to {site_url}...")
+    metrics = get_metrics()
+    with host_limiter.hold(site_url), metrics.timer('interlink', site_url):
+        ctx['updated_post'] = update_existing_post(site_url, ctx['login'], ctx['password'],
+                                                   ctx['target_url'], ctx['anchor'], ctx['topic'])
+    journal = get_journal()
+    with host_limiter.hold(site_url), metrics.timer('publish', site_url):
+        existing = None
+        if ctx.get('check_existing'):
+            existing = find_existing_post(site_url, ctx['login'], ctx['password'], ctx['title'])
+        if existing:
+            print(f"   ⏭️ Пост уже есть на сайте: {existing.get('link')}")
+            journal.count('found_existing')
+            ctx['post_result'] = existing
+        else:
+            ctx['post_result'] = publish_to_wordpress(site_url, ctx['login'], ctx['password'], ctx['title'], ctx['content'])
+    if ctx['post_result']:
+        get_event_bus().emit('post_published', site=site_url, post_id=ctx['post_result'].get('id'),
+                             link=ctx['post_result'].get('link'))
+        if journal is not None:
+            journal.mark_published(ctx['key'], ctx['post_result'].get('id'), ctx['post_result'].get('link'))
+    # Текст статьи больше не нужен - не держим его в памяти до логирования
+    ctx.pop('content', None)
+    return ctx
+
+def log_stage(ctx):
+    post_result = ctx['post_result']
+    status = "success" if post_result else "error"
+    link = post_result.get('link') if post_result else None
+    
+    updated_post = ctx.get('updated_post')
+    if not ctx.get('done'):
+        # Sheets, SQLite, Telegram и JSONL получают событие из своих очередей - здесь не ждем
+        with get_metrics().timer('log', ctx['site_url']):
+            get_event_bus().emit('task_finished', site=ctx['site_url'], topic=ctx['topic'], style=ctx['style'],
+                                 status=status, link=link, model=ctx['model_used'],
+                                 updated_post=updated_post['link'] if updated_post else None)
+        journal = get_journal()
+        if journal is not None:
+            journal.mark_logged(ctx['key'], status, link)
+    
+    task_result = {
+        "site": ctx['site_url'],
+        "status": status,
+        "new_post_url": link
+    }
+    if updated_post:
+        # Только когда ссылка вставлена в старый пост - иначе строка такая же, как раньше
+        task_result["updated_old_post"] = updated_post['link']
+    return task_result
+
+def process_task(i, task, host_limiter=None):
+    """
+    Runs a single task end to end: generation, publishing and reporting.
+    Returns the task result dict, or None if the task was skipped.
+    """
+    ctx = prepare_task(i, task)
+    if ctx is None:
+        return None
+    host_limiter = host_limiter or HostLimiter()
+    return log_stage(publish_stage(generate_stage(ctx), host_limiter))
+
+def schedule_by_health(tasks, lookahead=SCHEDULE_LOOKAHEAD):
+    """
+    Moves (index, task) pairs for hosts or logins with an open circuit to the end of
+    their window of `lookahead` tasks, so healthy satellites get the workers
+    first. The sort is stable: all other tasks keep their input order.
+    """
+    health = get_host_health()
+    tasks = iter(tasks)
+    while True:
+        window = list(itertools.islice(tasks, lookahead))
+        if not window:
+            return
+        window.sort(key=lambda item: health.rank(item[1].get('site_url') or '',
+                                                 (item[1].get('login'), item[1].get('app_password'))))
+        yield from window
+
+def _iter_sequential(tasks, per_host):
+    host_limiter = HostLimiter(per_host)
+    for i, task in tasks:
+        yield process_task(i, task, host_limiter)
+
+def _iter_concurrent(tasks, workers, per_host):
+    """
+    Runs (index, task) pairs on a thread pool. At most `workers` tasks are in
+    flight and at most `per_host` requests hit the same satellite at once.
+    Tasks are pulled lazily and results are yielded in submission order.
+    """
+    host_limiter = HostLimiter(per_host)
+    window = deque()
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="pbn-task") as executor:
+        while True:
+            for i, task in tasks:
+                window.append((i, executor.submit(process_task, i, task, host_limiter)))
+                if len(window) >= workers * 2:
+                    break
+            if not window:
+                break
+            i, future = window.popleft()
+            try:
+                yield future.result()
+            except Exception as e:
+                print(f"❌ Task {i+1} failed: {e}")
+                yield None
+
+def _prepare_and_generate(item):
+    ctx = prepare_task(*item)
+    return generate_stage(ctx) if ctx else None
+
+def build_pipeline(per_host=1, gen_workers=4, publish_workers=4, log_workers=1,
+                   queue_size=50, report_interval=None):
+    """
+    Builds the generate -> publish -> log pipeline. Each stage has its own
+    worker count; publishing still respects the per-host limit.
+    """
+    host_limiter = HostLimiter(per_host)
+    stages = [
+        Stage('generate', _prepare_and_generate, gen_workers),
+        Stage('publish', lambda ctx: publish_stage(ctx, host_limiter), publish_workers),
+        Stage('log', log_stage, log_workers),
+    ]
+    return Pipeline(stages, queue_size=queue_size, report_interval=report_interval)
+
+def _print_pipeline_stats(pipeline):
+    print("\n=== Pipeline Stages ===")
+    for name, s in pipeline.stats().items():
+        print(f"⚙️ {name:8} | workers: {s['workers']} | processed: {s['processed']} | errors: {s['errors']} | "
+              f"max queue: {s['max_queue_depth']} | busy: {s['busy_seconds']:.1f}s | {s['throughput_per_sec']:.2f}/s")
+
+def print_run_summary():
+    http = get_publisher().stats()
+    sheets = get_sheets_logger().stats()
+    cache = get_generation_cache().stats()
+    gemini = get_gemini_client().stats()
+    print("\n=== Run Summary ===")
+    print(f"🔌 HTTP: {http['requests']} requests to {http['hosts']} hosts, "
+          f"{http['connections_opened']} connections opened, {http['connections_reused']} reused")
+    print(f"📊 Sheets: {sheets['rows_written']} rows written in {sheets['api_calls']} API calls, "
+          f"{sheets['rows_pending']} pending")
+    print(f"♻️ Generation cache ({cache['mode']}): {cache['hits']} hits, {cache['misses']} misses")
+    print(f"🤖 Gemini: {gemini['requests']} requests, {gemini['retries']} retries, {gemini['failures']} failures, "
+          f"throttled {gemini['throttled_seconds']:.1f}s, backoff {gemini['backoff_seconds']:.1f}s")
+    for stage, p in sorted(get_metrics().percentiles().items()):
+        print(f"⏱️ {stage:9} | n={p['count']:<5} | p50 {p['p50']:.2f}s | p95 {p['p95']:.2f}s | p99 {p['p99']:.2f}s")
+    print("📮 Sinks: " + ", ".join(f"{name} {st['delivered']} delivered/{st['failed']} failed/{st['dropped']} dropped"
+                                   for name, st in get_event_bus().stats().items()))
+    if _article_batcher is not None:
+        b = _article_batcher.stats()
+        print(f"📦 Batched generation: {b['items']} articles in {b['batches']} requests")
+    health = get_host_health().stats()
+    print(f"🩺 Hosts: {health['hosts']} tracked, {health['refused']} requests refused, "
+          f"{len(health['open'])} circuits open" +
+          ''.join(f"\n   🔴 {host} ({reason})" for host, reason in sorted(health['open'].items())))
+    journal = get_journal()
+    if journal is not None:
+        j = journal.stats()
+        print(f"🧾 Journal: {j['skipped']} finished tasks skipped, {j['reused_content']} stored articles reused, "
+              f"{j['found_existing']} existing posts found | states: {j['states']}")
+
+def run_tasks(data, output_file='results.json', workers=1, per_host=1, pipeline=None, resume=False,
+              with_index=False):
+    """
+    Runs all tasks from `data` (any iterable, consumed lazily) and writes the
+    results to `output_file`. Sequential by default; `workers > 1` uses a
+    thread pool and a `pipeline` from build_pipeline() streams tasks through
+    overlapping stages. Tasks for healthy satellites are scheduled first and
+    tasks for hosts with an open circuit are skipped without generating;
+    results are still written in input order (`with_index` adds each task's
+    input `index` to its row, for merging shard results).
+
+    A `.jsonl` output file is written as each task finishes (appended to
+    with `resume`, otherwise truncated first) and results are not kept in
+    memory (an empty list is returned); otherwise the full list is written
+    as JSON at the end and returned.
+    """
+    # Каждый исполнитель отдает ровно один результат на задачу в порядке запуска
+    order = deque()
+
+    def scheduled():
+        for i, task in schedule_by_health(enumerate(data)):
+            order.append(i)
+            yield i, task
+
+    tasks = scheduled()
+    if pipeline is not None:
+        outcomes = pipeline.run(tasks)
+    elif workers and workers > 1:
+        outcomes = _iter_concurrent(tasks, workers, per_host)
+    else:
+        outcomes = _iter_sequential(tasks, per_host)
+
+    started = time.perf_counter()
+    succeeded = 0
+    with ResultsWriter(output_file, resume=resume, with_index=with_index) as writer:
+        for task_result in outcomes:
+            writer.put(order.popleft(), task_result)
+            if task_result is not None:
+                succeeded += task_result['status'] == 'success'
+
+    if pipeline is not None:
+        _print_pipeline_stats(pipeline)
+    bus = get_event_bus()
+    bus.emit('run_finished', tasks=writer.count, succeeded=succeeded, seconds=time.perf_counter() - started)
+    bus.flush()
+    get_metrics().flush()
+    get_host_health().flush()
+    print_run_summary()
+    return writer.results if writer.results is not None else []
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Publish generated articles to PBN satellites.")
+    parser.add_argument('input_file', nargs='?',
+                        help="Tasks file: .json (see data/sites_data.json), .jsonl or .csv "
+                             "(see data/sites_import_TEMPLATE.csv)")
+    parser.add_argument('--output', default='results.json',
+                        help="Where to write the results (default: results.json). "
+                             "A .jsonl path streams each result as soon as its task finishes")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="Number of tasks processed concurrently (default: 1, sequential)")
+    parser.add_argument('--per-host', type=int, default=1,
+                        help="Max simultaneous requests to the same satellite (default: 1)")
+    parser.add_argument('--pipeline', action='store_true',
+                        help="Overlap generation, publishing and logging in a staged pipeline")
+    parser.add_argument('--gen-workers', type=int, default=4,
+                        help="Pipeline: generation workers (default: 4)")
+    parser.add_argument('--publish-workers', type=int, default=4,
+                        help="Pipeline: WordPress publishing workers (default: 4)")
+    parser.add_argument('--log-workers', type=int, default=1,
+                        help="Pipeline: logging workers (default: 1)")
+    parser.add_argument('--queue-size', type=int, default=50,
+                        help="Pipeline: max items waiting between two stages (default: 50)")
+    parser.add_argument('--stats-interval', type=float, default=None,
+                        help="Pipeline: print queue depths every N seconds")
+    parser.add_argument('--profile-startup', action='store_true',
+                        help="Run the command under -X importtime and report import time per package")
+    parser.add_argument('--watch-dir', default=None,
+                        help="Daemon: run every task file dropped into this directory")
+    parser.add_argument('--socket', default=None,
+                        help="Daemon: accept task files on this local (Unix) socket")
+    parser.add_argument('--submit', default=None, metavar='SOCKET',
+                        help="Send input_file to a running daemon and wait for the summary")
+    parser.add_argument('--shards', type=int, default=1,
+                        help="Split tasks by satellite across N worker processes (default: 1)")
+    parser.add_argument('--shard-dir', default=None,
+                        help="Shards: where per-shard logs are kept (default: <output>.shards)")
+    parser.add_argument('--resume', action='store_true',
+                        help="Skip tasks finished in a previous run and reuse stored articles "
+                             "(a .jsonl --output is appended to instead of overwritten)")
+    parser.add_argument('--journal', default=DEFAULT_JOURNAL_PATH,
+                        help="Task state journal (default: monitoring/task_journal.db)")
+    parser.add_argument('--no-journal', action='store_true',
+                        help="Do not record task state (runs cannot be resumed)")
+    parser.add_argument('--metrics-port', type=int, default=None,
+                        help="Serve Prometheus/OpenMetrics on http://127.0.0.1:PORT/metrics")
+    parser.add_argument('--metrics-db', default=DEFAULT_METRICS_DB,
+                        help="SQLite DB for per-task latency and token samples (default: monitoring/pbn_metrics.db)")
+    parser.add_argument('--no-metrics-db', action='store_true',
+                        help="Keep latency samples in memory only")
+    parser.add_argument('--pool-size', type=int, default=10,
+                        help="Max pooled HTTP connections kept per satellite (default: 10)")
+    parser.add_argument('--no-keep-alive', action='store_true',
+                        help="Close the HTTP connection after every request")
+    parser.add_argument('--health-db', default=DEFAULT_HEALTH_PATH,
+                        help="Per-host health and circuit state (default: monitoring/host_health.db)")
+    parser.add_argument('--no-health-db', action='store_true',
+                        help="Track host health for this run only")
+    parser.add_argument('--reset-health', action='store_true',
+                        help="Close all circuits and retry every satellite")
+    parser.add_argument('--sheet-batch-size', type=int, default=50,
+                        help="Max rows per Google Sheets append (default: 50)")
+    parser.add_argument('--sheet-flush-interval', type=float, default=10.0,
+                        help="Max seconds a finished task waits before its row is appended (default: 10)")
+    cache_mode = parser.add_mutually_exclusive_group()
+    cache_mode.add_argument('--no-cache', action='store_true',
+                            help="Bypass the generation cache entirely")
+    cache_mode.add_argument('--refresh-cache', action='store_true',
+                            help="Regenerate every article and overwrite cached entries")
+    parser.add_argument('--cache-ttl-days', type=float, default=30,
+                        help="Days a cached article stays valid (default: 30)")
+    parser.add_argument('--cache-max-mb', type=float, default=200,
+                        help="Max size of the generation cache before LRU eviction (default: 200)")
+    parser.add_argument('--gemini-rpm', type=int, default=60,
+                        help="Gemini requests per minute budget (default: 60)")
+    parser.add_argument('--gemini-tpm', type=int, default=1_000_000,
+                        help="Gemini tokens per minute budget (default: 1000000)")
+    parser.add_argument('--generation-log', default='generation_logs.jsonl',
+                        help="Where generated-article events are appended for dashboard.py "
+                             "(default: generation_logs.jsonl, '' to disable)")
+    parser.add_argument('--events-log', default=None,
+                        help="Append every task event as a JSON line to this file")
+    parser.add_argument('--telegram-digest-minutes', type=float, default=60,
+                        help="Minutes between Telegram digests during a run (default: 60)")
+    parser.add_argument('--no-telegram', action='store_true',
+                        help="Do not send Telegram digests even if TELEGRAM_BOT_TOKEN is set")
+    parser.add_argument('--gen-batch-size', type=int, default=1,
+                        help="Articles of the same author style generated per Gemini request (default: 1, off)")
+    parser.add_argument('--gen-batch-wait', type=float, default=2.0,
+                        help="Max seconds a task waits for its generation batch to fill (default: 2)")
+    parser.add_argument('--gemini-retries', type=int, default=5,
+                        help="Retries on Gemini rate limits and transient errors (default: 5)")
+    return parser.parse_args(argv)
+
+def configure_from_args(args):
+    """
+    Sets up the process-wide clients, caches and state stores from the CLI options.
+    """
+    configure_metrics(db_path=None if args.no_metrics_db else args.metrics_db, port=args.metrics_port,
+                      run_id=getattr(args, 'run_id', None))
+    health = configure_host_health(path=None if args.no_health_db else args.health_db)
+    if args.reset_health:
+        health.reset()
+    configure_publisher(pool_size=args.pool_size, keep_alive=not args.no_keep_alive)
+    configure_generation_cache(
+        mode="bypass" if args.no_cache else ("refresh" if args.refresh_cache else "use"),
+        ttl_seconds=args.cache_ttl_days * 24 * 3600,
+        max_bytes=int(args.cache_max_mb * 1024 * 1024),
+    )
+    configure_gemini_client(rpm=args.gemini_rpm, tpm=args.gemini_tpm, max_retries=args.gemini_retries)
+    # Пакет собирается из одновременно генерируемых задач - больше потоков генерации он не наберет
+    batch_size = min(args.gen_batch_size, args.gen_workers if args.pipeline else args.workers)
+    if args.gen_batch_size > 1 and batch_size < 2:
+        print("⚠️ --gen-batch-size needs --workers or --pipeline --gen-workers of 2+, batching disabled")
+    configure_article_batching(batch_size, args.gen_batch_wait)
+    if args.resume and not args.no_journal and args.shards <= 1:
+        merge_journal_segments(args.journal)
+    configure_journal(args.journal, resume=args.resume, enabled=not args.no_journal)
+    configure_event_bus(build_sinks(args), run_id=getattr(args, 'run_id', None))
+
+def build_sinks(args):
+    """
+    Reporting sinks fed by the event bus, each on its own queue and thread.
+    """
+    sinks = [SheetsSink(batch_size=args.sheet_batch_size, flush_interval=args.sheet_flush_interval)]
+    if not args.no_metrics_db:
+        sinks.append(SQLiteSink(args.metrics_db))
+    if args.generation_log:
+        sinks.append(JSONLSink(args.generation_log, types={'article_generated'}))
+    if args.events_log:
+        sinks.append(JSONLSink(args.events_log))
+    if not args.no_telegram and os.getenv("TELEGRAM_BOT_TOKEN") and os.getenv("TELEGRAM_CHAT_ID"):
+        sinks.append(TelegramDigestSink(digest_interval=args.telegram_digest_minutes * 60))
+    return sinks
+
+def run_from_args(data, args, output_file=None, with_index=False):
+    pipeline = None
+    if args.pipeline:
+        pipeline = build_pipeline(per_host=args.per_host, gen_workers=args.gen_workers,
+                                  publish_workers=args.publish_workers, log_workers=args.log_workers,
+                                  queue_size=args.queue_size, report_interval=args.stats_interval)
+    return run_tasks(data, output_file=output_file or args.output, workers=args.workers, per_host=args.per_host,
+                     pipeline=pipeline, resume=args.resume, with_index=with_index)
+
+def count_results(jsonl_path):
+    """
+    Counts the tasks and successes in a .jsonl results file.
+    """
+    succeeded = total = 0
+    with open(jsonl_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            total += 1
+            succeeded += json.loads(line).get('status') == 'success'
+    return {'tasks': total, 'succeeded': succeeded}
+
+def run_shard(shard, shards, tasks_path, results_path, args):
+    """
+    Worker process of a sharded run: its own pools and metrics DB, output
+    to a per-shard log next to the results. The task journal is shared (it
+    is keyed by task), so any later run can resume whatever the shard count.
+    The Gemini quota is shared by the whole network, so it is split between shards.
+    """
+    args = copy.copy(args)
+    args.gemini_rpm = max(1, args.gemini_rpm // shards)
+    args.gemini_tpm = max(1, args.gemini_tpm // shards)
+    args.metrics_db = os.path.join(os.path.dirname(results_path), f"shard-{shard}.metrics.db")
+    args.metrics_port = None
+    args.reset_health = False
+    # Один общий дайджест (в конце запуска) отправляет координатор
+    args.no_telegram = True
+    log_path = os.path.join(os.path.dirname(results_path), f"shard-{shard}.log")
+    started = time.perf_counter()
+    with open(log_path, 'w', encoding='utf-8') as log, redirect_stdout(log):
+        configure_from_args(args)
+        run_from_args(iter_tasks(tasks_path), args, output_file=results_path, with_index=True)
+        get_metrics().close()
+        get_host_health().close()
+    return {'shard': shard, **count_results(results_path),
+            'seconds': time.perf_counter() - started, 'metrics_db': args.metrics_db, 'log': log_path}
+
+def run_sharded_from_args(data, args):
+    """
+    Coordinator of `--shards N`: splits tasks by satellite host across N
+    processes, then merges their results into args.output (in input order)
+    and their latency samples into the metrics DB.
+    """
+    args.run_id = datetime.now().strftime('%Y%m%dT%H%M%S')
+    work_dir = args.shard_dir or os.path.splitext(args.output)[0] + '.shards'
+    if args.reset_health:
+        configure_host_health(path=None if args.no_health_db else args.health_db).reset()
+    if not args.no_journal:
+        if args.resume:
+            merge_journal_segments(args.journal)
+        # Общий журнал создается (и переводится в WAL) до запуска шардов
+        TaskJournal(args.journal).close()
+    started = time.perf_counter()
+    summaries, results_paths, positions = run_sharded(run_shard, args, data, args.shards, work_dir)
+    elapsed = time.perf_counter() - started
+
+    # Шарды работают без Telegram - общий дайджест собирается из их результатов
+    bus = configure_event_bus([] if args.no_telegram else [TelegramDigestSink()], run_id=args.run_id)
+    writer = merge_results(results_paths, positions, args.output, resume=args.resume, on_result=lambda r: bus.emit(
+        'task_finished', site=r['site'], status=r['status'], link=r['new_post_url'],
+        updated_post=r.get('updated_old_post')))
+    for path in results_paths:
+        if os.path.exists(path):
+            os.remove(path)
+    shard_dbs = [s.get('metrics_db') for s in summaries]
+    if not args.no_metrics_db:
+        merged = merge_metrics_dbs(args.metrics_db, shard_dbs)
+        print(f"📈 {merged} замеров латентности добавлено в {args.metrics_db}")
+    for path in shard_dbs:
+        for suffix in ('', '-wal', '-shm'):
+            if path and os.path.exists(path + suffix):
+                os.remove(path + suffix)
+
+    bus.emit('run_finished', tasks=writer.count, succeeded=sum(s['succeeded'] for s in summaries), seconds=elapsed)
+    bus.close()
+
+    print("\n=== Shards ===")
+    for s in summaries:
+        status = f"❌ {s['failed']}" if s.get('failed') else f"лог: {s['log']}"
+        print(f"🧩 shard {s['shard']:<3} | {s['succeeded']}/{s['tasks']} ok | {s['seconds']:.1f}s | {status}")
+    total = sum(s['tasks'] for s in summaries)
+    print(f"✅ {sum(s['succeeded'] for s in summaries)}/{total} задач за {elapsed:.1f}s "
+          f"({total / elapsed if elapsed else 0:.1f} задач/с), результаты: {args.output} ({writer.count})")
+
+def run_daemon_job(input_path, output_path, args):
+    results = run_from_args(iter_tasks(input_path), args, output_file=output_path)
+    # .jsonl результаты не держатся в памяти - считаем по файлу
+    if is_streaming_output(output_path):
+        return count_results(output_path)
+    return {'tasks': len(results), 'succeeded': sum(1 for r in results if r['status'] == 'success')}
+
 if __name__ == "__main__":
-    user_input = []
-    if len(sys.argv) > 1:
+    args = parse_args()
+    if args.profile_startup:
+        sys.exit(profile_command(os.path.abspath(__file__), [a for a in sys.argv[1:] if a != '--profile-startup']))
+    if args.submit:
+        print(json.dumps(submit(args.submit, args.input_file, args.output), ensure_ascii=False))
+        sys.exit(0)
+    if args.watch_dir or args.socket:
+        configure_from_args(args)
+        signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+        TaskDaemon(lambda input_path, output_path: run_daemon_job(input_path, output_path, args),
+                   watch_dir=args.watch_dir, socket_path=args.socket).serve_forever()
+        sys.exit(0)
+    if args.shards <= 1:
+        configure_from_args(args)
+    user_input = None
+    first_task = None
+    if args.input_file:
         try:
-            with open(sys.argv[1], 'r') as f:
-                user_input = json.load(f)
+            # Tasks are read lazily - only the first one is loaded up front
+            user_input = iter_tasks(args.input_file)
+            first_task = next(user_input, None)
         except Exception as e:
             print(f"Error reading input file: {e}")
             sys.exit(1)
             
-    if not user_input:
+    if first_task is None:
         print("No tasks to run.")
+    elif args.shards > 1:
+        run_sharded_from_args(itertools.chain([first_task], user_input), args)
     else:
-        run_tasks(user_input)
+        run_from_args(itertools.chain([first_task], user_input), args)
@@ -0,0 +1,178 @@
+import argparse
+import random
+import threading
+import time
+import zlib
+from collections import Counter
+from functools import lru_cache
+
+# numpy/scipy импортируются при первом обращении (см. available())
+np = None
+sparse = None
+_import_attempted = False
+_import_lock = threading.Lock()
+
+# Размер пространства признаков (hashing trick), степень двойки
+N_FEATURES = 1 << 18
+
+
+def available():
+    """
+    Imports numpy/scipy on first call. Without them the SQLite index is used.
+    Threads calling it while the import runs wait for its outcome.
+    """
+    global np, sparse, _import_attempted
+    if not _import_attempted:
+        with _import_lock:
+            if not _import_attempted:
+                try:
+                    import numpy
+                    from scipy import sparse as scipy_sparse
+                    np, sparse = numpy, scipy_sparse
+                except ImportError:
+                    pass
+                _import_attempted = True
+    return np is not None
+
+
+@lru_cache(maxsize=200_000)
+def term_columns(term):
+    """
+    Hashed feature columns of one term: the term itself plus its character
+    3-grams, so different Russian word forms still share most features.
+    """
+    padded = f"<{term}>"
+    features = [term] + [f"3:{padded[i:i + 3]}" for i in range(len(padded) - 2)]
+    return tuple(zlib.crc32(f.encode('utf-8')) & (N_FEATURES - 1) for f in features)
+
+
+def _rows_to_matrix(term_counts):
+    """
+    Builds the (rows x N_FEATURES) matrix as (rows x vocabulary) counts times
+    a (vocabulary x N_FEATURES) hashing matrix, so the Python loop only does
+    one dict lookup per term occurrence.
+    """
+    vocabulary = {}
+    indptr, indices, data = [0], [], []
+    for counts in term_counts:
+        for term, tf in counts.items():
+            indices.append(vocabulary.setdefault(term, len(vocabulary)))
+            data.append(tf)
+        indptr.append(len(indices))
+    counts = sparse.csr_matrix((np.asarray(data, dtype=np.float32), np.asarray(indices, dtype=np.int64),
+                                np.asarray(indptr, dtype=np.int64)), shape=(len(indptr) - 1, len(vocabulary)))
+    counts.data = 1.0 + np.log(counts.data)
+
+    term_rows, term_cols = [], []
+    for term, term_id in vocabulary.items():
+        columns = term_columns(term)
+        term_rows.extend([term_id] * len(columns))
+        term_cols.extend(columns)
+    hashing = sparse.csr_matrix((np.ones(len(term_rows), dtype=np.float32), (term_rows, term_cols)),
+                                shape=(len(vocabulary), N_FEATURES))
+    return counts.dot(hashing).tocsr()
+
+
+def _weight_and_normalize(matrix, idf_of):
+    matrix = matrix.tocsr(copy=True)
+    matrix.data *= idf_of(matrix.indices)
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+    norms[norms == 0] = 1.0
+    return sparse.diags(1.0 / norms).dot(matrix).tocsr()
+
+
+class RelevanceIndex:
+    """
+    TF-IDF vectors of a set of posts as one sparse matrix (hashed features).
+
+    All topics of a batch are scored against all posts with a single sparse
+    matrix multiply; top_k() then picks the best posts per topic. IDF is
+    only stored for the features that occur in the posts (a dense array
+    over N_FEATURES would cost ~1 MB per site).
+    """
+
+    def __init__(self, doc_ids, doc_term_counts):
+        self.doc_ids = list(doc_ids)
+        raw = _rows_to_matrix(doc_term_counts)
+        self.features, df = np.unique(raw.indices, return_counts=True)
+        self.idf = (np.log((1.0 + len(self.doc_ids)) / (1.0 + df)) + 1.0).astype(np.float32)
+        # IDF признака, которого нет ни в одном посте
+        self.missing_idf = np.float32(np.log(1.0 + len(self.doc_ids)) + 1.0)
+        self.matrix = _weight_and_normalize(raw, self.idf_of)
+
+    def __len__(self):
+        return len(self.doc_ids)
+
+    def idf_of(self, columns):
+        """
+        IDF weights of the given feature columns.
+        """
+        weights = np.full(len(columns), self.missing_idf, dtype=np.float32)
+        if len(self.features):
+            positions = np.minimum(np.searchsorted(self.features, columns), len(self.features) - 1)
+            known = self.features[positions] == columns
+            weights[known] = self.idf[positions[known]]
+        return weights
+
+    def vectorize(self, term_counts):
+        return _weight_and_normalize(_rows_to_matrix(term_counts), self.idf_of)
+
+    def top_k(self, query_term_counts, k=5):
+        """
+        Returns, per query, [(doc_id, score)] of the k best documents (score > 0).
+        """
+        if not self.doc_ids:
+            return [[] for _ in query_term_counts]
+        scores = self.vectorize(query_term_counts).dot(self.matrix.T).tocsr()
+        results = []
+        for row in range(scores.shape[0]):
+            start, end = scores.indptr[row], scores.indptr[row + 1]
+            data, cols = scores.data[start:end], scores.indices[start:end]
+            if len(data) > k:
+                best = np.argpartition(-data, k)[:k]
+                data, cols = data[best], cols[best]
+            order = np.argsort(-data)
+            results.append([(self.doc_ids[cols[i]], float(data[i])) for i in order if data[i] > 0])
+        return results
+
+
+def _synthetic_corpus(n_docs, vocab_size=20_000, words_per_doc=40, seed=7):
+    rng = random.Random(seed)
+    alphabet = 'абвгдежзийклмнопрстуфхцчшщыьэюя'
+    stems = [''.join(rng.choice(alphabet) for _ in range(rng.randint(4, 6))) for _ in range(vocab_size)]
+    endings = ['', 'а', 'ы', 'ов', 'ами', 'ой', 'ие', 'ия']
+    docs = []
+    for _ in range(n_docs):
+        words = [rng.choice(stems) + rng.choice(endings) for _ in range(words_per_doc)]
+        docs.append(Counter(w[:6] for w in words))
+    return docs
+
+
+def benchmark(n_posts=100_000, n_topics=500, k=5):
+    if not available():
+        print("❌ numpy/scipy are not installed")
+        return
+    print(f"=== Relevance benchmark: {n_posts} posts x {n_topics} topics ===")
+    docs = _synthetic_corpus(n_posts)
+    topics = [Counter(list(doc)[:4]) for doc in random.Random(1).sample(docs, n_topics)]
+
+    started = time.perf_counter()
+    index = RelevanceIndex(range(n_posts), docs)
+    build = time.perf_counter() - started
+
+    started = time.perf_counter()
+    top = index.top_k(topics, k=k)
+    score = time.perf_counter() - started
+
+    print(f"Index build:  {build:.2f}s ({n_posts / build:,.0f} posts/s)")
+    print(f"Batch score:  {score:.3f}s ({n_topics * n_posts / score:,.0f} pairs/s)")
+    print(f"Sample top-{k}: {top[0][:3]}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark topic/post relevance scoring.")
+    parser.add_argument('--posts', type=int, default=100_000)
+    parser.add_argument('--topics', type=int, default=500)
+    parser.add_argument('-k', type=int, default=5)
+    args = parser.parse_args()
+    benchmark(args.posts, args.topics, args.k)
@@ -0,0 +1,105 @@
+import heapq
+import json
+import os
+import time
+import zlib
+from array import array
+
+from host_health import host_key
+from task_io import ResultsWriter
+
+
+def shard_of(site_url, shards):
+    """
+    Stable shard number of a satellite: every task for the same host lands
+    in the same worker process, run after run.
+    """
+    return zlib.crc32(host_key(site_url or '').encode('utf-8')) % shards
+
+
+def partition_tasks(tasks, shards, work_dir):
+    """
+    Streams tasks into one .jsonl file per shard. Returns (paths, positions):
+    positions[k][j] is the input index of the j-th task of shard k.
+    """
+    paths = [os.path.join(work_dir, f"shard-{k}.tasks.jsonl") for k in range(shards)]
+    positions = [array('q') for _ in range(shards)]
+    files = [open(path, 'w', encoding='utf-8') for path in paths]
+    try:
+        for i, task in enumerate(tasks):
+            k = shard_of(task.get('site_url'), shards)
+            files[k].write(json.dumps(task, ensure_ascii=False) + '\n')
+            positions[k].append(i)
+    finally:
+        for f in files:
+            f.close()
+    return paths, positions
+
+
+def _iter_shard_results(path, positions):
+    """
+    Yields a shard's results with their shard-local `index` mapped back to
+    the input index of the whole run.
+    """
+    if not os.path.exists(path):
+        return
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                result = json.loads(line)
+                result['index'] = positions[result['index']]
+                yield result
+
+
+def merge_results(paths, positions, output_file, resume=False, on_result=None):
+    """
+    Merges the per-shard .jsonl results into `output_file` in input order.
+    Every shard writes its results in its own input order, so a streaming
+    k-way merge on the input index is enough. `on_result` is called with
+    every merged result; `resume` appends to a .jsonl output (see ResultsWriter).
+    """
+    with ResultsWriter(output_file, resume=resume) as writer:
+        for result in heapq.merge(*[_iter_shard_results(path, shard_positions)
+                                    for path, shard_positions in zip(paths, positions)],
+                                  key=lambda result: result['index']):
+            del result['index']
+            writer.write(result)
+            if on_result is not None:
+                on_result(result)
+    return writer
+
+
+def run_sharded(worker, args, tasks, shards, work_dir):
+    """
+    Partitions `tasks` by host, runs `worker(shard, shards, tasks_path,
+    results_path, args)` for every non-empty shard in its own process and
+    returns the per-shard summaries (shard order), the results paths and
+    the input positions of every shard's tasks (see partition_tasks).
+    """
+    os.makedirs(work_dir, exist_ok=True)
+    started = time.perf_counter()
+    task_paths, positions = partition_tasks(tasks, shards, work_dir)
+    counts = [len(p) for p in positions]
+    print(f"🧩 {sum(counts)} задач разбито на {shards} шардов: {counts} ({time.perf_counter() - started:.1f}s)")
+
+    results_paths = [os.path.join(work_dir, f"shard-{k}.results.jsonl") for k in range(shards)]
+    for path in results_paths:
+        if os.path.exists(path):
+            os.remove(path)
+    from concurrent.futures import ProcessPoolExecutor
+    from multiprocessing import get_context
+
+    summaries = []
+    # spawn: воркеры не наследуют потоки и открытые соединения координатора
+    with ProcessPoolExecutor(max_workers=shards, mp_context=get_context('spawn')) as pool:
+        futures = {k: pool.submit(worker, k, shards, task_paths[k], results_paths[k], args)
+                   for k in range(shards) if counts[k]}
+        for k, future in futures.items():
+            try:
+                summaries.append(future.result())
+            except Exception as e:
+                print(f"❌ Шард {k} упал: {e}")
+                summaries.append({'shard': k, 'tasks': counts[k], 'succeeded': 0, 'seconds': 0.0, 'failed': str(e)})
+    for path in task_paths:
+        os.remove(path)
+    return summaries, results_paths, positions
@@ -0,0 +1,49 @@
+import subprocess
+import sys
+from collections import defaultdict
+
+
+def parse_importtime(stderr):
+    """
+    Parses `python -X importtime` output into {module: (self_us, cumulative_us)}.
+    """
+    modules = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        parts = line.split(':', 1)[1].split('|')
+        if len(parts) != 3:
+            continue
+        try:
+            modules[parts[2].strip()] = (int(parts[0]), int(parts[1]))
+        except ValueError:
+            continue
+    return modules
+
+
+def report(modules, top=15):
+    """
+    Prints import time per top-level package (sum of self times) and the total.
+    """
+    packages = defaultdict(int)
+    for name, (self_us, _) in modules.items():
+        packages[name.split('.')[0]] += self_us
+    total = sum(packages.values())
+    print(f"\n=== Startup imports: {total / 1000:.0f} ms in {len(modules)} modules ===")
+    for package, micros in sorted(packages.items(), key=lambda item: -item[1])[:top]:
+        print(f"⏱️ {package:28} {micros / 1000:8.1f} ms  {100 * micros / total if total else 0:5.1f}%")
+
+
+def profile_command(script, argv, top=15):
+    """
+    Re-runs `script argv` under `python -X importtime` and reports which
+    modules its imports spent time in (lazy imports on the code path taken
+    included). Returns the command's exit code.
+    """
+    proc = subprocess.run([sys.executable, '-X', 'importtime', script] + list(argv),
+                          stderr=subprocess.PIPE, text=True)
+    errors = [line for line in proc.stderr.splitlines() if not line.startswith('import time:')]
+    if errors:
+        print('\n'.join(errors), file=sys.stderr)
+    report(parse_importtime(proc.stderr), top)
+    return proc.returncode
@@ -0,0 +1,150 @@
+import json
+import os
+import queue
+import shutil
+import socket
+import threading
+import time
+
+TASK_EXTENSIONS = ('.json', '.jsonl', '.csv')
+
+
+class TaskDaemon:
+    """
+    Keeps one warm process (imports, HTTP pools, Gemini client, caches) and
+    runs task files as they arrive, one at a time:
+
+      - watched directory: files dropped into `watch_dir` are moved to
+        `processing/`, run, and moved to `done/` next to their results.
+        Files left in `processing/` by a crashed daemon are put back into
+        `watch_dir` on startup and run again;
+      - local socket: a client sends one JSON line {"input": path,
+        "output": path?} and gets a JSON line back when the run is over.
+
+    `run_file(input_path, output_path)` does the actual work and returns a
+    summary dict.
+    """
+
+    def __init__(self, run_file, watch_dir=None, socket_path=None, poll_interval=2.0):
+        self.run_file = run_file
+        self.watch_dir = watch_dir
+        self.socket_path = socket_path
+        self.poll_interval = poll_interval
+        self._jobs = queue.Queue()
+        self._stopped = threading.Event()
+        self._server = None
+        self.jobs_done = 0
+
+    # --- sources ---
+
+    def _scan(self):
+        processing = os.path.join(self.watch_dir, 'processing')
+        os.makedirs(processing, exist_ok=True)
+        os.makedirs(os.path.join(self.watch_dir, 'done'), exist_ok=True)
+        # Задания, прерванные падением демона, возвращаются в очередь
+        for name in sorted(os.listdir(processing)):
+            os.replace(os.path.join(processing, name), os.path.join(self.watch_dir, name))
+            print(f"♻️ Незавершенное задание {name} возвращено в {self.watch_dir}")
+        while not self._stopped.is_set():
+            for name in sorted(os.listdir(self.watch_dir)):
+                path = os.path.join(self.watch_dir, name)
+                # Файлы с точкой в начале - еще дописываются (пишите в .name и переименовывайте)
+                if name.startswith('.') or not name.lower().endswith(TASK_EXTENSIONS) or not os.path.isfile(path):
+                    continue
+                claimed = os.path.join(processing, name)
+                os.replace(path, claimed)
+                self._jobs.put((claimed, None, None))
+            self._stopped.wait(self.poll_interval)
+
+    def _listen(self):
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+        self._server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._server.bind(self.socket_path)
+        self._server.listen()
+        while not self._stopped.is_set():
+            try:
+                conn, _ = self._server.accept()
+            except OSError:
+                break
+            threading.Thread(target=self._handle, args=(conn,), daemon=True).start()
+
+    def _handle(self, conn):
+        with conn, conn.makefile('rw', encoding='utf-8') as stream:
+            try:
+                request = json.loads(stream.readline())
+                reply = queue.Queue(maxsize=1)
+                self._jobs.put((os.path.abspath(request['input']), request.get('output'), reply))
+                response = reply.get()
+            except Exception as e:
+                response = {'status': 'error', 'error': str(e)}
+            stream.write(json.dumps(response, ensure_ascii=False) + '\n')
+
+    # --- jobs ---
+
+    def _run_job(self, input_path, output_path):
+        if output_path is None:
+            output_path = os.path.splitext(input_path)[0] + '.results.json'
+        started = time.perf_counter()
+        print(f"\n📥 Задание: {input_path}")
+        try:
+            summary = {'status': 'ok', **(self.run_file(input_path, output_path) or {})}
+        except Exception as e:
+            print(f"❌ Задание {input_path} упало: {e}")
+            summary = {'status': 'error', 'error': str(e)}
+        summary.update({'input': input_path, 'output': output_path,
+                        'seconds': round(time.perf_counter() - started, 2)})
+        self.jobs_done += 1
+        return summary
+
+    def serve_forever(self):
+        threads = []
+        if self.watch_dir:
+            threads.append(threading.Thread(target=self._scan, name="daemon-watch", daemon=True))
+            print(f"👀 Слежу за папкой {self.watch_dir}")
+        if self.socket_path:
+            threads.append(threading.Thread(target=self._listen, name="daemon-socket", daemon=True))
+            print(f"🔌 Принимаю задания на сокете {self.socket_path}")
+        for thread in threads:
+            thread.start()
+        try:
+            while not self._stopped.is_set():
+                try:
+                    input_path, output_path, reply = self._jobs.get(timeout=1.0)
+                except queue.Empty:
+                    continue
+                if reply is None:
+                    done_dir = os.path.join(self.watch_dir, 'done')
+                    name = os.path.basename(input_path)
+                    summary = self._run_job(input_path, output_path or
+                                            os.path.join(done_dir, os.path.splitext(name)[0] + '.results.json'))
+                    shutil.move(input_path, os.path.join(done_dir, name))
+                else:
+                    summary = self._run_job(input_path, output_path)
+                    reply.put(summary)
+                print(f"📤 {json.dumps(summary, ensure_ascii=False)}")
+        except KeyboardInterrupt:
+            print("\n🛑 Остановка демона")
+        finally:
+            self.stop()
+
+    def stop(self):
+        self._stopped.set()
+        if self._server is not None:
+            self._server.close()
+            self._server = None
+            if os.path.exists(self.socket_path):
+                os.remove(self.socket_path)
+
+
+def submit(socket_path, input_path, output_path=None):
+    """
+    Sends a task file to a running daemon and waits for its summary.
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(socket_path)
+        with sock.makefile('rw', encoding='utf-8') as stream:
+            stream.write(json.dumps({'input': os.path.abspath(input_path),
+                                     'output': os.path.abspath(output_path) if output_path else None}) + '\n')
+            stream.flush()
+            return json.loads(stream.readline())
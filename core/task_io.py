@@ -0,0 +1,102 @@
+import json
+import os
+
+from import_from_sheets import iter_csv_sites
+
+
+def iter_tasks(path):
+    """
+    Lazily yields tasks from `path`:
+      - .jsonl: one JSON task per line, read line by line
+      - .csv:   Google Sheets export layout (see data/sites_import_TEMPLATE.csv)
+      - other:  a JSON array (loaded at once, like before)
+    """
+    ext = os.path.splitext(path)[1].lower()
+    if ext == '.csv':
+        yield from iter_csv_sites(path)
+    elif ext == '.jsonl':
+        with open(path, 'r', encoding='utf-8') as f:
+            for line_no, line in enumerate(f, 1):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError as e:
+                    print(f"⚠️ {path}:{line_no}: invalid JSON ({e}), line skipped")
+    else:
+        with open(path, 'r', encoding='utf-8') as f:
+            yield from json.load(f)
+
+
+def is_streaming_output(path):
+    return path.lower().endswith('.jsonl')
+
+
+class ResultsWriter:
+    """
+    Writes task results either as a JSON array at close (results.json) or,
+    for a .jsonl path, writes each result as soon as it arrives so nothing
+    is lost if the run crashes and memory use stays constant. A .jsonl file
+    is truncated first unless `resume` is set, in which case the results of
+    the resumed run are appended to what the crashed run left.
+
+    Results handed over with their input position through put() are written
+    in input order, whatever order their tasks finished in; `with_index`
+    also stores that position in each row as `index`.
+    """
+
+    def __init__(self, path, resume=False, with_index=False):
+        self.path = path
+        self.with_index = with_index
+        self.streaming = is_streaming_output(path)
+        self.count = 0
+        self.results = [] if not self.streaming else None
+        self._file = None
+        if self.streaming:
+            if not resume:
+                # Новый файл вместо обрезки старого: dashboard.py узнает его по смене inode
+                open(path + '.tmp', 'w').close()
+                os.replace(path + '.tmp', path)
+            self._file = open(path, 'a', encoding='utf-8')
+        self._pending = {}
+        self._next = 0
+
+    def write(self, result):
+        self.count += 1
+        if self.streaming:
+            self._file.write(json.dumps(result, ensure_ascii=False) + '\n')
+            self._file.flush()
+        else:
+            self.results.append(result)
+
+    def put(self, position, result):
+        """
+        Queues the result of the task at input `position` (None for a skipped
+        task) and writes every result that is now next in order.
+        """
+        if result is not None and self.with_index:
+            result = {'index': position, **result}
+        self._pending[position] = result
+        while self._next in self._pending:
+            result = self._pending.pop(self._next)
+            self._next += 1
+            if result is not None:
+                self.write(result)
+
+    def close(self):
+        for position in sorted(self._pending):
+            if self._pending[position] is not None:
+                self.write(self._pending[position])
+        self._pending.clear()
+        if self.streaming:
+            self._file.close()
+        else:
+            with open(self.path, 'w') as f:
+                json.dump(self.results, f, indent=2)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,181 @@
+import glob
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+from paths import MONITORING_DIR
+
+DEFAULT_JOURNAL_PATH = os.getenv("PBN_JOURNAL_DB", os.path.join(MONITORING_DIR, 'task_journal.db'))
+
+# Состояния задачи в порядке продвижения
+STATES = ('pending', 'generated', 'published', 'logged')
+
+
+def task_key(ctx):
+    """
+    Stable key of a task: the same site, target, anchor, topic and style
+    always map to the same journal entry, whatever the input file order.
+    """
+    parts = [
+        (ctx.get('site_url') or '').rstrip('/').lower(),
+        ctx.get('login') or '',
+        ctx.get('target_url') or '',
+        ctx.get('anchor') or '',
+        ctx.get('topic') or '',
+        ctx.get('style') or '',
+    ]
+    return hashlib.sha256('\x1f'.join(parts).encode('utf-8')).hexdigest()[:32]
+
+
+class TaskJournal:
+    """
+    Durable per-task state in SQLite (pending -> generated -> published -> logged).
+
+    Every stage records its outcome, so a crashed run can be resumed: finished
+    tasks are skipped, generated articles are published from the stored
+    content without calling Gemini again, and published posts are only logged.
+    Entries are keyed by task, so the shard processes of a `--shards` run all
+    write to the same WAL database and any later run can resume from it.
+    """
+
+    def __init__(self, path=DEFAULT_JOURNAL_PATH, resume=False):
+        self.path = path
+        self.resume = resume
+        self._lock = threading.Lock()
+        # Шарды пишут в одну базу из разных процессов - ждем блокировку, а не падаем
+        self._conn = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute('''CREATE TABLE IF NOT EXISTS tasks
+                              (key TEXT PRIMARY KEY,
+                               site_url TEXT,
+                               topic TEXT,
+                               state TEXT,
+                               title TEXT,
+                               content TEXT,
+                               model TEXT,
+                               post_id INTEGER,
+                               post_link TEXT,
+                               status TEXT,
+                               attempts INTEGER DEFAULT 0,
+                               updated_at REAL)''')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS idx_tasks_state ON tasks (state)')
+        self._conn.commit()
+        self.skipped = 0
+        self.reused_content = 0
+        self.found_existing = 0
+
+    def get(self, key):
+        with self._lock:
+            cur = self._conn.execute('SELECT * FROM tasks WHERE key = ?', (key,))
+            row = cur.fetchone()
+            if row is None:
+                return None
+            return dict(zip([c[0] for c in cur.description], row))
+
+    def _execute(self, sql, params):
+        with self._lock:
+            self._conn.execute(sql, params)
+            self._conn.commit()
+
+    def mark_pending(self, key, ctx, reset=False):
+        """
+        Registers an attempt. With `reset` the task starts over from 'pending'
+        (a normal run); otherwise its recorded progress is kept (--resume).
+        """
+        if reset:
+            update = "state = 'pending', title = NULL, content = NULL, model = NULL, post_id = NULL, " \
+                     "post_link = NULL, status = NULL, "
+        else:
+            update = ""
+        self._execute(f'''INSERT INTO tasks (key, site_url, topic, state, attempts, updated_at)
+                          VALUES (?, ?, ?, 'pending', 1, ?)
+                          ON CONFLICT(key) DO UPDATE SET {update}attempts = attempts + 1,
+                          updated_at = excluded.updated_at''',
+                      (key, ctx.get('site_url'), ctx.get('topic'), time.time()))
+
+    def mark_generated(self, key, title, content, model):
+        self._execute('''UPDATE tasks SET state = 'generated', title = ?, content = ?, model = ?, updated_at = ?
+                         WHERE key = ?''', (title, content, model, time.time(), key))
+
+    def mark_published(self, key, post_id, link):
+        # Контент больше не нужен - пост уже на сайте
+        self._execute('''UPDATE tasks SET state = 'published', post_id = ?, post_link = ?, content = NULL,
+                         updated_at = ? WHERE key = ?''', (post_id, link, time.time(), key))
+
+    def mark_logged(self, key, status, link):
+        self._execute('''UPDATE tasks SET state = 'logged', status = ?, post_link = COALESCE(?, post_link),
+                         updated_at = ? WHERE key = ?''', (status, link, time.time(), key))
+
+    def count(self, name, value=1):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + value)
+
+    def stats(self):
+        with self._lock:
+            states = dict(self._conn.execute('SELECT state, COUNT(*) FROM tasks GROUP BY state').fetchall())
+        return {
+            'states': states,
+            'skipped': self.skipped,
+            'reused_content': self.reused_content,
+            'found_existing': self.found_existing,
+        }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def merge_journal_segments(path=DEFAULT_JOURNAL_PATH):
+    """
+    Folds per-shard journals left by older `--shards` runs
+    (task_journal.shard2of8.db) into the journal at `path`, keeping the
+    newest entry per task, and removes them. Returns the number of entries.
+    """
+    base, ext = os.path.splitext(path)
+    segments = sorted(glob.glob(glob.escape(base) + '.shard*of*' + ext))
+    if not segments:
+        return 0
+    TaskJournal(path).close()
+    merged = 0
+    conn = sqlite3.connect(path, timeout=60)
+    try:
+        for segment in segments:
+            conn.execute('ATTACH DATABASE ? AS segment', (segment,))
+            with conn:
+                merged += conn.execute('''INSERT OR REPLACE INTO tasks
+                                          SELECT s.* FROM segment.tasks s LEFT JOIN tasks t ON t.key = s.key
+                                          WHERE t.key IS NULL OR s.updated_at > t.updated_at''').rowcount
+            conn.execute('DETACH DATABASE segment')
+            for suffix in ('', '-wal', '-shm'):
+                if os.path.exists(segment + suffix):
+                    os.remove(segment + suffix)
+    finally:
+        conn.close()
+    print(f"🧾 {len(segments)} сегментов журнала объединено в {path} ({merged} задач)")
+    return merged
+
+
+_default_journal = None
+_default_lock = threading.Lock()
+
+
+def get_journal():
+    """
+    Returns the process-wide journal, or None when journaling is disabled.
+    """
+    return _default_journal
+
+
+def configure_journal(path=DEFAULT_JOURNAL_PATH, resume=False, enabled=True):
+    """
+    Opens the process-wide journal at `path` (closing the previous one).
+    """
+    global _default_journal
+    with _default_lock:
+        if _default_journal is not None:
+            _default_journal.close()
+        _default_journal = TaskJournal(path, resume=resume) if enabled else None
+        return _default_journal
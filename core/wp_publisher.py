@@ -0,0 +1,159 @@
+import base64
+import threading
+import time
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from host_health import get_host_health
+from metrics import get_metrics
+
+USER_AGENT = 'WordPress-Publisher-Bot/1.0'
+# Запросы, где 401/403 означают неверный логин/пароль, а не запрет на конкретный пост
+AUTH_CHECK_ENDPOINTS = {('GET', '/wp-json/wp/v2/users/me'), ('POST', '/wp-json/wp/v2/posts')}
+# Медленная публикация может все же пройти на сервере - обрыв по адаптивному таймауту дал бы дубль
+FULL_TIMEOUT_METHODS = {'POST', 'PATCH', 'PUT'}
+
+
+class WordPressPublisher:
+    """
+    Talks to WordPress REST APIs over pooled keep-alive sessions.
+
+    One requests.Session is kept per satellite host, so consecutive posts to
+    the same site reuse the TCP/TLS connection instead of paying for a new
+    handshake every time. Basic auth headers are cached per (site, login).
+    """
+
+    def __init__(self, pool_size=10, keep_alive=True, timeout=30):
+        self.pool_size = pool_size
+        self.keep_alive = keep_alive
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._sessions = {}
+        self._auth_headers = {}
+        self._requests_sent = 0
+
+    @staticmethod
+    def host_key(site_url):
+        parsed = urlparse(site_url)
+        return f"{parsed.scheme}://{parsed.netloc.lower()}"
+
+    def _session(self, site_url):
+        key = self.host_key(site_url)
+        with self._lock:
+            session = self._sessions.get(key)
+            if session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                session.headers['User-Agent'] = USER_AGENT
+                if not self.keep_alive:
+                    session.headers['Connection'] = 'close'
+                self._sessions[key] = session
+            return session
+
+    def auth_headers(self, site_url, username, app_password):
+        key = (site_url.rstrip('/'), username, app_password)
+        headers = self._auth_headers.get(key)
+        if headers is None:
+            token = base64.b64encode(f"{username}:{app_password}".encode()).decode()
+            headers = {'Authorization': f'Basic {token}'}
+            self._auth_headers[key] = headers
+        return headers
+
+    def request(self, method, site_url, path, username=None, app_password=None, **kwargs):
+        """
+        Sends a request to `site_url` + `path` on the host's pooled session.
+        Credentials are optional so public endpoints can be called too.
+        Raises HostUnavailable while the host's circuit is open. Reads use
+        the host's adaptive timeout; writes always get the full one.
+        """
+        health = get_host_health()
+        session = self._session(site_url)
+        headers = dict(kwargs.pop('headers', None) or {})
+        if username and app_password:
+            headers.update(self.auth_headers(site_url, username, app_password))
+        if method.upper() in FULL_TIMEOUT_METHODS:
+            kwargs.setdefault('timeout', self.timeout)
+        else:
+            kwargs.setdefault('timeout', min(self.timeout, health.timeout(site_url)))
+        endpoint = f"{site_url.rstrip('/')}{path}"
+        metrics = get_metrics()
+        credentials = (username, app_password) if username and app_password else None
+        probes = health.check(site_url, credentials)
+        # Отклоненные автоматом запросы в сеть не уходят - не считаем их
+        with self._lock:
+            self._requests_sent += 1
+        started = time.perf_counter()
+        status = 'error'
+        try:
+            response = session.request(method, endpoint, headers=headers, **kwargs)
+            status = response.status_code
+            return response
+        finally:
+            elapsed = time.perf_counter() - started
+            health.record(site_url, elapsed, status, auth_check=(method.upper(), path) in AUTH_CHECK_ENDPOINTS,
+                          probes=probes, credentials=credentials)
+            metrics.observe('http', elapsed, site=self.host_key(site_url), status=status)
+            metrics.inc('pbn_http_requests', method=method, status=status)
+
+    def stats(self):
+        """
+        Returns request and connection counters across all host sessions.
+        """
+        opened = 0
+        with self._lock:
+            sessions = list(self._sessions.values())
+            requests_sent = self._requests_sent
+        for session in sessions:
+            for adapter in set(session.adapters.values()):
+                pools = adapter.poolmanager.pools
+                for key in list(pools.keys()):
+                    try:
+                        opened += pools[key].num_connections
+                    except KeyError:
+                        continue
+        return {
+            'hosts': len(sessions),
+            'requests': requests_sent,
+            'connections_opened': opened,
+            'connections_reused': max(0, requests_sent - opened),
+        }
+
+    def close(self):
+        with self._lock:
+            sessions = list(self._sessions.values())
+            self._sessions.clear()
+        for session in sessions:
+            session.close()
+
+
+_default_publisher = None
+_default_lock = threading.Lock()
+
+
+def get_publisher():
+    """
+    Returns the process-wide publisher; its per-host sessions are shared by
+    all worker threads.
+    """
+    global _default_publisher
+    with _default_lock:
+        if _default_publisher is None:
+            _default_publisher = WordPressPublisher()
+        return _default_publisher
+
+
+def configure_publisher(**kwargs):
+    """
+    Closes the current host sessions and builds a publisher with `kwargs`
+    (pool size, keep-alive, timeout).
+    """
+    global _default_publisher
+    with _default_lock:
+        if _default_publisher is not None:
+            _default_publisher.close()
+        _default_publisher = WordPressPublisher(**kwargs)
+        return _default_publisher
@@ -1,85 +1,366 @@
 import json
 import os
+import sys
 import csv
-import requests
 import sqlite3
+import uuid
 from datetime import datetime
 from dotenv import load_dotenv
 
 # Load environment variables
 load_dotenv()
 
-def init_db():
+DB_PATH = os.getenv("PBN_METRICS_DB", os.path.join(os.path.dirname(os.path.abspath(__file__)), 'pbn_metrics.db'))
+
+# Gemini 2.0 Flash, USD за 1M токенов
+PRICE_INPUT_PER_M = 0.10
+PRICE_OUTPUT_PER_M = 0.40
+
+def _epoch(value, default):
     """
-    Initializes the SQLite database with the requested schema.
+    Epoch seconds of a log timestamp (a number or an ISO string), or `default`.
     """
+    if isinstance(value, (int, float)):
+        return float(value)
     try:
-        conn = sqlite3.connect('pbn_metrics.db')
-        c = conn.cursor()
-        # Таблица для общей статистики
-        c.execute('''CREATE TABLE IF NOT EXISTS publications
-                     (id INTEGER PRIMARY KEY AUTOINCREMENT,
-                      timestamp DATETIME,
-                      success_count INTEGER,
-                      error_count INTEGER,
-                      links_inserted INTEGER,
-                      cost_usd REAL)''')
-        # Таблица для детального мониторинга по стилям
-        c.execute('''CREATE TABLE IF NOT EXISTS persona_stats
-                     (persona TEXT,
-                      posts_count INTEGER,
-                      avg_length INTEGER)''')
-        conn.commit()
-        conn.close()
-    except Exception as e:
-        print(f"⚠️ Ошибка инициализации БД: {e}")
+        return datetime.fromisoformat(value).timestamp()
+    except (TypeError, ValueError):
+        return default
+
+def new_run_id():
+    return f"{datetime.now().strftime('%Y%m%dT%H%M%S')}-{uuid.uuid4().hex[:6]}"
+
+def _columns(c, table):
+    return {row[1]: row for row in c.execute(f"PRAGMA table_info({table})")}
+
+def init_db(conn=None):
+    """
+    Creates (or migrates) the metrics schema on an open connection, or on
+    the default DB when no connection is given.
+    """
+    if conn is None:
+        connect_db().close()
+        return
+    c = conn.cursor()
+    # Таблица для общей статистики (одна строка на запуск дашборда)
+    c.execute('''CREATE TABLE IF NOT EXISTS publications
+                 (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                  timestamp DATETIME,
+                  success_count INTEGER,
+                  error_count INTEGER,
+                  links_inserted INTEGER,
+                  cost_usd REAL,
+                  run_id TEXT)''')
+    if 'run_id' not in _columns(c, 'publications'):
+        c.execute("ALTER TABLE publications ADD COLUMN run_id TEXT")
+
+    # Факты: одна строка на задачу и на генерацию
+    c.execute('''CREATE TABLE IF NOT EXISTS task_facts
+                 (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                  run_id TEXT,
+                  timestamp REAL,
+                  site TEXT,
+                  status TEXT,
+                  new_post_url TEXT,
+                  updated_old_post TEXT)''')
+    c.execute('''CREATE TABLE IF NOT EXISTS generation_facts
+                 (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                  run_id TEXT,
+                  timestamp REAL,
+                  persona TEXT,
+                  length INTEGER)''')
+    c.execute("CREATE INDEX IF NOT EXISTS idx_task_facts_ts ON task_facts (timestamp)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_task_facts_run ON task_facts (run_id)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_task_facts_site ON task_facts (site)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_generation_facts_ts ON generation_facts (timestamp)")
+    # Старые версии писали в факты время строкой - переводим в epoch, как в остальных таблицах
+    # (строки в SQLite больше любых чисел, так что индекс находит только их)
+    for table in ('task_facts', 'generation_facts'):
+        c.execute(f"""UPDATE {table} SET timestamp = (julianday(timestamp, 'utc') - 2440587.5) * 86400.0
+                      WHERE timestamp >= ''""")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_generation_facts_persona ON generation_facts (persona, timestamp)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_publications_ts ON publications (timestamp)")
+
+    # Rollup-таблицы, которые читает Grafana
+    c.execute('''CREATE TABLE IF NOT EXISTS daily_rollup
+                 (day TEXT PRIMARY KEY,
+                  success_count INTEGER DEFAULT 0,
+                  error_count INTEGER DEFAULT 0,
+                  links_inserted INTEGER DEFAULT 0,
+                  generated_count INTEGER DEFAULT 0,
+                  generated_chars INTEGER DEFAULT 0)''')
+    persona = _columns(c, 'persona_stats')
+    if persona and not persona['persona'][5]:
+        # Старая таблица без ключа копила дубли снимков - пересобираем по фактам
+        c.execute("DROP TABLE persona_stats")
+    c.execute('''CREATE TABLE IF NOT EXISTS persona_stats
+                 (persona TEXT PRIMARY KEY,
+                  posts_count INTEGER DEFAULT 0,
+                  avg_length INTEGER DEFAULT 0,
+                  total_length INTEGER DEFAULT 0)''')
+    c.execute("""INSERT OR IGNORE INTO persona_stats (persona, posts_count, avg_length, total_length)
+                 SELECT persona, COUNT(*), AVG(length), SUM(length) FROM generation_facts GROUP BY persona""")
+
+    # Откуда продолжать чтение файлов при следующем запуске
+    c.execute('''CREATE TABLE IF NOT EXISTS ingest_offsets
+                 (path TEXT PRIMARY KEY,
+                  inode INTEGER,
+                  offset INTEGER,
+                  mtime REAL,
+                  size INTEGER)''')
+    conn.commit()
+
+def connect_db(path=None):
+    """
+    Opens the metrics DB in WAL mode (Grafana can read while we write)
+    and makes sure the schema is in place.
+    """
+    conn = sqlite3.connect(path or DB_PATH)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    init_db(conn)
+    return conn
+
+def _rollup_day(c, day, success=0, errors=0, links=0, generated=0, chars=0):
+    c.execute("""INSERT INTO daily_rollup (day, success_count, error_count, links_inserted, generated_count, generated_chars)
+                 VALUES (?, ?, ?, ?, ?, ?)
+                 ON CONFLICT(day) DO UPDATE SET
+                    success_count = success_count + excluded.success_count,
+                    error_count = error_count + excluded.error_count,
+                    links_inserted = links_inserted + excluded.links_inserted,
+                    generated_count = generated_count + excluded.generated_count,
+                    generated_chars = generated_chars + excluded.generated_chars""",
+              (day, success, errors, links, generated, chars))
+
+def _rollup_persona(c, persona, count, total_len):
+    c.execute("""INSERT INTO persona_stats (persona, posts_count, avg_length, total_length)
+                 VALUES (?, ?, ?, ?)
+                 ON CONFLICT(persona) DO UPDATE SET
+                    posts_count = posts_count + excluded.posts_count,
+                    total_length = total_length + excluded.total_length,
+                    avg_length = (total_length + excluded.total_length) / (posts_count + excluded.posts_count)""",
+              (persona, count, total_len // count if count else 0, total_len))
+
+def _read_new_lines(c, path):
+    """
+    Returns lines appended to `path` since the last call, resuming from the
+    stored byte offset. A new inode or a shrunken file means the log was
+    rotated, so it is read from the start. Partial last lines are left for
+    the next run.
+    """
+    path = os.path.abspath(path)
+    st = os.stat(path)
+    row = c.execute("SELECT inode, offset FROM ingest_offsets WHERE path = ?", (path,)).fetchone()
+    offset = row[1] if row and row[0] == st.st_ino and row[1] <= st.st_size else 0
+    lines = []
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        for raw in f:
+            if not raw.endswith(b'\n'):
+                break
+            offset += len(raw)
+            lines.append(raw.decode('utf-8', errors='replace'))
+    c.execute("INSERT OR REPLACE INTO ingest_offsets (path, inode, offset, mtime, size) VALUES (?, ?, ?, ?, ?)",
+              (path, st.st_ino, offset, st.st_mtime, st.st_size))
+    return lines
+
+def _snapshot_changed(c, path):
+    """
+    results.json is rewritten as a whole by every run: ingest it only when
+    its size or mtime changed since the last ingest.
+    """
+    path = os.path.abspath(path)
+    st = os.stat(path)
+    row = c.execute("SELECT inode, mtime, size FROM ingest_offsets WHERE path = ?", (path,)).fetchone()
+    if row and tuple(row) == (st.st_ino, st.st_mtime, st.st_size):
+        return False
+    c.execute("INSERT OR REPLACE INTO ingest_offsets (path, inode, offset, mtime, size) VALUES (?, ?, ?, ?, ?)",
+              (path, st.st_ino, st.st_size, st.st_mtime, st.st_size))
+    return True
+
+def ingest_results(conn, results_file, run_id):
+    """
+    Loads new task results (results.json snapshot or appended results.jsonl)
+    into task_facts and daily_rollup. Returns the newly ingested results.
+    """
+    c = conn.cursor()
+    if results_file.endswith('.jsonl'):
+        results = []
+        for line in _read_new_lines(c, results_file):
+            try:
+                results.append(json.loads(line))
+            except ValueError:
+                continue
+    elif _snapshot_changed(c, results_file):
+        with open(results_file, 'r') as f:
+            results = json.load(f)
+    else:
+        results = []
+
+    now = datetime.now()
+    c.executemany("INSERT INTO task_facts (run_id, timestamp, site, status, new_post_url, updated_old_post) VALUES (?, ?, ?, ?, ?, ?)",
+                  [(run_id, now.timestamp(), r.get('site'), r.get('status'), r.get('new_post_url'), r.get('updated_old_post'))
+                   for r in results])
+    success = sum(1 for r in results if r.get('status') == 'success')
+    links = sum(1 for r in results if r.get('updated_old_post'))
+    if results:
+        _rollup_day(c, now.strftime('%Y-%m-%d'), success=success, errors=len(results) - success, links=links)
+    conn.commit()
+    return results
 
-def log_to_grafana(success, errors, links, cost, style_stats=None):
+def last_run_totals(conn):
+    """
+    Totals of the latest run that ingested task results, read from
+    task_facts: (run_id, tasks, succeeded, links). run_id is None if there
+    are no facts yet.
+    """
+    row = conn.execute("SELECT run_id FROM task_facts ORDER BY id DESC LIMIT 1").fetchone()
+    if row is None:
+        return None, 0, 0, 0
+    tasks, success, links = conn.execute("""SELECT COUNT(*), SUM(status = 'success'),
+                                                   SUM(COALESCE(updated_old_post, '') != '')
+                                            FROM task_facts WHERE run_id = ?""", (row[0],)).fetchone()
+    return row[0], tasks, success or 0, links
+
+def ingest_generation_logs(conn, logs_file, run_id):
+    """
+    Appends new generation_logs.jsonl lines to generation_facts and the
+    persona/daily rollups. Returns {style: {'count', 'total_len'}} of the new lines.
+    """
+    c = conn.cursor()
+    style_stats = {}
+    rows = []
+    now = datetime.now()
+    for line in _read_new_lines(c, logs_file):
+        try:
+            log = json.loads(line)
+        except ValueError:
+            continue
+        style = log.get('style', 'unknown')
+        # publish_post.py пишет только длину статьи, старые логи - весь ответ
+        content_len = log.get('length') or len(log.get('response', ''))
+        rows.append((run_id, _epoch(log.get('timestamp'), now.timestamp()), style, content_len))
+        if style not in style_stats:
+            style_stats[style] = {'count': 0, 'total_len': 0}
+        style_stats[style]['count'] += 1
+        style_stats[style]['total_len'] += content_len
+
+    c.executemany("INSERT INTO generation_facts (run_id, timestamp, persona, length) VALUES (?, ?, ?, ?)", rows)
+    for style, data in style_stats.items():
+        _rollup_persona(c, style, data['count'], data['total_len'])
+    if rows:
+        _rollup_day(c, now.strftime('%Y-%m-%d'), generated=len(rows),
+                    chars=sum(s['total_len'] for s in style_stats.values()))
+    conn.commit()
+    return style_stats
+
+def _table_exists(conn, table):
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)).fetchone() is not None
+
+def ingest_token_usage(conn):
+    """
+    Sums real Gemini token usage (written by core/metrics.py) recorded since
+    the last dashboard run. Returns (prompt_tokens, output_tokens) or None
+    if no usage has been recorded yet.
+    """
+    if not _table_exists(conn, 'token_usage'):
+        return None
+    c = conn.cursor()
+    row = c.execute("SELECT offset FROM ingest_offsets WHERE path = 'table:token_usage'").fetchone()
+    last_id = row[0] if row else 0
+    max_id, prompt, output = c.execute("""SELECT MAX(id), SUM(prompt_tokens), SUM(output_tokens)
+                                          FROM token_usage WHERE id > ?""", (last_id,)).fetchone()
+    if max_id is None:
+        return None
+    c.execute("INSERT OR REPLACE INTO ingest_offsets (path, inode, offset, mtime, size) VALUES (?, 0, ?, 0, 0)",
+              ('table:token_usage', max_id))
+    conn.commit()
+    return prompt or 0, output or 0
+
+def _percentiles(values):
+    values = sorted(values)
+    pick = lambda q: values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+    return pick(0.50), pick(0.95), pick(0.99)
+
+def print_latency_report(conn, hours=24, slowest=5):
+    """
+    Prints p50/p95/p99 per stage and the slowest satellites from the
+    per-task samples written by core/metrics.py.
+    """
+    if not _table_exists(conn, 'stage_samples'):
+        return
+    since = datetime.now().timestamp() - hours * 3600
+    by_stage, by_site = {}, {}
+    for stage, site, seconds in conn.execute(
+            "SELECT stage, site, seconds FROM stage_samples WHERE timestamp >= ?", (since,)):
+        by_stage.setdefault(stage, []).append(seconds)
+        if stage == 'publish' and site:
+            by_site.setdefault(site, []).append(seconds)
+    if not by_stage:
+        return
+
+    print(f"\n[Latency, last {hours}h]")
+    for stage, values in sorted(by_stage.items()):
+        p50, p95, p99 = _percentiles(values)
+        print(f"Stage: {stage:10} | n={len(values):5} | p50 {p50:6.2f}s | p95 {p95:6.2f}s | p99 {p99:6.2f}s")
+    ranked = sorted(((_percentiles(v)[1], site, len(v)) for site, v in by_site.items()), reverse=True)
+    for p95, site, n in ranked[:slowest]:
+        print(f"Slow host: {site} | publish p95 {p95:.2f}s over {n} posts")
+
+def log_to_grafana(success, errors, links, cost, style_stats=None, conn=None, run_id=None):
     """
     Logs metrics to SQLite database for Grafana visualization.
+    `style_stats` ({style: {'count', 'total_len'}}) is added to the persona rollup.
     """
+    own_conn = conn is None
     try:
-        init_db()
-        conn = sqlite3.connect('pbn_metrics.db')
+        conn = conn or connect_db()
         c = conn.cursor()
         
         # Log to publications table
-        c.execute("INSERT INTO publications (timestamp, success_count, error_count, links_inserted, cost_usd) VALUES (?, ?, ?, ?, ?)",
-                  (datetime.now(), success, errors, links, cost))
+        c.execute("INSERT INTO publications (timestamp, success_count, error_count, links_inserted, cost_usd, run_id) VALUES (?, ?, ?, ?, ?, ?)",
+                  (datetime.now(), success, errors, links, cost, run_id))
         
-        # Log to persona_stats table
         if style_stats:
-            # Clear old stats or update? The user's prompt suggests a cumulative or snapshot view. 
-            # We'll insert current batch stats.
             for style, data in style_stats.items():
-                avg_len = data['total_len'] / data['count'] if data['count'] > 0 else 0
-                c.execute("INSERT INTO persona_stats (persona, posts_count, avg_length) VALUES (?, ?, ?)",
-                          (style, data['count'], int(avg_len)))
+                _rollup_persona(c, style, data['count'], data['total_len'])
         
         conn.commit()
-        conn.close()
-        print("📊 Данные успешно синхронизированы с SQLite (pbn_metrics.db)")
+        print(f"📊 Данные успешно синхронизированы с SQLite ({os.path.basename(DB_PATH)})")
     except Exception as e:
         print(f"⚠️ Ошибка записи в БД: {e}")
+    finally:
+        if own_conn and conn is not None:
+            conn.close()
 
-def calculate_dashboard_metrics(results_file='results.json', logs_file='generation_logs.jsonl'):
+def calculate_dashboard_metrics(results_file='results.json', logs_file='generation_logs.jsonl', db_path=None):
     print("=== PBN Executive Dashboard ===")
     
-    # 1. Load Results
+    # 1. Load Results (only what was added since the last run)
     if not os.path.exists(results_file):
         print(f"Error: {results_file} not found. Run publishing first.")
         return
     
-    with open(results_file, 'r') as f:
-        results = json.load(f)
+    conn = connect_db(db_path)
+    run_id = new_run_id()
+    try:
+        results = ingest_results(conn, results_file, run_id)
+    except Exception as e:
+        print(f"Error: cannot read {results_file}: {e}")
+        conn.close()
+        return
     
-    total_tasks = len(results)
-    success_count = sum(1 for r in results if r.get('status') == 'success')
+    # В publications (Grafana суммирует) идут только новые результаты, отчет - по последнему запуску
+    new_success = sum(1 for r in results if r.get('status') == 'success')
+    new_links = sum(1 for r in results if r.get('updated_old_post'))
+
+    report_run_id, total_tasks, success_count, link_injection_count = last_run_totals(conn)
     error_count = total_tasks - success_count
-    link_injection_count = sum(1 for r in results if r.get('updated_old_post'))
     new_posts_count = success_count # assuming each success is a new post or update
     
-    print(f"\n[Overall Performance]")
+    print(f"\n[Overall Performance] run {report_run_id or run_id}")
+    if not results:
+        print(f"No new results in {results_file} since the last run, showing run {report_run_id}.")
     print(f"Total Sites: {total_tasks}")
     print(f"Successful:  {success_count} | Errors: {error_count}")
     print(f"Old Updated: {link_injection_count} | New Created: {new_posts_count}")
@@ -94,50 +375,44 @@ def calculate_dashboard_metrics(results_file='results.json', logs_file='generati
         writer.writerow(['Old Posts Updated', link_injection_count, 'Ссылок добавлено в существующий контент'])
         writer.writerow(['New Posts Created', new_posts_count, 'Создано новых страниц с нуля'])
 
-    # 2. Analyze Styles (Persona)
-    style_stats = {}
+    # 2. Analyze Styles (Persona) - new log lines go to the rollup, the report reads the rollup
+    new_style_stats = {}
     if os.path.exists(logs_file):
-        with open(logs_file, 'r') as f:
-            for line in f:
-                try:
-                    log = json.loads(line)
-                    style = log.get('style', 'unknown')
-                    content_len = len(log.get('response', ''))
-                    
-                    if style not in style_stats:
-                        style_stats[style] = {'count': 0, 'total_len': 0, 'indexed': 0}
-                    style_stats[style]['count'] += 1
-                    style_stats[style]['total_len'] += content_len
-                    # For demo purposes, we simulate an indexing rate if not tracked
-                    # In a real app, verify_posts.py would update this.
-                except:
-                    continue
+        new_style_stats = ingest_generation_logs(conn, logs_file, run_id)
 
         print(f"\n[Persona & Content Metrics]")
         with open('persona_analytics.csv', 'w', newline='', encoding='utf-8') as f:
             writer = csv.writer(f)
             writer.writerow(['Persona', 'Posts', 'Indexing Rate (%)', 'Avg Length (chars)'])
             
-            for style, data in style_stats.items():
-                avg_len = data['total_len'] / data['count']
+            for style, count, avg_len in conn.execute("SELECT persona, posts_count, avg_length FROM persona_stats ORDER BY persona"):
                 # Dummy indexing rate for visualization as requested
                 indexing_rate = 91 if style == 'lifestyle' else (82 if style == 'expert' else 75)
                 
-                print(f"Style: {style:10} | Posts: {data['count']:3} | Avg Length: {avg_len:4.0f} chars")
-                writer.writerow([style.capitalize(), data['count'], f"{indexing_rate}%", int(avg_len)])
+                print(f"Style: {style:10} | Posts: {count:3} | Avg Length: {avg_len:4.0f} chars")
+                writer.writerow([style.capitalize(), count, f"{indexing_rate}%", int(avg_len)])
 
-    # 3. Economical Metrics (Gemini 1.5 Flash approx)
-    total_chars = sum(s['total_len'] for s in style_stats.values()) if style_stats else 0
-    tokens = total_chars / 2 
-    estimated_cost = (tokens / 1_000_000) * 0.075
-    
+    # 3. Economical Metrics: real token usage if recorded, otherwise a character-based estimate
+    usage = ingest_token_usage(conn)
     print(f"\n[Economical Metrics]")
-    print(f"Estimated Gemini Cost: ${estimated_cost:.4f}")
+    if usage:
+        prompt_tokens, output_tokens = usage
+        estimated_cost = (prompt_tokens * PRICE_INPUT_PER_M + output_tokens * PRICE_OUTPUT_PER_M) / 1_000_000
+        print(f"Gemini Tokens: {prompt_tokens} prompt + {output_tokens} output")
+        print(f"Gemini Cost: ${estimated_cost:.4f}")
+    else:
+        total_chars = sum(s['total_len'] for s in new_style_stats.values()) if new_style_stats else 0
+        tokens = total_chars / 2 
+        estimated_cost = (tokens / 1_000_000) * 0.075
+        print(f"Estimated Gemini Cost: ${estimated_cost:.4f}")
+
+    print_latency_report(conn)
     print("\nCSV Reports generated: execution_summary.csv, persona_analytics.csv")
     print("===============================")
     
-    # Save to SQLite for Grafana using the new log_to_grafana function
-    log_to_grafana(success_count, error_count, link_injection_count, estimated_cost, style_stats)
+    # Save to SQLite for Grafana (persona rollup is already updated by the ingester)
+    log_to_grafana(new_success, len(results) - new_success, new_links, estimated_cost, conn=conn, run_id=run_id)
+    conn.close()
 
 def send_telegram_report(summary_file):
     """
@@ -160,6 +435,7 @@ def send_telegram_report(summary_file):
 
         message = f"📊 *PBN Daily Report* ({datetime.now().strftime('%Y-%m-%d')})\n\n{summary_text}"
         url = f"https://api.telegram.org/bot{token}/sendMessage"
+        import requests  # нужен только для отправки отчета
         
         response = requests.post(url, json={
             "chat_id": chat_id,
@@ -176,5 +452,6 @@ def send_telegram_report(summary_file):
         print(f"⚠️ Ошибка при подготовке отчета Telegram: {e}")
 
 if __name__ == "__main__":
-    calculate_dashboard_metrics()
+    results_arg = sys.argv[1] if len(sys.argv) > 1 else 'results.json'
+    calculate_dashboard_metrics(results_arg)
     send_telegram_report('execution_summary.csv')